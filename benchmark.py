@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import asyncio
+import argparse
+import platform
+import statistics
+import tempfile
+import tracemalloc
+import numpy as np
+
+from time import perf_counter
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from utils.coverage import CoverageSelector, select_coverage_words
+from utils.data import ColumnarSessionDatabase, write_session_database
+from utils.latency import ngram_latency_statistics
+from utils.ngram import NGRAM_SIZES, NgramWordIndex, count_session_ngrams, create_ngrams, get_words_with_ngrams, ngrams_from_session
+from utils.replay import replay_keys
+from utils.srs_compact import CompactSRSDataBase
+from utils.srs import SRSSampler, sample_ngrams_from_srs_database, update_srs_database_with_ngrams
+from utils.synthetic import synthetic_keystrokes, synthetic_session, synthetic_srs_database, synthetic_text, synthetic_words
+
+# Sizes of the synthetic data for each scale.
+SCALES = {
+    "small": {"words": 1_000, "entries": 1_000, "ngrams": 1_000, "text_words": 20},
+    "medium": {"words": 10_000, "entries": 10_000, "ngrams": 10_000, "text_words": 100},
+    "large": {"words": 100_000, "entries": 100_000, "ngrams": 100_000, "text_words": 500},
+}
+
+
+def measure(function: Callable, setup: Optional[Callable] = None, repeats: int = 5) -> Dict[str, float]:
+    """Time repeats calls of function. If setup is passed, its return value is passed to function and it is not timed."""
+    times = []
+    for _ in range(repeats):
+        arguments = setup() if setup is not None else ()
+        start = perf_counter()
+        function(*arguments)
+        times.append(perf_counter() - start)
+
+    return {
+        "repeats": repeats,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+    }
+
+
+def benchmark_on_key(text: str, inputs: str, work_dir: Path, viewport: bool = False) -> None:
+    """Feed inputs through SrsTyperApp.on_key and render the text box after every key, without a terminal. The last character of the text is not typed.
+
+       With viewport, the text box is sized 100x20 and only renders the lines around the cursor.
+    """
+    # imported here, so the other benchmarks do not pay for importing textual
+    from rich.console import Console
+    from textual import events
+    from textual.geometry import Size
+    from main import SrsTyperApp
+    from widgets.box import TextBox, GutterBox, InfoBox
+
+    async def type_inputs() -> None:
+        current_dir = Path.cwd()
+        os.chdir(str(work_dir))
+        try:
+            app = SrsTyperApp(full_text=text)
+            await app.on_load(events.Load(app))
+            app.text = TextBox(app.styled_text, viewport=viewport)
+            app.text._update_size(Size(100, 20))
+            app.gutter = GutterBox()
+            app.info = InfoBox()
+            with open(os.devnull, "w") as null_file:
+                console = Console(file=null_file, width=120)
+                # the last key would shut down the app, which needs a terminal
+                for current_input in inputs[:app.engine.text_length - 1]:
+                    await app.on_key(events.Key(app, current_input))
+                    console.print(app.text.render())
+            app.session_journal.close()
+        finally:
+            os.chdir(str(current_dir))
+
+    asyncio.run(type_inputs())
+
+
+def run_benchmarks(scale: str, repeats: int, seed: int, only: Optional[List[str]] = None) -> List[Dict]:
+    sizes = SCALES[scale]
+    rng = np.random.default_rng(seed)
+
+    words = synthetic_words(sizes["words"], seed=rng)
+    session = synthetic_session(sizes["entries"], words, seed=rng)
+    srs_database = synthetic_srs_database(sizes["ngrams"], words=words, seed=rng)
+    pickled_srs_database = pickle.dumps(srs_database)
+    sampled_ngrams = sample_ngrams_from_srs_database(srs_database, 100, seed=rng)
+    word_index = NgramWordIndex.build(words)
+    coverage_selector = CoverageSelector(word_index)
+
+    work_dir = Path(tempfile.mkdtemp(prefix="srstyper_benchmark_"))
+    pickle_session_path = work_dir / "benchmark_session_database.pkl"
+    columnar_session_path = work_dir / "benchmark_session_database.npz"
+    write_session_database(session, pickle_session_path)
+    columnar_session = ColumnarSessionDatabase.from_session_database(session)
+    write_session_database(columnar_session, columnar_session_path)
+    correct_ngrams, typo_ngrams = ngrams_from_session(columnar_session_path)
+
+    key_text = synthetic_text(words, num_words=sizes["text_words"], seed=rng)
+    key_inputs = "".join(char if rng.random() > 0.05 else "#" for char in key_text)
+    # the keys of key_text, typed at the start of a text of 10 times the length
+    long_text = key_text + " " + synthetic_text(words, num_words=sizes["text_words"] * 10, seed=rng)
+    replay_text = synthetic_text(words, num_words=sizes["entries"] // 5, seed=rng)
+    replay_keystrokes = synthetic_keystrokes(replay_text, seed=rng)
+
+    benchmarks = {
+        "create_ngrams": (lambda: [create_ngrams(entry.word, entry.location_in_word, n=NGRAM_SIZES) for entry in session.entries], None),
+        "ngrams_from_session_pickle": (lambda: ngrams_from_session(pickle_session_path), None),
+        "ngrams_from_session_columnar": (lambda: ngrams_from_session(columnar_session_path), None),
+        "count_session_ngrams": (lambda: count_session_ngrams(columnar_session), None),
+        "ngram_latency_statistics": (lambda: ngram_latency_statistics(columnar_session), None),
+        "get_words_with_ngrams_scan": (lambda: get_words_with_ngrams(sampled_ngrams, words), None),
+        "get_words_with_ngrams_index": (lambda: get_words_with_ngrams(sampled_ngrams, words, word_index=word_index), None),
+        "update_srs_database_with_ngrams": (
+            lambda database: update_srs_database_with_ngrams(database, correct_ngrams, typo_ngrams, session_name="benchmark", seed=seed),
+            lambda: (pickle.loads(pickled_srs_database), ),
+        ),
+        "sample_ngrams_from_srs_database": (lambda: sample_ngrams_from_srs_database(srs_database, 100, seed=seed), None),
+        "select_coverage_words": (lambda: select_coverage_words(srs_database, word_index, 16, seed=seed, selector=coverage_selector), None),
+        "srs_sampler_100_texts": (lambda: SRSSampler(srs_database).sample(100, num_texts=100, seed=seed), None),
+        "on_key": (lambda: benchmark_on_key(key_text, key_inputs, work_dir), None),
+        "on_key_long_text": (lambda: benchmark_on_key(long_text, key_inputs[:-1], work_dir), None),
+        "on_key_long_text_viewport": (lambda: benchmark_on_key(long_text, key_inputs[:-1], work_dir, viewport=True), None),
+        "typing_engine_replay": (lambda: replay_keys(replay_text, replay_keystrokes), None),
+    }
+
+    results = []
+    for name, (function, setup) in benchmarks.items():
+        if only is not None and name not in only:
+            continue
+        result = {"name": name, "scale": scale, **measure(function, setup=setup, repeats=repeats)}
+        if name.startswith("on_key"):
+            result["keys"] = len(key_inputs) - 1
+            result["median_per_key"] = result["median"] / result["keys"]
+        if name == "typing_engine_replay":
+            result["keys"] = len(replay_keystrokes)
+            result["median_per_key"] = result["median"] / result["keys"]
+        results.append(result)
+        print(f"{scale:>6} {name:<36} median {result['median'] * 1000:10.2f} ms")
+
+    shutil.rmtree(str(work_dir))
+
+    return results
+
+
+def measure_srs_memory(num_ngrams: int, seed: int) -> Dict:
+    """Memory and file size of an SRSDataBase and a CompactSRSDataBase with num_ngrams 2- to 5-grams."""
+    srs_database = synthetic_srs_database(num_ngrams, seed=seed, n=(2, 3, 4, 5))
+    pickled_srs_database = pickle.dumps(srs_database)
+    del srs_database
+
+    work_dir = Path(tempfile.mkdtemp(prefix="srstyper_memory_"))
+    compact_path = work_dir / "srs_database.npz"
+
+    # memory of a database is measured as the memory allocated while it is loaded and still alive afterwards
+    tracemalloc.start()
+    srs_database = pickle.loads(pickled_srs_database)
+    srs_database_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    CompactSRSDataBase.from_srs_database(srs_database).save(compact_path)
+    num_stored_ngrams = len(srs_database.ngram_bins)
+    del srs_database
+
+    tracemalloc.start()
+    compact_srs_database = CompactSRSDataBase.load(compact_path)
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    result = {
+        "name": "srs_memory",
+        "ngrams": num_stored_ngrams,
+        "srs_database_bytes": srs_database_bytes,
+        "srs_database_pickle_bytes": len(pickled_srs_database),
+        "compact_bytes": compact_bytes,
+        "compact_array_bytes": compact_srs_database.nbytes(),
+        "compact_file_bytes": compact_path.stat().st_size,
+    }
+    shutil.rmtree(str(work_dir))
+
+    print(f"SRS database with {num_stored_ngrams} ngrams:")
+    print(f"  SRSDataBase        {srs_database_bytes / 2**20:8.1f} MiB in memory, pickle {len(pickled_srs_database) / 2**20:8.1f} MiB")
+    print(f"  CompactSRSDataBase {compact_bytes / 2**20:8.1f} MiB in memory, npz    {result['compact_file_bytes'] / 2**20:8.1f} MiB")
+    return result
+
+
+def compare_results(results: List[Dict], baseline_results: List[Dict], threshold: float) -> List[str]:
+    """Names of all benchmarks whose median is more than threshold times the median of the baseline."""
+    # memory measurements have no timings
+    baseline_medians = {(result["name"], result["scale"]): result["median"] for result in baseline_results if "median" in result}
+    regressions = []
+    for result in results:
+        if "median" not in result:
+            continue
+        baseline_median = baseline_medians.get((result["name"], result["scale"]))
+        if baseline_median is not None and result["median"] > threshold * baseline_median:
+            regressions.append(f"{result['scale']}/{result['name']}: {baseline_median * 1000:.2f} ms -> {result['median'] * 1000:.2f} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ngram, SRS and keystroke hot paths on synthetic data.")
+    parser.add_argument("--scales", nargs="+", choices=SCALES.keys(), default=["small", "medium"])
+    parser.add_argument("--only", nargs="+", default=None, help="Names of the benchmarks to run.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"))
+    parser.add_argument("--srs-memory", type=int, default=None, help="Also measure the memory of the SRS database representations with this many ngrams, e.g. 1000000.")
+    parser.add_argument("--compare", type=Path, default=None, help="Results of an earlier run to check for regressions.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown factor that counts as a regression.")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        results.extend(run_benchmarks(scale, repeats=args.repeats, seed=args.seed, only=args.only))
+    if args.srs_memory is not None:
+        results.append(measure_srs_memory(args.srs_memory, seed=args.seed))
+
+    with open(str(args.output), "w") as output_file:
+        json.dump({
+            "date": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "results": results,
+        }, output_file, indent=2)
+
+    if args.compare is not None:
+        with open(str(args.compare), "r") as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file)["results"], args.threshold)
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,161 @@
+import sys
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Union
+
+from utils.data import write_session_database
+from utils.ngram import ngram_counts_from_session, ngrams_from_session
+from utils.srs import SRSDataBase, sample_ngrams_from_srs_database, update_srs_database_with_ngram_counts, update_srs_database_with_ngrams
+from utils.srs_compact import CompactSRSDataBase
+from utils.srs_sqlite import SQLiteSRSStore
+from utils.synthetic import synthetic_session, synthetic_words
+
+
+def update_with_ngram_lists(
+    srs_database: SRSDataBase,
+    correct_ngrams: List[str],
+    typo_ngrams: List[str],
+    session_name: str,
+    seed: Union[None, int, np.random.Generator] = None,
+) -> None:
+    """The original list-based update, that tests membership in the lists and counts with list.count, one ngram at a time.
+
+       The only change is that it goes through the ngrams in sorted order and draws its random decisions from a numpy Generator,
+       so it consumes the same random numbers as update_srs_database_with_ngram_counts for the same seed.
+    """
+    rng = np.random.default_rng(seed)
+    srs_database.add_session(session_name)
+
+    for ngram in sorted(set(typo_ngrams + correct_ngrams)):
+        ngram_is_in_database, ngram_bin_num = srs_database.find_ngram(ngram)
+
+        # correct
+        if ngram not in typo_ngrams:
+            if ngram_is_in_database:
+                srs_database.move_ngram_up(ngram, current_bin_num=ngram_bin_num)
+
+        # typo
+        elif ngram not in correct_ngrams:
+            if ngram_is_in_database:
+                srs_database.move_ngram_down(ngram, current_bin_num=ngram_bin_num)
+            else:
+                srs_database.add_new_ngram(ngram)
+
+        # both
+        elif ngram_is_in_database:
+            correct_occurrences = correct_ngrams.count(ngram)
+            typo_occurrences = typo_ngrams.count(ngram)
+            if rng.random() < typo_occurrences / (typo_occurrences + correct_occurrences):
+                srs_database.move_ngram_down(ngram, current_bin_num=ngram_bin_num)
+        else:
+            srs_database.add_new_ngram(ngram)
+
+
+def database_state(srs_database) -> Dict:
+    """Bins of all ngrams, number of bins, including empty ones, and sessions of any SRS database backend."""
+    if not isinstance(srs_database, SRSDataBase):
+        srs_database = srs_database.to_srs_database()
+    return {
+        "ngram_bins": dict(srs_database.ngram_bins),
+        "num_bins": srs_database.get_max_bin_num() + 1 if len(srs_database.bins) > 0 else 0,
+        "sessions": list(srs_database.sessions),
+    }
+
+
+def check_equivalence(num_sessions: int, num_entries: int, num_words: int, num_samples: int, seed: int, work_dir: Path) -> List[str]:
+    """Update all update paths and backends with the same seeded synthetic sessions, and compare their databases and samples.
+
+       Returns a description of every mismatch.
+    """
+    rng = np.random.default_rng(seed)
+    words = synthetic_words(num_words, seed=rng)
+
+    databases = {
+        "lists": SRSDataBase(),
+        "update_srs_database_with_ngrams": SRSDataBase(),
+        "update_srs_database_with_ngram_counts": SRSDataBase(),
+        "compact": CompactSRSDataBase(),
+        "sqlite": SQLiteSRSStore(work_dir / "srs_database.sqlite"),
+    }
+    mismatches = []
+
+    def update_all(session_name: str, correct_ngrams: List[str], typo_ngrams: List[str], correct_counts: Counter, typo_counts: Counter) -> None:
+        update_seed = int(rng.integers(2**32))
+        update_with_ngram_lists(databases["lists"], correct_ngrams, typo_ngrams, session_name, seed=update_seed)
+        update_srs_database_with_ngrams(databases["update_srs_database_with_ngrams"], correct_ngrams, typo_ngrams, session_name, seed=update_seed)
+        update_srs_database_with_ngram_counts(databases["update_srs_database_with_ngram_counts"], correct_counts, typo_counts, session_name, seed=update_seed)
+        databases["compact"].update_with_ngram_counts(correct_counts, typo_counts, session_name, seed=update_seed)
+        databases["sqlite"].update_with_ngram_counts(correct_counts, typo_counts, session_name, seed=update_seed)
+
+        reference_state = database_state(databases["lists"])
+        for name, srs_database in databases.items():
+            state = database_state(srs_database)
+            for key in reference_state:
+                if state[key] != reference_state[key]:
+                    mismatches.append(f"{session_name}: {key} of {name} differs from the list-based update")
+
+    def compare_samples(label: str) -> None:
+        reference = databases["update_srs_database_with_ngram_counts"]
+        for sample_seed in range(num_samples):
+            num_ngrams = int(rng.integers(1, 50))
+            expected = sample_ngrams_from_srs_database(reference, num_ngrams, seed=sample_seed)
+            for name in ("compact", "sqlite"):
+                if databases[name].sample_ngrams(num_ngrams, seed=sample_seed) != expected:
+                    mismatches.append(f"{label}: sample with seed {sample_seed} of {name} differs from sample_ngrams_from_srs_database")
+
+    for session_num in range(num_sessions):
+        session_name = f"2000-01-{session_num + 1:02d}_00-00_session_database.npz"
+        # high typo rates, so many ngrams are typed both correctly and with typos and take the random path
+        session = synthetic_session(num_entries, words, typo_rate=float(rng.uniform(0.05, 0.3)), seed=rng, date=session_name[:16])
+        session_path = work_dir / session_name
+        write_session_database(session, session_path)
+
+        correct_ngrams, typo_ngrams = ngrams_from_session(session_path)
+        correct_counts, typo_counts = ngram_counts_from_session(session_path)
+        if correct_counts != Counter(correct_ngrams) or typo_counts != Counter(typo_ngrams):
+            mismatches.append(f"{session_name}: ngram_counts_from_session differs from counting ngrams_from_session")
+
+        update_all(session_name, correct_ngrams, typo_ngrams, correct_counts, typo_counts)
+        compare_samples(session_name)
+
+    # a session with typos in every ngram of the top bin empties it, but the bin still counts for sampling
+    reference_state = database_state(databases["lists"])
+    if reference_state["num_bins"] > 1:
+        top_bin_num = reference_state["num_bins"] - 1
+        typo_ngrams = sorted(ngram for ngram, bin_num in reference_state["ngram_bins"].items() if bin_num == top_bin_num)
+        session_name = "2100-01-01_00-00_session_database.npz"
+        update_all(session_name, [], typo_ngrams, Counter(), Counter(typo_ngrams))
+        compare_samples(f"{session_name} (empty top bin)")
+
+    databases["sqlite"].close()
+
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that the list-based and counter-based SRS updates and all SRS database backends agree on seeded synthetic sessions."
+    )
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--entries", type=int, default=2000, help="Number of keystrokes per session.")
+    parser.add_argument("--words", type=int, default=300, help="Number of words in the synthetic word list.")
+    parser.add_argument("--samples", type=int, default=10, help="Number of samples to compare after every session.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="srstyper_equivalence_"))
+    try:
+        mismatches = check_equivalence(args.sessions, args.entries, args.words, args.samples, args.seed, work_dir)
+    finally:
+        shutil.rmtree(str(work_dir))
+
+    if len(mismatches) > 0:
+        print("\n".join(mismatches))
+        print(f"{len(mismatches)} mismatches.")
+        sys.exit(1)
+    print(f"All update paths and backends agree on {args.sessions} sessions with seed {args.seed}.")
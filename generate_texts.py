@@ -0,0 +1,48 @@
+import argparse
+import numpy as np
+
+from pathlib import Path
+
+from utils.ngram import load_word_index
+from utils.srs import SRSDataBase, SRSSampler, backfill_srs_database, close_srs_database, open_srs_database, srs_database_has_ngrams
+from utils.text import assemble_text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate many practice texts from the SRS database at once, e.g. a week of drills.")
+    parser.add_argument("--num-texts", type=int, default=7)
+    parser.add_argument("--num-words", type=int, default=20, help="Number of words per text.")
+    parser.add_argument("--exploration-percentage", type=float, default=0.2, help="Share of random words that are not chosen for an SRS ngram.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--srs-database", type=str, default="srs_database.pkl", help="Name of the SRS database in data, .sqlite and .npz select the other formats.")
+    parser.add_argument("--output", type=Path, default=None, help="File to write the texts to, one per line. Prints them if not set.")
+    args = parser.parse_args()
+
+    word_file_path = Path("/usr/share/dict/words")
+    data_dir = Path("data")
+
+    rng = np.random.default_rng(args.seed)
+
+    # fold all finished sessions into the SRS database first, like before every practice text
+    backfill_srs_database(data_dir=data_dir, srs_database_name=args.srs_database, progress=None)
+
+    srs_database_path = data_dir / args.srs_database
+    texts_ngrams = [[] for _ in range(args.num_texts)]
+    if srs_database_path.is_file():
+        srs_database = open_srs_database(srs_database_path)
+        # without ngrams, e.g. before the first session, the texts only consist of random words
+        if srs_database_has_ngrams(srs_database):
+            # the sampler needs all bins at once, so the other formats are loaded into an SRSDataBase
+            full_srs_database = srs_database if isinstance(srs_database, SRSDataBase) else srs_database.to_srs_database()
+            num_sampled_ngrams = int(args.num_words*(1-args.exploration_percentage))
+            texts_ngrams = SRSSampler(full_srs_database).sample(num_sampled_ngrams, num_texts=args.num_texts, seed=rng)
+        close_srs_database(srs_database, srs_database_path, write=False)
+
+    word_index = load_word_index(word_file_path, data_dir / "word_index")
+    texts = [assemble_text(text_ngrams, word_index, args.num_words, seed=rng) for text_ngrams in texts_ngrams]
+
+    if args.output is None:
+        print("\n".join(texts))
+    else:
+        with open(str(args.output), "w") as output_file:
+            output_file.write("\n".join(texts) + "\n")
@@ -0,0 +1,108 @@
+import json
+import shutil
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+
+from time import perf_counter
+from pathlib import Path
+
+from utils.ngram import NgramWordIndex
+from utils.profiling import LatencyHistogram
+from utils.server import PracticeServer, ProfilePool
+from utils.synthetic import synthetic_keystrokes, synthetic_words
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, message: dict) -> dict:
+    writer.write((json.dumps(message) + "\n").encode("utf-8"))
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    assert response["ok"], response.get("error")
+    return response
+
+
+async def simulate_typist(
+    host: str,
+    port: int,
+    profile: str,
+    num_sessions: int,
+    batch_size: int,
+    delay: float,
+    seed: int,
+    histograms: dict,
+) -> int:
+    """Type num_sessions texts as the profile and return the number of sent keys. Round trip times are added to histograms."""
+    rng = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    num_keys = 0
+    try:
+        for _ in range(num_sessions):
+            start = perf_counter()
+            text = (await request(reader, writer, {"op": "start", "profile": profile}))["text"]
+            histograms["start"].add(perf_counter() - start)
+
+            keys = [key for key, _ in synthetic_keystrokes(text, seed=rng)]
+            for batch_start in range(0, len(keys), batch_size):
+                start = perf_counter()
+                await request(reader, writer, {"op": "keys", "keys": keys[batch_start:batch_start + batch_size]})
+                histograms["keys"].add(perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            num_keys += len(keys)
+
+            start = perf_counter()
+            await request(reader, writer, {"op": "finish"})
+            histograms["finish"].add(perf_counter() - start)
+    finally:
+        writer.close()
+    return num_keys
+
+
+async def generate_load(args: argparse.Namespace) -> None:
+    server = None
+    root_dir = None
+    if args.port is None:
+        # serve synthetic profiles in this process
+        root_dir = Path(tempfile.mkdtemp(prefix="srstyper_load_"))
+        word_index = NgramWordIndex.build(synthetic_words(10_000, seed=args.seed))
+        profile_pool = ProfilePool(root_dir, word_index, num_storage_threads=args.storage_threads)
+        server = await PracticeServer(profile_pool).start(host=args.host, port=0)
+        port = server.sockets[0].getsockname()[1]
+    else:
+        port = args.port
+
+    histograms = {"start": LatencyHistogram(), "keys": LatencyHistogram(), "finish": LatencyHistogram()}
+    start = perf_counter()
+    key_counts = await asyncio.gather(*(
+        simulate_typist(args.host, port, f"typist{i}", args.sessions, args.batch_size, args.delay, args.seed + i, histograms)
+        for i in range(args.clients)
+    ))
+    duration = perf_counter() - start
+
+    print(f"{args.clients} typists, {args.clients * args.sessions} sessions, {sum(key_counts)} keys in {duration:.2f} s")
+    print(f"{sum(key_counts) / duration:,.0f} keys/s, {args.clients * args.sessions / duration:.1f} sessions/s")
+    print(f"{'request':<8} {'count':>8} {'p50':>9} {'p95':>9} {'p99':>9}  round trip in milliseconds")
+    for name, histogram in histograms.items():
+        print(f"{name:<8} {histogram.count:>8}" + "".join(f" {histogram.percentile(q) * 1000:>9.3f}" for q in (50, 95, 99)))
+
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+        profile_pool.close()
+        shutil.rmtree(str(root_dir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate many concurrent typists against the practice server and measure its throughput.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="Port of a running serve.py. Without it, a server with synthetic words is started in this process.")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=3, help="Texts typed by every client.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Keys sent per request.")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds between the requests of a client, 0 for maximum load.")
+    parser.add_argument("--storage-threads", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(generate_load(args))
@@ -1,26 +1,77 @@
-import pickle
-import numpy as np
-from typing import List
-from time import time
+from time import perf_counter, monotonic
+
+# taken before the remaining imports, to measure the time until the first frame is rendered
+STARTUP_TIME = perf_counter()
+
+import asyncio
+import argparse
+from functools import partial
+from typing import Callable, Optional
 from pathlib import Path
 
 from textual.app import App
 from textual import events
 
 from widgets.box import TextBox, InfoBox, GutterBox
-from utils.data import SessionDatabase, SessionDatabaseEntry, index_text_to_words, read_database
-from utils.srs import update_srs_database_from_latest_session, sample_ngrams_from_srs_database
-from utils.ngram import get_words_with_ngrams
+from widgets.scheduler import FrameScheduler
+from widgets.styled_text import StyledText
+from utils.data import SessionDatabase
+from utils.engine import TypingEngine
+from utils.text import prepare_practice_text, update_practice_history, update_practice_history_in_background
+from utils.journal import SessionJournal, JOURNAL_SUFFIX
+from utils.replay import write_key_log, KEY_LOG_SUFFIX
+from utils.profiling import KeystrokeInstrumentation
 
 
 class SrsTyperApp(App):
     """Terminal application for personalized typing practice based on the Spaced Repetition Sysem (SRS)."""
 
-    def __init__(self, full_text: str, **kwargs):
-
-        # Raw text that is to be typed in the session.
-        self.full_text = full_text
-        self.text_length = len(full_text)
+    def __init__(
+        self,
+        full_text: str,
+        startup_time: Optional[float] = None,
+        startup_target: float = 0.5,
+        instrument: bool = False,
+        profile: bool = False,
+        text_generator: Optional[Callable[..., str]] = None,
+        key_log: bool = False,
+        viewport: bool = False,
+        history_updater: Optional[Callable[..., object]] = None,
+        **kwargs,
+    ):
+
+        # Raw text that is to be typed in the first round of the session.
+        self.initial_text = full_text
+
+        # Whether to write the raw keys of every round into a key log, to regenerate the session database with replay.py
+        self.key_log = key_log
+
+        # Whether the text box only renders the lines around the cursor, for long texts
+        self.viewport = viewport
+
+        # Picklable function that updates the SRS database and returns the text of the next round, called with exclude=[journal of the running round].
+        # If it is passed, the session continues with a new round after every finished text, instead of exiting.
+        self.text_generator = text_generator
+        # Single worker process that prepares the next text while the current one is typed, and the future of its result
+        self.text_executor = None
+        self.next_text = None
+
+        # Picklable function that folds the finished sessions into the SRS database, called with exclude=[journal of the running round].
+        # It runs in the worker process, so the first frame does not wait for it, e.g. for a backfill of many sessions. Continuous sessions do it with every text instead.
+        self.history_updater = history_updater
+        self.history_update = None
+
+        # perf_counter() at the start of the process, and the time in seconds the first frame should be rendered in.
+        self.startup_time = startup_time
+        self.startup_target = startup_target
+
+        # Opt-in timing of the stages of on_key and cProfile capture of the session
+        self.instrumentation = KeystrokeInstrumentation(enabled=instrument, profile=profile)
+        # monotonic() time stamp of the last key event, that has not been rendered yet
+        self.unrendered_key_time: Optional[float] = None
+
+        # Coalesces the refreshes of the widgets into frames, created when the widgets are mounted
+        self.scheduler: Optional[FrameScheduler] = None
 
         super().__init__(**kwargs)
 
@@ -32,42 +83,76 @@ class SrsTyperApp(App):
         if not self.data_dir.is_dir():
             self.data_dir.mkdir()
 
-        # Words of the text and indices to map the current location in the text to a word.
-        # Both are used to save the word in which typos occur.
-        self.word_list, self.word_indices = index_text_to_words(self.full_text)
+        # Rich styles for rendering
+        self.correct_style = "bold green"
+        self.current_style = "black on white"
+        self.incorrect_style = "bold red"
 
-        # Text on the left side of the curser (already typed), with formatting for rich rendering
-        self.formatted_input = ""
-        # Full text, with formatting for rich rendering
-        self.formatted_text = ""
+        self.start_round(self.initial_text)
 
-        # Left and right tags for rich rendering
-        self.correct_style = ["[bold green]", "[/bold green]"]
-        self.current_style = ["[black on white]", "[/black on white]"]
-        self.incorrect_style = ["[bold red]", "[/bold red]"]
+        if self.text_generator is not None or self.history_updater is not None:
+            # imported here, because only continuous sessions and background updates need a worker process
+            from concurrent.futures import ProcessPoolExecutor
+            self.text_executor = ProcessPoolExecutor(max_workers=1)
+            if self.text_generator is not None:
+                self.prepare_next_text()
+            else:
+                self.history_update = self.text_executor.submit(self.history_updater, exclude=[self.session_journal.journal_path])
 
-        # Current location in the full text
-        self.current_location = 0
+        await self.bind("escape", "quit", "Quit")
 
-        # The formatted text will contain information about rendering like [bold green].
-        # To correctly remove characters from the formatted text, we have to remember where in the string a new text character starts.
-        # To delete more than one character in sequence, we keep a list of these locations, and pop off from the end.
-        self.delete_locations = []
+    def start_round(self, full_text: str) -> None:
+        """Reset the text, the styles, the counters and the session database, and open a new journal for a round of typing full_text."""
 
-        # A class for storing information about what was typed in which context
-        self.session_database = SessionDatabase()
+        session_database = SessionDatabase()
 
-        # Counters to calculate the accuracy
-        self.hits = 0
-        self.misses = 0
+        # Journal that writes the entries to disk while typing, so a crash does not lose the session
+        self.session_journal = SessionJournal(
+            self.data_dir / f"{session_database.date}{JOURNAL_SUFFIX}",
+            date=session_database.date,
+        )
 
-        await self.bind("escape", "quit", "Quit")
+        # Typing state of the round: location in the text, counters and the recorded entries, which are journaled as well
+        self.engine = TypingEngine(
+            full_text,
+            session_database=session_database,
+            on_entry=self.session_journal.append,
+            record_keys=self.key_log,
+        )
+
+        # Full text with the styles of the already typed characters and the curser
+        self.styled_text = StyledText(full_text, cursor_style=self.current_style)
+
+    def close_round(self) -> None:
+        """Close the journal of the round and write its key log."""
+        # the journal is converted into a session database before the next update of the SRS database
+        self.session_journal.close()
+        if self.engine.keys is not None:
+            session_date = self.engine.session_database.date
+            write_key_log(self.data_dir / f"{session_date}{KEY_LOG_SUFFIX}", self.engine.full_text, self.engine.keys, session_date)
+
+    def prepare_next_text(self) -> None:
+        """Start generating the text of the next round in the worker process, without the running round."""
+        self.next_text = self.text_executor.submit(self.text_generator, exclude=[self.session_journal.journal_path])
+
+    async def next_round(self) -> None:
+        """Finish the current round and continue with the prepared text, without restarting the app."""
+        # closing the journal lets the worker fold this round into the SRS database, while the user types the next one
+        self.close_round()
+
+        # usually the text is ready long before the round is finished
+        full_text = await asyncio.wrap_future(self.next_text)
+        self.start_round(full_text)
+        self.prepare_next_text()
+
+        await self.text.update(self.styled_text)
+        self.request_info_update()
 
     async def on_mount(self) -> None:
         """Called when application mode is ready."""
 
         self.info = InfoBox()
-        self.text = TextBox(self.full_text)
+        self.text = TextBox(self.styled_text, viewport=self.viewport)
         self.gutter = GutterBox()
         grid = await self.view.dock_grid(edge="left", name="left")
 
@@ -89,167 +174,178 @@ class SrsTyperApp(App):
             gutter_area=self.gutter,
         )
 
+        if self.instrumentation.enabled:
+            self.text.render_callback = self.record_render
+
+        # all widgets are refreshed together, at most once per frame, after all queued keys are handled
+        self.scheduler = FrameScheduler(before_frame=self.prepare_frame)
+        if self.instrumentation.enabled:
+            self.scheduler.frame_callback = self.record_frame
+        for widget in (self.info, self.text, self.gutter):
+            widget.scheduler = self.scheduler
+
     async def on_key(self, event: events.Key) -> None:
         """Called when a key is pressed."""
 
-        current_char = self.full_text[self.current_location]
-        current_input = str(event.key)
+        key_start = self.instrumentation.start()
+
+        stage_start = self.instrumentation.start()
+        result = self.engine.press(str(event.key))
+        self.instrumentation.record("engine", stage_start)
 
-        # handle special characters
-        if current_input == "ctrl+h":
-            # backspace
-            self.current_location = max(self.current_location - 1, 0)
-            try:
-                delete_location = self.delete_locations.pop()
-            except IndexError:
-                delete_location = 0
-            self.formatted_input = self.formatted_input[:delete_location]
+        current_char = result.current_char
+        current_input = result.current_input
 
+        stage_start = self.instrumentation.start()
+        if result.backspace:
+            self.styled_text.pop()
+        elif result.correct:
+            self.styled_text.push(self.correct_style)
         else:
-            self.save_entry(current_input, current_char)
+            if current_char.isspace():
+                # since we cannot color in a space, we replace it with an underscore
+                current_char = "_"
+            self.styled_text.push(self.incorrect_style, character=current_char)
+        self.instrumentation.record("style", stage_start)
+
+        # the widgets are only marked dirty here, they are refreshed together in the next frame, which is timed as "frame"
+        stage_start = self.instrumentation.start()
+        await self.text.update(self.styled_text)
+        self.instrumentation.record("text_mark_dirty", stage_start)
+
+        stage_start = self.instrumentation.start()
+        await self.gutter.update(f"<<{current_char}>>    <<{current_input}>>")
+        self.instrumentation.record("gutter_mark_dirty", stage_start)
+
+        # the values of the info box are only formatted once per frame, in prepare_frame
+        stage_start = self.instrumentation.start()
+        self.request_info_update()
+        self.instrumentation.record("info_mark_dirty", stage_start)
+
+        self.instrumentation.record("on_key", key_start)
+        if self.instrumentation.enabled:
+            self.unrendered_key_time = event.time
 
-            if current_input == current_char:
-                # correct input
-                formatted_char = surround_with_style(self.correct_style,
-                                                     current_char)
-                self.hits += 1
+        if self.engine.finished:
+            if self.text_generator is not None:
+                await self.next_round()
             else:
-                # incorrect input
-                if current_char.isspace():
-                    # since we cannot color in a space, we replace it with an underscore
-                    current_char = "_"
-                formatted_char = surround_with_style(self.incorrect_style,
-                                                     current_char)
-                self.misses += 1
-
-            # new location to jump to, when deleting text is the current lenght of the text, before adding the new formatted char
-            self.delete_locations.append(max(len(self.formatted_input), 0))
-            self.formatted_input += formatted_char
-            self.current_location += 1
-
-        self.formatted_text = self.assemble_formatted_text()
-
-        await self.text.update(self.formatted_text)
-        await self.gutter.update(f"<<{current_char}>>    <<{current_input}>>")
-        await self.info.update(
-            accuracy=self.get_accuracy(),
-            speed=self.get_speed(),
-            progress=self.get_progress(),
+                await self.exit()
+
+    def request_info_update(self) -> None:
+        if self.scheduler is None:
+            self.prepare_frame()
+            self.info.refresh()
+        else:
+            self.scheduler.mark_dirty(self.info)
+
+    def prepare_frame(self) -> None:
+        """Format the rolling speed and accuracy and the progress for the info box, once per frame."""
+        metrics = self.engine.metrics
+        now = self.engine.clock()
+        self.info.set_values(
+            accuracy=f"{metrics.accuracy(now):.1f}%",
+            speed=f"{int(metrics.speed(now))} cpm",
+            progress=self.engine.get_progress(),
         )
 
-        if self.current_location >= self.text_length:
-            await self.exit()
+    def record_frame(self, start: float, end: float) -> None:
+        """Record the time of a frame, from formatting the info box to refreshing all dirty widgets."""
+        self.instrumentation.record("frame", start, end)
+
+    def record_render(self, start: float, end: float) -> None:
+        """Record the time to render the text, and the latency from the last key event to its rendered text."""
+        self.instrumentation.record("render", start, end)
+        if self.unrendered_key_time is not None:
+            # key events are time stamped with monotonic()
+            self.instrumentation.record("input_to_render", self.unrendered_key_time, monotonic())
+            self.unrendered_key_time = None
+
+    def dump_instrumentation(self) -> None:
+        """Write the latency report and the profile of the session into the data directory."""
+        self.instrumentation.dump(
+            self.data_dir / f"{self.engine.session_database.date}_latency_report.txt",
+            profile_path=self.data_dir / f"{self.engine.session_database.date}_profile.prof",
+        )
 
-    def assemble_formatted_text(self) -> str:
-        """Return a renderable string based on the previous input and the remaining text."""
-        try:
-            return self.formatted_input \
-                   + surround_with_style(self.current_style, self.full_text[self.current_location]) \
-                   + self.full_text[self.current_location + 1:]
-        except IndexError:
-            return self.formatted_input
+    def report_startup_time(self) -> None:
+        """Append the time from the start of the process to the first rendered frame to data/startup_times.txt."""
+        if self.startup_time is None or self.text.first_render_time is None:
+            return
 
-    def save_entry(
-        self,
-        current_input: str,
-        current_char: str,
-    ) -> None:
-        """Save information about what as put in, what was expected, the current word, the characters location in the word, and a time stamp."""
-
-        current_word_index = self.word_indices[self.current_location]
-        current_search_location = self.current_location
-
-        while self.word_indices[current_search_location] == current_word_index:
-            current_search_location -= 1
-
-        location_in_word = self.current_location - current_search_location - 1
-
-        self.session_database.entries.append(
-            SessionDatabaseEntry(
-                input=current_input,
-                text=current_char,
-                correct=current_input == current_char,
-                word=self.word_list[current_word_index],
-                location_in_word=location_in_word,
-                time=time(),
-            ))
-
-    def get_progress(self) -> str:
-        """Percentage of typed text."""
-        return f"{(self.current_location/self.text_length)*100:.1f}%"
-
-    def get_accuracy(self) -> str:
-        """Percentage of hits in typed text."""
-        try:
-            return f"{(self.hits/(self.hits+self.misses))*100:.1f}%"
-        except ZeroDivisionError:
-            return "100%"
-
-    def get_speed(self) -> str:
-        """Characters per minute since start."""
-        try:
-            start = self.session_database.entries[0].time
-            return f"{int(self.current_location/(time() - start)*60)} cpm"
-        except IndexError:
-            return "0 cpm"
+        time_to_first_frame = self.text.first_render_time - self.startup_time
+        over_target = "  over target" if time_to_first_frame > self.startup_target else ""
+        with open(str(self.data_dir / "startup_times.txt"), "a") as startup_file:
+            startup_file.write(f"{self.engine.session_database.date} {time_to_first_frame:.3f}s{over_target}\n")
+
+    def stop_text_executor(self) -> None:
+        """Stop the worker process once its running task is done. Tasks that have not started are cancelled.
+
+           The running task, a background update of the history or the text of a round that will not be typed, is waited for,
+           since both may be writing the SRS database, and the interpreter joins the worker process on exit anyway.
+        """
+        if self.text_executor is not None:
+            self.text_executor.shutdown(wait=True, cancel_futures=True)
+            self.text_executor = None
 
     async def exit(self) -> None:
         """What to do on exit."""
-        database_save_path = self.data_dir / f"{self.session_database.date}_session_database.pkl"
-        with open(str(database_save_path), "wb") as output_file:
-            pickle.dump(self.session_database, output_file)
+        self.close_round()
+        self.report_startup_time()
+        self.dump_instrumentation()
+        self.stop_text_executor()
+        if self.scheduler is not None:
+            self.scheduler.cancel()
         await self.shutdown()
 
     async def action_quit(self) -> None:
         """What to do on quit."""
-        database_save_path = self.data_dir / f"{self.session_database.date}_session_database.pkl"
-        with open(str(database_save_path), "wb") as output_file:
-            pickle.dump(self.session_database, output_file)
+        self.close_round()
+        self.report_startup_time()
+        self.dump_instrumentation()
+        self.stop_text_executor()
+        if self.scheduler is not None:
+            self.scheduler.cancel()
         await self.shutdown()
 
 
-def surround_with_style(style: List[str], text: str) -> str:
-    """Take a text and surround it with a rich text style like [bold red] text [/bold red], stored in a list."""
-    return style[0] + text + style[1]
-
-
 if __name__ == "__main__":
-    num_words_in_text = 20
-    exploration_percentage = 0.2
-    word_file_path = Path("/usr/share/dict/words")
-    data_dir = Path("data")
-    srs_database_name = "srs_database.pkl"
-
-    update_srs_database_from_latest_session(data_dir=data_dir, srs_database_name=srs_database_name)
-    srs_database = read_database(data_dir / srs_database_name)
-
-    sampled_ngrams = sample_ngrams_from_srs_database(srs_database, int(num_words_in_text*(1-exploration_percentage)))
-
-    assert word_file_path.is_file(), f"Cannot find {word_file_path.absolute()}."
-
-    with open(str(word_file_path.absolute()), "r") as word_file:
-        WORDS = word_file.read().splitlines()
-
-    relevant_words = get_words_with_ngrams(sampled_ngrams, WORDS)
-
-    text_words = []
-
-    while len(sampled_ngrams) > 0:
-        ngram = sampled_ngrams.pop()
-        ngram_word_list = [ngram_word for ngram_word in relevant_words if ngram in ngram_word]
-        # if there is no word matching the ngram, add the ngram itself
-        if len(ngram_word_list) == 0:
-            if len(ngram) > 0:
-                text_words.append(ngram)
-        else:
-            word = np.random.choice(ngram_word_list)
-            text_words.append(word)
-
-    num_missing_words = num_words_in_text - len(text_words)
-    if num_missing_words > 0:
-        text_words.extend(np.random.choice(WORDS, size=num_missing_words))
-
-
-    full_text = " ".join(text_words)
-
-    SrsTyperApp.run(full_text=full_text)
+    parser = argparse.ArgumentParser(description="Practice typing with texts generated from your typos.")
+    parser.add_argument("--instrument", action="store_true", help="Time the stages of every keystroke and write a latency report on exit.")
+    parser.add_argument("--profile", action="store_true", help="Capture a cProfile of the session.")
+    parser.add_argument("--key-log", action="store_true", help="Write the raw keys of every text into data, to regenerate the session with replay.py.")
+    parser.add_argument("--corpus", type=Path, default=None, help="Text file to take practice sentences from, instead of single words. Its index is built before the first text and after every change of the file, which takes minutes per gigabyte and prints its progress.")
+    parser.add_argument("--num-words", type=int, default=20, help="Number of words in every text, e.g. 10000 for an endurance drill with --viewport.")
+    parser.add_argument("--viewport", action="store_true", help="Only render the lines of the text around the cursor, for long texts.")
+    parser.add_argument("--coverage", action="store_true", help="Pick the words that cover the most weak ngrams, instead of one random word per sampled ngram.")
+    parser.add_argument("--continuous", action="store_true", help="Continue with a new text after every finished text, until escape is pressed.")
+    args = parser.parse_args()
+
+    # use srs_database_name="srs_database.sqlite" to store the srs database in SQLite, or "srs_database.npz" for the compact format
+    history_arguments = dict(data_dir=Path("data"), srs_database_name="srs_database.pkl")
+    text_generator = partial(
+        prepare_practice_text,
+        **history_arguments,
+        word_file_path=Path("/usr/share/dict/words"),
+        word_index_name="word_index",
+        num_words_in_text=args.num_words,
+        exploration_percentage=0.2,
+        corpus_path=args.corpus,
+        word_selection="coverage" if args.coverage else "random",
+    )
+
+    # the sessions since the last launch, usually only the last one, are folded in before the first text is sampled, so it drills their typos.
+    # folding in one session takes tens of milliseconds, but a backfill of many, e.g. after an import, would delay the first frame and runs in the worker process instead
+    history_is_updated = update_practice_history(**history_arguments, max_sessions=2) is not None
+    full_text = text_generator(update_history=False)
+
+    SrsTyperApp.run(
+        full_text=full_text,
+        startup_time=STARTUP_TIME,
+        instrument=args.instrument,
+        profile=args.profile,
+        text_generator=text_generator if args.continuous else None,
+        key_log=args.key_log,
+        viewport=args.viewport,
+        history_updater=None if history_is_updated else partial(update_practice_history_in_background, **history_arguments),
+    )
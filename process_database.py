@@ -1,13 +1,45 @@
 import pprint
+import argparse
 from pathlib import Path
 from utils.data import read_database
 
-from utils.srs import update_srs_database_from_latest_session
+from utils.srs import update_srs_database_from_latest_session, backfill_srs_database
+from utils.srs_sqlite import import_srs_database_pickle
+from utils.archive import compact_sessions, read_session
+from utils.journal import unprocessed_session_paths
+from utils.latency import word_latency_statistics
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the SRS database with recorded sessions and print it.")
+    parser.add_argument("--backfill", action="store_true", help="Process every session that is not in the SRS database yet, instead of only the latest one.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes that extract ngrams during a backfill.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the random decisions of the update.")
+    parser.add_argument("--import-sqlite", action="store_true", help="Afterwards, copy the SRS database into data/srs_database.sqlite.")
+    parser.add_argument("--slow-words", action="store_true", help="Afterwards, print the words of the latest session that were typed slowly.")
+    parser.add_argument("--compact", action="store_true", help="Afterwards, move processed sessions into data/history_archive.bin.")
+    parser.add_argument("--keep-latest", type=int, default=10, help="Number of the newest sessions that --compact leaves in data.")
+    args = parser.parse_args()
+
     pp = pprint.PrettyPrinter(indent=4)
 
-    update_srs_database_from_latest_session()
+    if args.backfill:
+        backfill_srs_database(seed=args.seed, num_workers=args.workers)
+    else:
+        update_srs_database_from_latest_session(seed=args.seed)
     srs_database = read_database(Path("data") / "srs_database.pkl")
     pp.pprint(srs_database)
+
+    if args.import_sqlite:
+        import_srs_database_pickle(Path("data") / "srs_database.pkl", Path("data") / "srs_database.sqlite").close()
+
+    if args.slow_words:
+        # sessions are sorted by date, also those that were moved into the archive
+        latest_session_path = unprocessed_session_paths(Path("data"))[-1]
+        statistics = word_latency_statistics(read_session(latest_session_path))
+        print(f"Slow words in {latest_session_path.name} (median delay {statistics.baseline * 1000:.0f} ms):")
+        pp.pprint(statistics.slow_keys())
+
+    if args.compact:
+        archived_session_names = compact_sessions(keep_latest=args.keep_latest)
+        print(f"Moved {len(archived_session_names)} sessions into the archive.")
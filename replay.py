@@ -0,0 +1,40 @@
+import argparse
+import numpy as np
+
+from time import perf_counter
+from pathlib import Path
+
+from utils.data import write_session_database
+from utils.journal import DATABASE_SUFFIX
+from utils.replay import KEY_LOG_SUFFIX, read_key_log, replay_keys
+from utils.synthetic import synthetic_keystrokes, synthetic_text, synthetic_words
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay key logs or synthetic keystrokes through the typing engine, without a terminal.")
+    parser.add_argument("key_logs", nargs="*", type=Path, help="Key logs written by main.py --key-log.")
+    parser.add_argument("--output-dir", type=Path, default=None, help="Write the regenerated session databases into this directory.")
+    parser.add_argument("--synthetic-keys", type=int, default=0, help="Additionally, replay about this many synthetic keystrokes.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for key_log_path in args.key_logs:
+        full_text, date, keys = read_key_log(key_log_path)
+        start = perf_counter()
+        engine = replay_keys(full_text, keys, date=date)
+        duration = perf_counter() - start
+        print(f"{key_log_path.name}: {len(keys)} keys in {duration * 1000:.2f} ms, accuracy {engine.get_accuracy()}")
+
+        if args.output_dir is not None:
+            session_name = key_log_path.name[:-len(KEY_LOG_SUFFIX)] + DATABASE_SUFFIX
+            write_session_database(engine.session_database, args.output_dir / session_name)
+
+    if args.synthetic_keys > 0:
+        rng = np.random.default_rng(args.seed)
+        words = synthetic_words(10_000, seed=rng)
+        full_text = synthetic_text(words, num_words=args.synthetic_keys // 7 + 1, seed=rng)
+        keys = synthetic_keystrokes(full_text, seed=rng)
+        start = perf_counter()
+        engine = replay_keys(full_text, keys)
+        duration = perf_counter() - start
+        print(f"synthetic: {len(keys)} keys in {duration * 1000:.2f} ms, {len(keys) / duration:,.0f} keys/s, accuracy {engine.get_accuracy()}")
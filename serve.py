@@ -0,0 +1,39 @@
+import asyncio
+import argparse
+
+from pathlib import Path
+
+from utils.ngram import load_word_index
+from utils.server import PracticeServer, ProfilePool
+
+
+async def serve(args: argparse.Namespace) -> None:
+    # one word index for all profiles, memory-mapped from the cache in the root directory
+    args.root_dir.mkdir(parents=True, exist_ok=True)
+    word_index = load_word_index(args.word_file, args.root_dir / "word_index")
+
+    profile_pool = ProfilePool(args.root_dir, word_index, num_storage_threads=args.storage_threads, num_words_in_text=args.num_words)
+    practice_server = PracticeServer(profile_pool)
+    server = await practice_server.start(host=args.host, port=args.port)
+    print(f"Serving profiles in {args.root_dir} on {args.host}:{args.port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        profile_pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve typing practice for many profiles over a local json lines protocol.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--root-dir", type=Path, default=Path("profiles"), help="Directory with one data directory per profile.")
+    parser.add_argument("--word-file", type=Path, default=Path("/usr/share/dict/words"))
+    parser.add_argument("--num-words", type=int, default=20, help="Number of words in every practice text.")
+    parser.add_argument("--storage-threads", type=int, default=8, help="Threads that read and write the profiles.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
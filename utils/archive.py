@@ -0,0 +1,184 @@
+import io
+import os
+import json
+
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+from utils.data import ColumnarSessionDatabase, SessionDatabase, read_database
+
+# The archive is named without "session", so it is never mistaken for a session in data_dir.
+ARCHIVE_NAME = "history_archive.bin"
+
+
+@dataclass
+class ArchiveEntry:
+    name: str
+    date: str
+    offset: int
+    length: int
+
+
+@dataclass(frozen=True)
+class ArchivedSession:
+    """Picklable reference to a session in an archive, that is read on demand, e.g. in a worker process, like a session file by its Path."""
+    archive_path: Path
+    name: str
+    offset: int
+    length: int
+
+    def read(self) -> ColumnarSessionDatabase:
+        with open(str(self.archive_path), "rb") as archive_file:
+            archive_file.seek(self.offset)
+            return ColumnarSessionDatabase.read(io.BytesIO(archive_file.read(self.length)))
+
+
+def read_session(session: Union[Path, ArchivedSession]) -> Union[SessionDatabase, ColumnarSessionDatabase]:
+    """Read a session file, or a session from an archive."""
+    if isinstance(session, ArchivedSession):
+        return session.read()
+    assert session.is_file(), f"Cannot find {session.absolute()}."
+    return read_database(session)
+
+
+def session_date(session_name: str) -> str:
+    """Date at the start of a session file name, e.g. 2022-05-01_18-30 of 2022-05-01_18-30_session_database.npz."""
+    return session_name.split("_session")[0]
+
+
+class SessionArchive:
+    """Many sessions in a single file, with an index from session name and date to the location of the session in the file.
+
+       Every session is stored in the columnar .npz format, so a single session is read with one seek,
+       without loading the other sessions. The index is a json file next to the archive, with the entries sorted by name and thus by date.
+    """
+
+    def __init__(self, archive_path: Path) -> None:
+        self.archive_path = archive_path
+        self.index_path = archive_path.with_name(archive_path.stem + "_index.json")
+
+        self.entries: List[ArchiveEntry] = []
+        if self.index_path.is_file():
+            with open(str(self.index_path), "r") as index_file:
+                self.entries = [ArchiveEntry(**entry) for entry in json.load(index_file)]
+        self.entry_by_name = {entry.name: entry for entry in self.entries}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, session_name: str) -> bool:
+        return session_name in self.entry_by_name
+
+    def session_names(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[str]:
+        """Names of the sessions from start_date to end_date, both included. Dates can be prefixes, e.g. 2022-05 for all of May 2022."""
+        return [
+            entry.name for entry in self.entries
+            if (start_date is None or entry.date >= start_date) and (end_date is None or entry.date[:len(end_date)] <= end_date)
+        ]
+
+    def session(self, session_name: str) -> ArchivedSession:
+        entry = self.entry_by_name.get(session_name)
+        assert entry is not None, f"Cannot find {session_name} in {self.archive_path}."
+        return ArchivedSession(archive_path=self.archive_path, name=entry.name, offset=entry.offset, length=entry.length)
+
+    def sessions(self) -> List[ArchivedSession]:
+        """References to all sessions, sorted by name and thus by date."""
+        return [self.session(entry.name) for entry in self.entries]
+
+    def read_session(self, session_name: str) -> ColumnarSessionDatabase:
+        return self.session(session_name).read()
+
+    def read_sessions(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Iterator[Tuple[str, ColumnarSessionDatabase]]:
+        """Names and sessions from start_date to end_date, read one at a time."""
+        for session_name in self.session_names(start_date, end_date):
+            yield session_name, self.read_session(session_name)
+
+    def add_sessions(self, session_database_paths: List[Path]) -> List[Path]:
+        """Append the sessions to the archive and return the paths of all sessions that are in the archive now.
+
+           The sessions are synced to disk before the index is replaced, so a crash never leaves an index that points to missing data.
+        """
+        archived_paths = []
+        with open(str(self.archive_path), "ab") as archive_file:
+            for session_database_path in sorted(session_database_paths):
+                archived_paths.append(session_database_path)
+                if session_database_path.name in self:
+                    continue
+
+                if session_database_path.suffix == ".npz":
+                    with open(str(session_database_path), "rb") as session_file:
+                        session_bytes = session_file.read()
+                else:
+                    session_database = read_database(session_database_path)
+                    if isinstance(session_database, SessionDatabase):
+                        session_database = ColumnarSessionDatabase.from_session_database(session_database)
+                    session_buffer = io.BytesIO()
+                    session_database.write(session_buffer)
+                    session_bytes = session_buffer.getvalue()
+
+                entry = ArchiveEntry(
+                    name=session_database_path.name,
+                    date=session_date(session_database_path.name),
+                    offset=archive_file.tell(),
+                    length=len(session_bytes),
+                )
+                archive_file.write(session_bytes)
+                self.entries.append(entry)
+                self.entry_by_name[entry.name] = entry
+
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+
+        self.entries.sort(key=lambda entry: entry.name)
+        temporary_index_path = self.index_path.with_suffix(".tmp")
+        with open(str(temporary_index_path), "w") as index_file:
+            json.dump([asdict(entry) for entry in self.entries], index_file)
+        os.replace(str(temporary_index_path), str(self.index_path))
+
+        return archived_paths
+
+
+def compact_sessions(
+    data_dir: Path = Path("data"),
+    srs_database_name: str = "srs_database.pkl",
+    word_pair_tracker_name: str = "word_pair_tracker.pkl",
+    archive_name: str = ARCHIVE_NAME,
+    keep_latest: int = 10,
+) -> List[str]:
+    """Move all but the keep_latest newest session files of data_dir into the archive, and return their names.
+
+       Only sessions that are already in the SRS database and the word pair tracker are moved, so usually only new sessions are read
+       from data_dir. The backfills read archived sessions as well, e.g. for a new SRS database in another format.
+    """
+    # imported here, because the SRS module reads archived sessions itself
+    from utils.srs import close_srs_database, open_srs_database
+
+    assert data_dir.is_dir()
+
+    srs_database_path = data_dir / srs_database_name
+    srs_database = open_srs_database(srs_database_path)
+    word_pair_tracker_path = data_dir / word_pair_tracker_name
+    word_pair_tracker = read_database(word_pair_tracker_path) if word_pair_tracker_path.is_file() else None
+
+    # session names start with their date, so sorting them sorts them chronologically; journals belong to running or unrecovered sessions
+    session_database_paths = sorted(
+        database_path for database_path in data_dir.iterdir()
+        if "session" in database_path.name and database_path.suffix != ".jsonl"
+    )
+    session_database_paths = session_database_paths[:max(len(session_database_paths) - keep_latest, 0)]
+    session_database_paths = [
+        database_path for database_path in session_database_paths
+        if srs_database.has_session(database_path.name)
+        and (word_pair_tracker is None or word_pair_tracker.has_session(database_path.name))
+    ]
+    close_srs_database(srs_database, srs_database_path, write=False)
+
+    if len(session_database_paths) == 0:
+        return []
+
+    archived_paths = SessionArchive(data_dir / archive_name).add_sessions(session_database_paths)
+    for archived_path in archived_paths:
+        archived_path.unlink()
+
+    return [archived_path.name for archived_path in archived_paths]
@@ -0,0 +1,49 @@
+import json
+import numpy as np
+
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+
+def file_key(file_path: Path) -> Tuple:
+    """Key that changes whenever the file is replaced or modified."""
+    stat = file_path.stat()
+    return str(file_path.absolute()), stat.st_size, stat.st_mtime_ns
+
+
+def cache_key(source_key: Tuple, n: Tuple[int, ...]) -> dict:
+    """Key of an index cache: the source file it was built from and the sizes of its ngrams, as it is stored in json."""
+    return {"source_key": list(source_key), "n": list(n)}
+
+
+def save_arrays(cache_dir: Path, arrays: Dict[str, np.ndarray], key: dict) -> None:
+    """Write the arrays as .npy files into cache_dir. The key is written last, so an interrupted write is never mistaken for a valid cache."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key_path = cache_dir / "key.json"
+    if key_path.is_file():
+        key_path.unlink()
+
+    for name, array in arrays.items():
+        np.save(str(cache_dir / f"{name}.npy"), array)
+
+    with open(str(key_path), "w") as key_file:
+        json.dump(key, key_file)
+
+
+def load_arrays(cache_dir: Path, names: Sequence[str], key: dict) -> Optional[Dict[str, np.ndarray]]:
+    """Memory-map the arrays from cache_dir. Returns None if the cache is missing, incomplete or was written with another key."""
+    try:
+        with open(str(cache_dir / "key.json"), "r") as key_file:
+            if json.load(key_file) != key:
+                return None
+    except (OSError, ValueError):
+        return None
+
+    arrays = {}
+    for name in names:
+        try:
+            arrays[name] = np.load(str(cache_dir / f"{name}.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+    return arrays
@@ -0,0 +1,447 @@
+import re
+import mmap
+import numpy as np
+
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from utils.cache import cache_key, file_key, load_arrays, save_arrays
+from utils.ngram import NGRAM_SIZES, decode_ngram_codes
+
+# A sentence ends with a punctuation mark followed by whitespace, or with an empty line.
+SENTENCE_END_PATTERN = re.compile(rb"[.!?][\"')\]]*\s+|\n\s*\n")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# the characters that WHITESPACE_PATTERN matches, which all have code points below 0x3001
+WHITESPACE_CODE_POINTS = np.array([code_point for code_point in range(0x3001) if chr(code_point).isspace()], dtype=np.uint32)
+
+
+def normalize_sentence(sentence: bytes) -> str:
+    """Sentence as it is typed: decoded, with all line breaks and runs of whitespace replaced by a single space."""
+    return WHITESPACE_PATTERN.sub(" ", sentence.decode("utf-8", errors="replace")).strip()
+
+
+def sentence_ranges(corpus: mmap.mmap) -> Iterator[Tuple[int, int]]:
+    """Start and end of every sentence in the corpus. The punctuation belongs to the sentence, the whitespace after it does not."""
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(corpus):
+        yield start, match.start() + len(match.group().rstrip())
+        start = match.end()
+    if start < len(corpus):
+        yield start, len(corpus)
+
+
+def sentence_ngrams(sentence: str, n: Tuple[int, ...] = NGRAM_SIZES) -> set:
+    """Ngrams of the words of the sentence, which are separated by spaces like in the practice texts."""
+    ngrams = set()
+    for word in sentence.split(" "):
+        for current_n in n:
+            for i in range(len(word) - current_n + 1):
+                ngrams.add(word[i:i + current_n])
+    return ngrams
+
+
+def chunk_sentence_ranges(corpus: mmap.mmap, chunk_size: int) -> Iterator[np.ndarray]:
+    """Start and end of the sentences, see sentence_ranges, as arrays of shape (number of sentences, 2) that span at least chunk_size bytes, except the last one."""
+    ranges = []
+    chunk_start = 0
+    for start, end in sentence_ranges(corpus):
+        ranges.append((start, end))
+        if end - chunk_start >= chunk_size:
+            yield np.array(ranges, dtype=np.int64)
+            ranges = []
+            chunk_start = end
+    if len(ranges) > 0:
+        yield np.array(ranges, dtype=np.int64)
+
+
+def chunk_sentence_ngrams(
+    corpus: mmap.mmap,
+    ranges: np.ndarray,
+    n: Tuple[int, ...],
+    min_words: int,
+    max_length: int,
+    ascii_only: bool,
+    base: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Mask of the sentences of a chunk that are kept, and the integer codes of the ngrams of every kept sentence, together with the number of the sentence among the kept ones.
+
+       Every ngram is listed once per sentence, sorted by code. The code of an ngram has the digits code point + 1 in base, like the codes of session_ngram_ids.
+       Unless ascii_only, the whole chunk is decoded at once, and the byte offsets of its characters map the sentences to their characters.
+       normalize_sentence and sentence_ngrams are never called, but the same sentences are kept and the same ngrams are found.
+    """
+    starts, ends = ranges[:, 0], ranges[:, 1]
+    chunk_start = int(starts[0])
+    chunk = corpus[chunk_start:int(ends[-1])]
+    if ascii_only:
+        # sentences with bytes above 0x7F are skipped, so the bytes of the kept sentences are their characters
+        code_points = np.frombuffer(chunk, dtype=np.uint8)
+        character_starts = starts - chunk_start
+        character_ends = ends - chunk_start
+    else:
+        text = chunk.decode("utf-8", errors="surrogateescape")
+        code_points = np.frombuffer(text.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32)
+        # the surrogateescape decoding keeps invalid bytes as one character each, which normalize_sentence replaces
+        is_invalid = (code_points >= 0xDC80) & (code_points <= 0xDCFF)
+        num_bytes = np.where(is_invalid, 1, 1 + (code_points >= 0x80).astype(np.int64) + (code_points >= 0x800) + (code_points >= 0x10000))
+        code_points = np.where(is_invalid, 0xFFFD, code_points)
+        character_offsets = np.concatenate([[0], np.cumsum(num_bytes)]) + chunk_start
+        character_starts = np.searchsorted(character_offsets, starts)
+        character_ends = np.searchsorted(character_offsets, ends)
+
+    def sentence_sums(mask: np.ndarray) -> np.ndarray:
+        cumulative = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+        return cumulative[character_ends] - cumulative[character_starts]
+
+    # sentences start after whitespace, so words start at characters after whitespace, and normalized sentences have one space between the words
+    is_space = np.isin(code_points, WHITESPACE_CODE_POINTS)
+    num_words = sentence_sums(~is_space & np.concatenate([[True], is_space[:-1]]))
+    lengths = sentence_sums(~is_space) + num_words - 1
+    is_kept = (ends - starts <= 4 * max_length) & (num_words >= min_words) & (lengths <= max_length)
+    if ascii_only:
+        is_kept &= sentence_sums(code_points >= 0x80) == 0
+
+    # number of the kept sentence of every character, and whether it is in that sentence
+    changes = np.zeros(len(code_points) + 1, dtype=np.int8)
+    changes[character_starts[is_kept]] = 1
+    sentence_numbers = np.cumsum(changes, dtype=np.int64) - 1
+    changes[character_ends[is_kept]] -= 1
+    is_in_sentence = np.cumsum(changes, dtype=np.int8) > 0
+
+    # codes over the characters of the chunk are small enough to be sorted together with the sentence numbers as one integer
+    is_in_alphabet = np.bincount(code_points[~is_space], minlength=int(code_points.max(initial=0)) + 1) > 0
+    alphabet = np.flatnonzero(is_in_alphabet)
+    local_ids = np.cumsum(is_in_alphabet)[code_points] * ~is_space
+    local_base = len(alphabet) + 1
+    num_kept = int(np.count_nonzero(is_kept))
+    assert float(local_base)**max(n) * num_kept < 2**63, f"Cannot encode {max(n)}-grams over an alphabet of {len(alphabet)} characters in 64 bit."
+
+    keys = []
+    for current_n in n:
+        num_windows = len(code_points) - current_n + 1
+        if num_windows <= 0:
+            continue
+        # ngrams are within words, so every window without whitespace that starts in a kept sentence also ends in it
+        is_ngram = is_in_sentence[:num_windows].copy()
+        codes = np.zeros(num_windows, dtype=np.int64)
+        for i in range(current_n):
+            is_ngram &= ~is_space[i:i + num_windows]
+            codes *= local_base
+            codes += local_ids[i:i + num_windows]
+        keys.append(codes[is_ngram] * num_kept + sentence_numbers[:num_windows][is_ngram])
+
+    keys = np.concatenate([np.empty(0, dtype=np.int64)] + keys)
+    if len(keys) == 0:
+        return is_kept, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    keys = np.sort(keys)
+    keys = keys[np.diff(keys, prepend=-1) != 0]
+    local_codes, sentence_numbers = np.divmod(keys, num_kept)
+
+    # only the distinct ngrams of the chunk are recoded with the code points as digits
+    is_first = np.diff(local_codes, prepend=-1) != 0
+    remaining = local_codes[is_first]
+    codes = np.zeros(len(remaining), dtype=np.int64)
+    place = 1
+    while np.any(remaining > 0):
+        remaining, local_id = np.divmod(remaining, local_base)
+        codes += np.where(local_id > 0, (alphabet[np.maximum(local_id - 1, 0)].astype(np.int64) + 1) * place, 0)
+        place *= base
+    return is_kept, codes[np.cumsum(is_first) - 1], sentence_numbers
+
+
+def sentence_hash_constants(num_bits: int, seed: int, num_rounds: int = 3) -> List[Tuple[int, int]]:
+    """Random odd multipliers and offsets below 2**num_bits for hash_sentence_ids."""
+    rng = np.random.default_rng(seed)
+    return [(int(rng.integers(1 << num_bits)) | 1, int(rng.integers(1 << num_bits))) for _ in range(num_rounds)]
+
+
+def hash_sentence_ids(sentence_ids: np.ndarray, num_bits: int, constants: List[Tuple[int, int]]) -> np.ndarray:
+    """Permutation of the integers below 2**num_bits, which puts the sentences in random order.
+
+       Every round adds an offset with xor, multiplies with an odd number and mixes the upper half of the bits, which decides the order the most, into the lower half.
+       All steps can be inverted, see unhash_sentence_ids.
+    """
+    mask = np.uint64((1 << num_bits) - 1)
+    shift = np.uint64((num_bits + 1) // 2)
+    hashed = sentence_ids.astype(np.uint64)
+    for multiplier, offset in constants:
+        hashed = ((hashed ^ np.uint64(offset)) * np.uint64(multiplier)) & mask
+        hashed ^= hashed >> shift
+    return hashed.astype(np.int64)
+
+
+def unhash_sentence_ids(hashed: np.ndarray, num_bits: int, constants: List[Tuple[int, int]]) -> np.ndarray:
+    """Inverse of hash_sentence_ids."""
+    mask = np.uint64((1 << num_bits) - 1)
+    shift = np.uint64((num_bits + 1) // 2)
+    sentence_ids = hashed.astype(np.uint64)
+    for multiplier, offset in reversed(constants):
+        sentence_ids ^= sentence_ids >> shift
+        sentence_ids = ((sentence_ids * np.uint64(pow(multiplier, -1, 1 << num_bits))) & mask) ^ np.uint64(offset)
+    return sentence_ids.astype(np.int64)
+
+
+def ngram_hash_offsets(ngram_codes: np.ndarray, num_bits: int) -> np.ndarray:
+    """Offsets below 2**num_bits that are added to the sentence ids with xor before hash_sentence_ids, so every ngram puts the sentences in a different order."""
+    # Fibonacci hashing, the upper bits of the product with 2**64 divided by the golden ratio
+    return ((ngram_codes.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(64 - num_bits)).astype(np.int64)
+
+
+def smallest_keys_per_ngram(key_arrays: List[np.ndarray], num_ngrams: int, num_hash_bits: int, max_sentences_per_ngram: int) -> np.ndarray:
+    """Sorted keys, ngram id << num_hash_bits | hashed sentence id, with the max_sentences_per_ngram smallest keys of every ngram.
+
+       key_arrays is emptied, so the memory of the arrays is freed while their keys are sorted.
+    """
+    keys = np.concatenate([np.empty(0, dtype=np.int64)] + key_arrays)
+    key_arrays.clear()
+    keys.sort()
+
+    # the keys of an ngram are found by binary search, so no other arrays as long as the keys are needed, except for the 8 bit mask
+    ngram_keys = np.arange(num_ngrams + 1, dtype=np.int64) << num_hash_bits
+    starts = np.searchsorted(keys, ngram_keys[:-1])
+    ends = np.searchsorted(keys, ngram_keys[1:])
+    has_keys = ends > starts
+    # +1 where the kept keys of an ngram start and -1 where they end
+    changes = np.zeros(len(keys) + 1, dtype=np.int8)
+    changes[starts[has_keys]] += 1
+    changes[np.minimum(starts + max_sentences_per_ngram, ends)[has_keys]] -= 1
+    return keys[np.cumsum(changes[:-1], dtype=np.int8) > 0]
+
+
+def update_max_keys(max_keys: np.ndarray, sampled_keys: np.ndarray, num_hash_bits: int, max_sentences_per_ngram: int) -> None:
+    """Set max_keys, indexed by ngram id, to the largest sampled key of every ngram with max_sentences_per_ngram sampled keys."""
+    ngram_ids = sampled_keys >> num_hash_bits
+    is_last = np.diff(ngram_ids, append=-1) != 0
+    is_full = np.bincount(ngram_ids, minlength=len(max_keys))[ngram_ids[is_last]] >= max_sentences_per_ngram
+    max_keys[ngram_ids[is_last][is_full]] = sampled_keys[is_last][is_full]
+
+
+def print_indexing_progress(num_bytes: int, total_bytes: int, corpus_name: str) -> None:
+    # one line that is overwritten after every chunk, since a large corpus has thousands of chunks
+    print(f"[{num_bytes / 2**20:.0f}/{total_bytes / 2**20:.0f} MiB] Indexed {corpus_name}", end="\n" if num_bytes == total_bytes else "\r")
+
+
+class CorpusIndex:
+    """Byte ranges of the sentences of a corpus file, and an inverted index from ngrams to the sentences that contain them.
+
+       The ids of the sentences that contain ngrams[i] are sentence_ids[offsets[i]:offsets[i + 1]].
+       To keep the index compact for corpora of many gigabytes, at most max_sentences_per_ngram sentences are kept for every ngram,
+       a uniform sample of all sentences that contain it, so passages of frequent ngrams come from the whole corpus.
+       All arrays are memory-mapped from the cache.
+    """
+
+    array_names = ("sentence_starts", "sentence_ends", "ngrams", "ngram_offsets", "sentence_ids")
+
+    def __init__(
+        self,
+        sentence_starts: np.ndarray,
+        sentence_ends: np.ndarray,
+        ngrams: np.ndarray,
+        ngram_offsets: np.ndarray,
+        sentence_ids: np.ndarray,
+        n: Tuple[int, ...] = NGRAM_SIZES,
+        source_key: Tuple = (),
+    ) -> None:
+        self.sentence_starts = sentence_starts
+        self.sentence_ends = sentence_ends
+        self.ngrams = ngrams
+        self.ngram_offsets = ngram_offsets
+        self.sentence_ids = sentence_ids
+        self.n = n
+        self.source_key = source_key
+
+    @classmethod
+    def build(
+        cls,
+        corpus_path: Path,
+        n: Tuple[int, ...] = NGRAM_SIZES,
+        min_words: int = 4,
+        max_length: int = 300,
+        ascii_only: bool = True,
+        max_sentences_per_ngram: int = 1000,
+        seed: int = 0,
+        chunk_size: int = 2**21,
+        progress: Optional[Callable[[int, int, str], None]] = print_indexing_progress,
+    ) -> "CorpusIndex":
+        """Scan the memory-mapped corpus once, in chunks of about chunk_size bytes. Sentences with fewer than min_words words, longer than max_length characters
+           or, if ascii_only, with characters that are not on a plain keyboard are skipped.
+           seed makes the sampled sentences of frequent ngrams reproducible. progress is called after every chunk, unless it is None.
+        """
+        # only characters below 0x80 are kept with ascii_only, which allows short codes, otherwise a digit is needed for every code point
+        base = 0x80 + 1 if ascii_only else 0x110000 + 1
+        assert float(base)**max(n) < 2**63, f"Cannot encode {max(n)}-grams over an alphabet of {base - 1} characters in 64 bit."
+
+        # every pair of an ngram and a sentence is sorted by the key ngram id << num_hash_bits | hashed sentence id,
+        # and the sentences of an ngram with the smallest keys are a sample in random order, that stays the same as more pairs are added
+        num_hash_bits = max(int(corpus_path.stat().st_size).bit_length(), 1)
+        hash_constants = sentence_hash_constants(num_hash_bits, seed)
+
+        sentence_starts = []
+        sentence_ends = []
+        num_sentences = 0
+        # codes and hash offsets of the ngrams, in the order of their ids, and the codes sorted to look up the ids of the ngrams of a chunk
+        ngram_codes = np.empty(0, dtype=np.int64)
+        hash_offsets = np.empty(0, dtype=np.int64)
+        sorted_codes = np.empty(0, dtype=np.int64)
+        sorted_ids = np.empty(0, dtype=np.int64)
+        # the sampled keys, at most max_sentences_per_ngram per ngram, followed by the new keys of the chunks since the last update of the sample,
+        # and the largest key of the ngrams with max_sentences_per_ngram sampled keys, above which new keys are dropped right away
+        key_arrays = [np.empty(0, dtype=np.int64)]
+        num_new_keys = 0
+        max_keys = np.empty(0, dtype=np.int64)
+
+        with open(str(corpus_path), "rb") as corpus_file, mmap.mmap(corpus_file.fileno(), 0, access=mmap.ACCESS_READ) as corpus:
+            for ranges in chunk_sentence_ranges(corpus, chunk_size):
+                is_kept, codes, sentence_numbers = chunk_sentence_ngrams(corpus, ranges, n, min_words, max_length, ascii_only, base)
+                sentence_starts.append(ranges[is_kept, 0])
+                sentence_ends.append(ranges[is_kept, 1])
+
+                is_first = np.diff(codes, prepend=-1) != 0
+                chunk_codes = codes[is_first]
+                positions = np.searchsorted(sorted_codes, chunk_codes)
+                is_new = positions == len(sorted_codes)
+                is_new[~is_new] = sorted_codes[positions[~is_new]] != chunk_codes[~is_new]
+                chunk_ids = np.empty(len(chunk_codes), dtype=np.int64)
+                chunk_ids[~is_new] = sorted_ids[positions[~is_new]]
+                chunk_ids[is_new] = len(ngram_codes) + np.arange(np.count_nonzero(is_new))
+                if np.any(is_new):
+                    ngram_codes = np.concatenate([ngram_codes, chunk_codes[is_new]])
+                    hash_offsets = np.concatenate([hash_offsets, ngram_hash_offsets(chunk_codes[is_new], num_hash_bits)])
+                    sorted_ids = np.argsort(ngram_codes)
+                    sorted_codes = ngram_codes[sorted_ids]
+                    max_keys = np.concatenate([max_keys, np.full(np.count_nonzero(is_new), np.iinfo(np.int64).max)])
+                assert len(ngram_codes) < 2**(63 - num_hash_bits), f"The corpus {corpus_path} has too many ngrams to be indexed."
+
+                ngram_ids = chunk_ids[np.cumsum(is_first) - 1]
+                keys = (ngram_ids << num_hash_bits) | hash_sentence_ids((sentence_numbers + num_sentences) ^ hash_offsets[ngram_ids], num_hash_bits, hash_constants)
+                keys = keys[keys < max_keys[ngram_ids]]
+                key_arrays.append(keys)
+                num_new_keys += len(keys)
+                num_sentences += int(np.count_nonzero(is_kept))
+
+                # the sample is only updated when there are as many new keys as sampled ones, since every update sorts all of them
+                if num_new_keys >= len(key_arrays[0]):
+                    key_arrays = [smallest_keys_per_ngram(key_arrays, len(ngram_codes), num_hash_bits, max_sentences_per_ngram)]
+                    num_new_keys = 0
+                    update_max_keys(max_keys, key_arrays[0], num_hash_bits, max_sentences_per_ngram)
+
+                if progress is not None:
+                    progress(int(ranges[-1, 1]), len(corpus), corpus_path.name)
+
+        sampled_keys = smallest_keys_per_ngram(key_arrays, len(ngram_codes), num_hash_bits, max_sentences_per_ngram)
+        sampled_ids = sampled_keys >> num_hash_bits
+        sentence_ids = unhash_sentence_ids(sampled_keys & ((1 << num_hash_bits) - 1), num_hash_bits, hash_constants) ^ hash_offsets[sampled_ids]
+
+        # sentence_ids_with_ngram searches the ngrams as strings, whose order is not the one of the ids
+        ngrams = np.array(decode_ngram_codes(ngram_codes, np.arange(base - 1), base), dtype=str)
+        order = np.argsort(ngrams, kind="stable")
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        keys = np.sort((ranks[sampled_ids] << num_hash_bits) | sentence_ids)
+        ngram_offsets = np.zeros(len(ngrams) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys >> num_hash_bits, minlength=len(ngrams)), out=ngram_offsets[1:])
+
+        return cls(
+            sentence_starts=np.concatenate([np.empty(0, dtype=np.int64)] + sentence_starts),
+            sentence_ends=np.concatenate([np.empty(0, dtype=np.int64)] + sentence_ends),
+            ngrams=ngrams[order],
+            ngram_offsets=ngram_offsets,
+            sentence_ids=keys & ((1 << num_hash_bits) - 1),
+            n=n,
+            source_key=file_key(corpus_path),
+        )
+
+    def __len__(self) -> int:
+        return len(self.sentence_starts)
+
+    def sentence_ids_with_ngram(self, ngram: str) -> np.ndarray:
+        position = int(np.searchsorted(self.ngrams, ngram))
+        if position < len(self.ngrams) and self.ngrams[position] == ngram:
+            return self.sentence_ids[self.ngram_offsets[position]:self.ngram_offsets[position + 1]]
+        return np.empty(0, dtype=np.int64)
+
+    def save(self, cache_dir: Path) -> None:
+        """Write all arrays as .npy files into cache_dir, see save_arrays."""
+        save_arrays(cache_dir, {name: getattr(self, name) for name in self.array_names}, key=cache_key(self.source_key, self.n))
+
+    @classmethod
+    def load(cls, cache_dir: Path, source_key: Tuple, n: Tuple[int, ...] = NGRAM_SIZES) -> Optional["CorpusIndex"]:
+        """Memory-map the index from cache_dir. Returns None if the cache is missing or was built from another corpus."""
+        arrays = load_arrays(cache_dir, cls.array_names, key=cache_key(source_key, n))
+        if arrays is None:
+            return None
+
+        return cls(**arrays, n=tuple(n), source_key=tuple(source_key))
+
+
+class CorpusTextSource:
+    """Practice texts made of sentences of a corpus file, which is memory-mapped and never read as a whole."""
+
+    def __init__(self, corpus_path: Path, index: CorpusIndex) -> None:
+        self.corpus_path = corpus_path
+        self.index = index
+        self.corpus_file = open(str(corpus_path), "rb")
+        self.corpus = mmap.mmap(self.corpus_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        self.corpus.close()
+        self.corpus_file.close()
+
+    def sentence(self, sentence_id: int) -> str:
+        return normalize_sentence(self.corpus[int(self.index.sentence_starts[sentence_id]):int(self.index.sentence_ends[sentence_id])])
+
+    def assemble_text(
+        self,
+        sampled_ngrams: List[str],
+        num_words_in_text: int,
+        seed: Union[None, int, np.random.Generator] = None,
+    ) -> str:
+        """Passage of about num_words_in_text words, made of the sentences that contain the most sampled ngrams, ties broken at random.
+
+           Sentences are added until the text is long enough. If no sentence contains any sampled ngram, random sentences are used.
+        """
+        rng = np.random.default_rng(seed)
+        assert len(self.index) > 0, f"The corpus {self.corpus_path} does not contain any usable sentences."
+
+        candidate_ids = [self.index.sentence_ids_with_ngram(ngram) for ngram in set(sampled_ngrams)]
+        candidate_ids = np.concatenate(candidate_ids) if len(candidate_ids) > 0 else np.empty(0, dtype=np.int64)
+        sentence_ids, num_ngrams = np.unique(candidate_ids, return_counts=True)
+        # most sampled ngrams first, in random order within the same number
+        order = np.lexsort((rng.random(size=len(sentence_ids)), -num_ngrams))
+        sentence_ids = sentence_ids[order]
+
+        sentences = []
+        num_words = 0
+        for sentence_id in sentence_ids:
+            if num_words >= num_words_in_text:
+                break
+            sentence = self.sentence(int(sentence_id))
+            sentences.append(sentence)
+            num_words += sentence.count(" ") + 1
+
+        while num_words < num_words_in_text:
+            sentence = self.sentence(int(rng.integers(len(self.index))))
+            sentences.append(sentence)
+            num_words += sentence.count(" ") + 1
+
+        return " ".join(sentences)
+
+
+def load_corpus_source(
+    corpus_path: Path,
+    cache_dir: Path,
+    n: Tuple[int, ...] = NGRAM_SIZES,
+    progress: Optional[Callable[[int, int, str], None]] = print_indexing_progress,
+) -> CorpusTextSource:
+    """Text source for the corpus, with its index memory-mapped from the cache, which is only rebuilt when the corpus changes.
+
+       Building the index reads the whole corpus, see CorpusIndex.build, and progress is called after every chunk of it.
+    """
+    assert corpus_path.is_file(), f"Cannot find {corpus_path.absolute()}."
+    source_key = file_key(corpus_path)
+
+    index = CorpusIndex.load(cache_dir, source_key=source_key, n=n)
+    if index is None:
+        index = CorpusIndex.build(corpus_path, n=n, progress=progress)
+        index.save(cache_dir)
+
+    return CorpusTextSource(corpus_path, index)
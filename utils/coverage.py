@@ -0,0 +1,126 @@
+import numpy as np
+
+from typing import List, Optional, Tuple, Union
+
+from utils.ngram import NgramWordIndex
+from utils.srs import SRSDataBase
+from utils.srs_compact import CompactSRSDataBase
+
+
+def srs_ngram_bins(srs_database) -> Tuple[np.ndarray, np.ndarray]:
+    """Ngrams and their bins of any SRS database backend, as a string array and an integer array."""
+    if isinstance(srs_database, CompactSRSDataBase):
+        return np.char.decode(srs_database.ngrams, "utf-8"), srs_database.bin_nums.astype(np.int64)
+    # the SQLite store reads only the ngram and bin columns, without building the bins and sessions of an SRSDataBase
+    ngram_bins = srs_database.ngram_bins if isinstance(srs_database, SRSDataBase) else srs_database.read_ngram_bins()
+    return np.array(list(ngram_bins.keys()), dtype=str), np.fromiter(ngram_bins.values(), dtype=np.int64, count=len(ngram_bins))
+
+
+class CoverageSelector:
+    """Selects words that together contain as many weak ngrams as possible.
+
+       The inverted index of a NgramWordIndex is the sparse ngram x word incidence matrix of the word list in compressed sparse column form:
+       the column of ngram i holds ones in the rows word_ids[offsets[i]:offsets[i + 1]].
+       Scoring all words against a weight per ngram is one sparse matrix-vector product, that only touches the columns with a weight.
+       Words are then picked greedily: after every pick, the weights of its ngrams are subtracted from the scores of all words that contain them,
+       so the next word always adds close to the most weight that is not covered yet.
+       Create the selector once per word index and reuse it, since it prepares the index for fast products.
+    """
+
+    def __init__(self, word_index: NgramWordIndex) -> None:
+        self.word_index = word_index
+        self.num_words = len(word_index.words)
+        # number of words of every ngram, and the word ids as intp, which np.bincount would otherwise convert in every product
+        self.ngram_lengths = np.diff(word_index.offsets)
+        self.posting_word_ids = np.asarray(word_index.word_ids, dtype=np.intp)
+
+    def ngram_weights(self, ngrams: np.ndarray, bin_nums: np.ndarray, p: float = 0.5) -> np.ndarray:
+        """Weight of every ngram of the index, (1 - p)**bin for ngrams in the SRS database and 0 for all others.
+
+           With the p of sample_ngrams_from_srs_database, every bin weighs as much relative to the next one as it is sampled more often.
+        """
+        weights = np.zeros(len(self.word_index.ngrams), dtype=np.float64)
+        if len(ngrams) == 0 or len(self.word_index.ngrams) == 0:
+            return weights
+        positions = np.searchsorted(self.word_index.ngrams, ngrams)
+        clipped_positions = np.minimum(positions, len(self.word_index.ngrams) - 1)
+        # ngrams of sizes that are not indexed, or that no word contains, cannot be covered
+        is_indexed = self.word_index.ngrams[clipped_positions] == ngrams
+        weights[clipped_positions[is_indexed]] = np.power(1 - p, bin_nums[is_indexed])
+        return weights
+
+    def postings(self, ngram_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Word ids of the columns of ngram_ids, concatenated, and the number of words of every column."""
+        starts = self.word_index.offsets[ngram_ids]
+        lengths = self.word_index.offsets[ngram_ids + 1] - starts
+        # positions in word_ids of all columns, without a python loop over the columns
+        positions = np.arange(int(lengths.sum()), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+        return self.word_index.word_ids[positions], lengths
+
+    def score_words(self, weights: np.ndarray) -> np.ndarray:
+        """Sum of the weights of the ngrams in every word."""
+        ngram_ids = np.flatnonzero(weights)
+        if 2 * int(self.ngram_lengths[ngram_ids].sum()) < len(self.posting_word_ids):
+            word_ids, lengths = self.postings(ngram_ids)
+            return np.bincount(word_ids, weights=np.repeat(weights[ngram_ids], lengths), minlength=self.num_words)
+        # if most columns have a weight, the whole matrix is multiplied, which is cheaper than gathering the columns
+        return np.bincount(self.posting_word_ids, weights=np.repeat(weights, self.ngram_lengths), minlength=self.num_words)
+
+    def word_ngram_ids(self, word: str) -> np.ndarray:
+        """Ids of the indexed ngrams of a word, the row of the word in the incidence matrix."""
+        word_ngrams = np.array(sorted({word[i:i + n] for n in self.word_index.n for i in range(len(word) - n + 1)}), dtype=str)
+        if len(word_ngrams) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.word_index.ngrams, word_ngrams), len(self.word_index.ngrams) - 1)
+        return positions[self.word_index.ngrams[positions] == word_ngrams]
+
+    def select_word_ids(
+        self,
+        weights: np.ndarray,
+        num_words: int,
+        seed: Union[None, int, np.random.Generator] = None,
+        tolerance: float = 0.1,
+    ) -> List[int]:
+        """Greedily pick up to num_words words that maximize the covered weight. Fewer words are returned, when all weight is covered.
+
+           Every word is drawn uniformly from the words that add at least (1 - tolerance) times the most weight,
+           so texts differ between rounds, while every pick stays close to the best one. With tolerance=0, only ties are broken at random.
+        """
+        rng = np.random.default_rng(seed)
+        weights = weights.copy()
+        scores = self.score_words(weights)
+
+        selected_word_ids = []
+        while len(selected_word_ids) < num_words:
+            max_score = scores.max(initial=0.0)
+            if max_score < 1e-6:
+                break
+            word_id = int(rng.choice(np.flatnonzero(scores >= (1 - tolerance) * max_score)))
+            selected_word_ids.append(word_id)
+            scores[word_id] = -np.inf
+
+            # the ngrams of the word are covered now, so they no longer count for any word that contains them
+            ngram_ids = self.word_ngram_ids(self.word_index.words[word_id])
+            ngram_ids = ngram_ids[weights[ngram_ids] > 0]
+            word_ids, lengths = self.postings(ngram_ids)
+            np.subtract.at(scores, word_ids, np.repeat(weights[ngram_ids], lengths))
+            weights[ngram_ids] = 0
+
+        return selected_word_ids
+
+
+def select_coverage_words(
+    srs_database,
+    word_index: NgramWordIndex,
+    num_words: int,
+    p: float = 0.5,
+    seed: Union[None, int, np.random.Generator] = None,
+    selector: Optional[CoverageSelector] = None,
+    tolerance: float = 0.1,
+) -> List[str]:
+    """Words that cover the most weak ngrams of the SRS database, weighted by their bins, see CoverageSelector.select_word_ids."""
+    if selector is None:
+        selector = CoverageSelector(word_index)
+    ngrams, bin_nums = srs_ngram_bins(srs_database)
+    weights = selector.ngram_weights(ngrams, bin_nums, p=p)
+    return [word_index.words[word_id] for word_id in selector.select_word_ids(weights, num_words, seed=seed, tolerance=tolerance)]
@@ -1,7 +1,8 @@
 import pickle
+import numpy as np
 
 from datetime import datetime
-from typing import List, Tuple
+from typing import BinaryIO, List, Tuple, Union
 from dataclasses import dataclass, field
 from pathlib import Path
 
@@ -19,22 +20,165 @@ class SessionDatabaseEntry:
 @dataclass
 class SessionDatabase:
     entries: List[SessionDatabaseEntry] = field(default_factory=list)
-    date: str = datetime.now().strftime("%Y-%m-%d_%H-%M")
+    # every session gets its own time stamp, with seconds, so that consecutive rounds of a session never share a name
+    date: str = field(default_factory=lambda: datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+
+
+@dataclass
+class ColumnarSessionDatabase:
+    """Column-wise storage of a SessionDatabase.
+
+       Every column holds one value per entry. The string columns input, text and word are dictionary-encoded as
+       integer codes into the vocabularies input_values, text_values and word_values.
+    """
+    time: np.ndarray
+    location_in_word: np.ndarray
+    correct: np.ndarray
+    input_codes: np.ndarray
+    text_codes: np.ndarray
+    word_codes: np.ndarray
+    input_values: np.ndarray
+    text_values: np.ndarray
+    word_values: np.ndarray
+    date: str = ""
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    @classmethod
+    def from_session_database(cls, session_database: SessionDatabase) -> "ColumnarSessionDatabase":
+        """Convert the list of entries into columns."""
+        entries = session_database.entries
+        input_values, input_codes = encode_strings([entry.input for entry in entries])
+        text_values, text_codes = encode_strings([entry.text for entry in entries])
+        word_values, word_codes = encode_strings([entry.word for entry in entries])
+
+        return cls(
+            time=np.array([entry.time for entry in entries], dtype=np.float64),
+            location_in_word=np.array([entry.location_in_word for entry in entries], dtype=np.int32),
+            correct=np.array([entry.correct for entry in entries], dtype=bool),
+            input_codes=input_codes,
+            text_codes=text_codes,
+            word_codes=word_codes,
+            input_values=input_values,
+            text_values=text_values,
+            word_values=word_values,
+            date=session_database.date,
+        )
+
+    def to_session_database(self) -> SessionDatabase:
+        """Convert the columns back into a list of entries."""
+        entries = [
+            SessionDatabaseEntry(
+                input=str(self.input_values[input_code]),
+                text=str(self.text_values[text_code]),
+                correct=bool(correct),
+                word=str(self.word_values[word_code]),
+                location_in_word=int(location_in_word),
+                time=float(time),
+            ) for input_code, text_code, correct, word_code, location_in_word, time in zip(
+                self.input_codes,
+                self.text_codes,
+                self.correct,
+                self.word_codes,
+                self.location_in_word,
+                self.time,
+            )
+        ]
+        return SessionDatabase(entries=entries, date=self.date)
+
+    def save(self, database_save_path: Path) -> None:
+        """Write all columns into an uncompressed .npz file that can be loaded without pickle."""
+        with open(str(database_save_path), "wb") as output_file:
+            self.write(output_file)
+
+    def write(self, output_file: BinaryIO) -> None:
+        """Write all columns in the .npz format into an open binary file."""
+        np.savez(
+            output_file,
+            time=self.time,
+            location_in_word=self.location_in_word,
+            correct=self.correct,
+            input_codes=self.input_codes,
+            text_codes=self.text_codes,
+            word_codes=self.word_codes,
+            input_values=self.input_values,
+            text_values=self.text_values,
+            word_values=self.word_values,
+            date=np.array(self.date),
+        )
+
+    @classmethod
+    def load(cls, database_path: Path) -> "ColumnarSessionDatabase":
+        """Read all columns from an .npz file."""
+        with open(str(database_path.absolute()), "rb") as input_file:
+            return cls.read(input_file)
+
+    @classmethod
+    def read(cls, input_file: BinaryIO) -> "ColumnarSessionDatabase":
+        """Read all columns in the .npz format from an open binary file."""
+        with np.load(input_file, allow_pickle=False) as columns:
+            return cls(
+                time=columns["time"],
+                location_in_word=columns["location_in_word"],
+                correct=columns["correct"],
+                input_codes=columns["input_codes"],
+                text_codes=columns["text_codes"],
+                word_codes=columns["word_codes"],
+                input_values=columns["input_values"],
+                text_values=columns["text_values"],
+                word_values=columns["word_values"],
+                date=str(columns["date"]),
+            )
+
+
+def encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Dictionary-encode a list of strings into a vocabulary and an array of codes into the vocabulary."""
+    vocabulary = {}
+    codes = np.array([vocabulary.setdefault(value, len(vocabulary)) for value in values], dtype=np.int32)
+    return np.array(list(vocabulary.keys()), dtype=str), codes
 
 
 def read_database(database_path: Path):
-    """Read and return the database."""
+    """Read and return the database. Sessions in the columnar .npz format are returned as ColumnarSessionDatabase."""
+    if database_path.suffix == ".npz":
+        return ColumnarSessionDatabase.load(database_path)
+
+    if database_path.suffix == ".jsonl":
+        # imported here, because the journal itself depends on this module
+        from utils.journal import read_journal
+        return read_journal(database_path)
+
     with open(str(database_path.absolute()), "rb") as database_file:
         return pickle.load(database_file)
 
 
-def index_text_to_words(text: str) -> Tuple[List[str], List[int]]:
-    """Index each position in the text with its corresponding word (text seperated by spaces)"""
+def write_session_database(
+    session_database: Union[SessionDatabase, ColumnarSessionDatabase],
+    database_save_path: Path,
+) -> None:
+    """Save a session to disk. Paths ending in .npz are written in the columnar format, all others are pickled."""
+    if database_save_path.suffix == ".npz":
+        if isinstance(session_database, SessionDatabase):
+            session_database = ColumnarSessionDatabase.from_session_database(session_database)
+        session_database.save(database_save_path)
+    else:
+        if isinstance(session_database, ColumnarSessionDatabase):
+            session_database = session_database.to_session_database()
+        with open(str(database_save_path), "wb") as output_file:
+            pickle.dump(session_database, output_file)
+
+
+def index_text_to_words(text: str) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """Index each position in the text with its corresponding word (text seperated by spaces).
+
+       Returns the words, the word index and the offset within the word of every character, and the location where each word starts.
+       A space belongs to the word in front of it.
+    """
     word_list = text.split(" ")
-    word_indices = []
-    counter = 0
-    for char in text:
-        word_indices.append(counter)
-        if char == " ":
-            counter += 1
-    return word_list, word_indices
+    is_space = np.fromiter((char == " " for char in text), dtype=bool, count=len(text))
+    # the word counter increases after each space
+    word_indices = (np.cumsum(is_space, dtype=np.int32) - is_space).astype(np.int32)
+    word_starts = np.concatenate([[0], np.flatnonzero(is_space) + 1]).astype(np.int32)
+    offsets_in_words = (np.arange(len(text), dtype=np.int32) - word_starts[word_indices]).astype(np.int32)
+    return word_list, word_indices, offsets_in_words, word_starts
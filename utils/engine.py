@@ -0,0 +1,159 @@
+from time import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, List, Optional, Tuple
+
+from utils.data import SessionDatabase, SessionDatabaseEntry, index_text_to_words
+
+BACKSPACE_KEY = "ctrl+h"
+
+
+@dataclass
+class KeyResult:
+    """What a key did: the expected character and the input, whether the input was correct, or whether it was a backspace."""
+    current_char: str
+    current_input: str
+    correct: bool
+    backspace: bool = False
+
+
+class RollingMetrics:
+    """Speed and accuracy of the entries of the last window seconds, updated with every entry instead of recomputed."""
+
+    def __init__(self, window: float = 30.0) -> None:
+        self.window = window
+        self.entries: Deque[Tuple[float, bool]] = deque()
+        self.num_correct = 0
+
+    def add(self, timestamp: float, correct: bool) -> None:
+        self.entries.append((timestamp, correct))
+        self.num_correct += correct
+        self.expire(timestamp)
+
+    def expire(self, now: float) -> None:
+        """Drop the entries that are older than the window."""
+        while len(self.entries) > 0 and self.entries[0][0] < now - self.window:
+            _, correct = self.entries.popleft()
+            self.num_correct -= correct
+
+    def accuracy(self, now: float) -> float:
+        """Percentage of correct entries in the window."""
+        self.expire(now)
+        return self.num_correct / len(self.entries) * 100 if len(self.entries) > 0 else 100.0
+
+    def speed(self, now: float) -> float:
+        """Characters per minute in the window, or since the first entry, if it is younger than the window."""
+        self.expire(now)
+        if len(self.entries) == 0:
+            return 0.0
+        elapsed = min(now - self.entries[0][0], self.window)
+        return len(self.entries) / elapsed * 60 if elapsed > 0 else 0.0
+
+
+class TypingEngine:
+    """State of typing a text, independent of any user interface.
+
+       Every key moves the current location in the text, updates the hit and miss counters and records an entry in the session database.
+       The time stamps of the entries come from clock, unless they are passed with the key, e.g. when replaying a recorded session.
+    """
+
+    def __init__(
+        self,
+        full_text: str,
+        session_database: Optional[SessionDatabase] = None,
+        on_entry: Optional[Callable[[SessionDatabaseEntry], None]] = None,
+        record_keys: bool = False,
+        clock: Callable[[], float] = time,
+        metrics_window: float = 30.0,
+    ) -> None:
+        # Raw text that is to be typed
+        self.full_text = full_text
+        self.text_length = len(full_text)
+
+        # Words of the text and indices to map the current location in the text to a word and the location in that word.
+        # They are used to save the word in which typos occur.
+        self.word_list, self.word_indices, self.offsets_in_words, _ = index_text_to_words(full_text)
+
+        # Current location in the full text
+        self.current_location = 0
+
+        # A class for storing information about what was typed in which context, and a callback for every new entry, e.g. to journal it
+        self.session_database = session_database if session_database is not None else SessionDatabase()
+        self.on_entry = on_entry
+
+        # Raw keys with their time stamps, including backspaces, if record_keys is set
+        self.keys: Optional[List[Tuple[str, float]]] = [] if record_keys else None
+        self.clock = clock
+
+        # Counters to calculate the accuracy, and the speed and accuracy of the last metrics_window seconds
+        self.hits = 0
+        self.misses = 0
+        self.metrics = RollingMetrics(window=metrics_window)
+
+    @property
+    def finished(self) -> bool:
+        return self.current_location >= self.text_length
+
+    def press(self, current_input: str, timestamp: Optional[float] = None) -> KeyResult:
+        """Handle a key, which is either a character or BACKSPACE_KEY."""
+        assert not self.finished, "The text is already typed completely."
+        if timestamp is None:
+            timestamp = self.clock()
+        if self.keys is not None:
+            self.keys.append((current_input, timestamp))
+
+        current_char = self.full_text[self.current_location]
+
+        if current_input == BACKSPACE_KEY:
+            self.current_location = max(self.current_location - 1, 0)
+            return KeyResult(current_char=current_char, current_input=current_input, correct=False, backspace=True)
+
+        self.save_entry(current_input, current_char, timestamp)
+        correct = current_input == current_char
+        if correct:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.current_location += 1
+
+        return KeyResult(current_char=current_char, current_input=current_input, correct=correct)
+
+    def save_entry(self, current_input: str, current_char: str, timestamp: float) -> None:
+        """Save information about what as put in, what was expected, the current word, the characters location in the word, and a time stamp."""
+
+        current_word_index = self.word_indices[self.current_location]
+        location_in_word = int(self.offsets_in_words[self.current_location])
+
+        entry = SessionDatabaseEntry(
+            input=current_input,
+            text=current_char,
+            correct=current_input == current_char,
+            word=self.word_list[current_word_index],
+            location_in_word=location_in_word,
+            time=timestamp,
+        )
+        self.session_database.entries.append(entry)
+        self.metrics.add(timestamp, entry.correct)
+        if self.on_entry is not None:
+            self.on_entry(entry)
+
+    def get_progress(self) -> str:
+        """Percentage of typed text."""
+        return f"{(self.current_location/self.text_length)*100:.1f}%"
+
+    def get_accuracy(self) -> str:
+        """Percentage of hits in typed text."""
+        try:
+            return f"{(self.hits/(self.hits+self.misses))*100:.1f}%"
+        except ZeroDivisionError:
+            return "100%"
+
+    def get_speed(self, now: Optional[float] = None) -> str:
+        """Characters per minute since start."""
+        if now is None:
+            now = self.clock()
+        try:
+            start = self.session_database.entries[0].time
+            return f"{int(self.current_location/(now - start)*60)} cpm"
+        except (IndexError, ZeroDivisionError):
+            return "0 cpm"
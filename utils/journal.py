@@ -0,0 +1,195 @@
+import os
+import json
+import zipfile
+import threading
+
+from time import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+from utils.archive import ARCHIVE_NAME, ArchivedSession, SessionArchive
+from utils.data import ColumnarSessionDatabase, SessionDatabase, SessionDatabaseEntry, write_session_database
+
+JOURNAL_SUFFIX = "_session_journal.jsonl"
+DATABASE_SUFFIX = "_session_database.npz"
+
+
+class SessionJournal:
+    """Append-only journal of the entries of a running session.
+
+       The journal is a file of json lines: a header with the session date, one line per entry and an end marker when the session is closed.
+       Entries are buffered and handed over in batches to an executor, that writes and syncs them to disk.
+       All batches that queued up while the previous write was running are written with a single fsync, in the order they were flushed.
+       This way, a crash only loses the entries of the current batch and writing never blocks the event loop of the app.
+       Many journals can share the threads of one executor, e.g. the storage threads of a server. Without an executor, the journal uses its own thread.
+    """
+
+    def __init__(
+        self,
+        journal_path: Path,
+        date: str,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.buffer = []
+        self.last_flush_time = time()
+
+        self.owns_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        # batches that are not written yet, and the future of the task that writes them, if one is running
+        self.lock = threading.Lock()
+        self.pending_batches = []
+        self.write_future: Optional[Future] = None
+
+        self.journal_file = open(str(journal_path), "a", encoding="utf-8")
+        self._schedule([{"date": date}])
+
+    def append(self, entry: SessionDatabaseEntry) -> None:
+        """Add an entry to the buffer, and pass the buffer to the writer if it is full or was not flushed for a while."""
+        self.buffer.append(asdict(entry))
+        if len(self.buffer) >= self.batch_size or time() - self.last_flush_time > self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Pass the buffered entries to the writer."""
+        if len(self.buffer) > 0:
+            self._schedule(self.buffer)
+            self.buffer = []
+        self.last_flush_time = time()
+
+    def finish(self) -> Future:
+        """Pass the remaining entries and the end marker to the writer, which closes the file afterwards. The future is done when the journal is closed."""
+        self.flush()
+        self._schedule([{"end": True}])
+        # None closes the file
+        return self._schedule(None)
+
+    def close(self) -> None:
+        """Write the remaining entries and the end marker, and wait for the writer to finish."""
+        self.finish().result()
+        if self.owns_executor:
+            self.executor.shutdown()
+
+    def _schedule(self, batch: Optional[List[dict]]) -> Future:
+        """Queue the batch and start a write task, unless one is running, which then writes the batch as well."""
+        with self.lock:
+            self.pending_batches.append(batch)
+            if self.write_future is None:
+                self.write_future = self.executor.submit(self._write_batches)
+            return self.write_future
+
+    def _write_batches(self) -> None:
+        while True:
+            with self.lock:
+                if len(self.pending_batches) == 0:
+                    self.write_future = None
+                    return
+                batches = self.pending_batches
+                self.pending_batches = []
+
+            records = [record for batch in batches if batch is not None for record in batch]
+            if len(records) > 0:
+                self.journal_file.write("".join(json.dumps(record) + "\n" for record in records))
+                self.journal_file.flush()
+                os.fsync(self.journal_file.fileno())
+            if batches[-1] is None:
+                self.journal_file.close()
+
+
+def read_journal(journal_path: Path) -> SessionDatabase:
+    """Read a journal into a SessionDatabase. Journals of crashed sessions may lack the end marker or end in a truncated line."""
+    session_database = SessionDatabase()
+
+    with open(str(journal_path.absolute()), "r", encoding="utf-8") as journal_file:
+        for line in journal_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # only the last line can be incomplete, since the journal is append-only
+                break
+
+            if "end" in record:
+                break
+            elif "date" in record:
+                session_database.date = record["date"]
+            else:
+                session_database.entries.append(SessionDatabaseEntry(**record))
+
+    return session_database
+
+
+def journal_database_path(journal_path: Path) -> Path:
+    """Path of the session database that a journal is converted into."""
+    return journal_path.parent / (journal_path.name[:-len(JOURNAL_SUFFIX)] + DATABASE_SUFFIX)
+
+
+def has_all_entries(database_path: Path, session_database: SessionDatabase) -> bool:
+    """Whether the session database at database_path can be read and has all entries of session_database."""
+    try:
+        return len(ColumnarSessionDatabase.load(database_path)) == len(session_database.entries)
+    except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+        return False
+
+
+def recover_session_journals(data_dir: Path, exclude: Optional[List[Path]] = None) -> List[Path]:
+    """Convert all journals in data_dir into columnar session databases and remove the journals.
+
+       Journals in exclude, e.g. the one of a running session, are left untouched.
+       If the session database of a journal exists already, because a crash interrupted a previous conversion, the journal is only removed
+       once the database is confirmed to hold all entries of the journal. Otherwise the database is written again.
+       Returns the paths of the written session databases.
+    """
+    exclude = [path.absolute() for path in exclude] if exclude is not None else []
+    recovered_paths = []
+
+    for journal_path in sorted(data_dir.glob(f"*{JOURNAL_SUFFIX}")):
+        if journal_path.absolute() in exclude:
+            continue
+
+        database_save_path = journal_database_path(journal_path)
+        session_database = read_journal(journal_path)
+        if not database_save_path.exists() or not has_all_entries(database_save_path, session_database):
+            write_session_database(session_database, database_save_path)
+            recovered_paths.append(database_save_path)
+        journal_path.unlink()
+
+    return recovered_paths
+
+
+def unprocessed_session_paths(
+    data_dir: Path,
+    is_processed: Optional[Callable[[str], bool]] = None,
+    exclude: Optional[List[Path]] = None,
+    archive_name: str = ARCHIVE_NAME,
+) -> List[Union[Path, ArchivedSession]]:
+    """Sessions in data_dir and its archive, oldest first, whose names is_processed rejects and that are not in exclude.
+
+       Session files are returned as their Path and archived sessions as an ArchivedSession, both can be read with read_session.
+       A session that is in the archive and still in data_dir is only returned once, as the file, and a journal is skipped if its session database exists.
+       The journals of finished or crashed sessions are converted into session databases first, except for those in exclude,
+       e.g. the journal of a running session.
+    """
+    assert data_dir.is_dir()
+
+    recover_session_journals(data_dir, exclude=exclude)
+    excluded_names = {path.name for path in exclude} if exclude is not None else set()
+
+    sessions = {session.name: session for session in SessionArchive(data_dir / archive_name).sessions()}
+    sessions.update(
+        (database_path.name, database_path) for database_path in data_dir.iterdir()
+        if "session" in database_path.name and database_path.name not in excluded_names
+    )
+    # a journal that is left next to its session database holds the same session, which must not be counted twice
+    for name in [name for name in sessions if name.endswith(JOURNAL_SUFFIX)]:
+        if journal_database_path(Path(name)).name in sessions:
+            del sessions[name]
+
+    # session names start with their date, so sorting them sorts them chronologically
+    return [sessions[name] for name in sorted(sessions) if is_processed is None or not is_processed(name)]
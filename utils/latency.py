@@ -0,0 +1,158 @@
+import numpy as np
+
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+from utils.archive import ArchivedSession, read_session
+from utils.data import ColumnarSessionDatabase, SessionDatabase
+from utils.ngram import NGRAM_SIZES, NgramCounts, SessionNgramIds, session_ngram_ids
+
+
+@dataclass
+class LatencyStatistics:
+    """Inter-key delays of correctly typed characters, grouped by key (ngram or word).
+
+       median and percentile are normalized by baseline, the median delay of all correctly typed characters in the session.
+    """
+    keys: List[str]
+    counts: np.ndarray
+    median: np.ndarray
+    percentile: np.ndarray
+    baseline: float
+
+    def is_slow(self, threshold: float = 1.5, min_count: int = 3) -> np.ndarray:
+        """Mask of the keys with at least min_count delays, whose median delay is at least threshold times the baseline."""
+        with np.errstate(invalid="ignore"):
+            return (self.counts >= min_count) & (self.median >= threshold)
+
+    def slow_keys(self, threshold: float = 1.5, min_count: int = 3) -> List[str]:
+        """Keys with at least min_count delays, whose median delay is at least threshold times the baseline."""
+        return [self.keys[i] for i in np.flatnonzero(self.is_slow(threshold, min_count))]
+
+
+def as_columnar(database: Union[SessionDatabase, ColumnarSessionDatabase]) -> ColumnarSessionDatabase:
+    if isinstance(database, SessionDatabase):
+        return ColumnarSessionDatabase.from_session_database(database)
+    return database
+
+
+def inter_key_delays(database: ColumnarSessionDatabase, max_delay: float = 2.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Delay before every entry, and a mask of the entries that are typed correctly after a correct entry and not separated from it by a pause longer than max_delay.
+
+       Backspaces are not entries, so the delay of the character that corrects a typo includes the backspace.
+       Those characters follow an incorrect entry and are excluded, so ngrams with typos are not counted as slow as well.
+    """
+    delays = np.diff(database.time, prepend=np.nan)
+    follows_correct = np.concatenate([[False], database.correct[:-1]]) if len(database.correct) > 0 else np.zeros(0, dtype=bool)
+    with np.errstate(invalid="ignore"):
+        is_valid = database.correct & follows_correct & (delays > 0.0) & (delays <= max_delay)
+    return delays, is_valid
+
+
+def grouped_percentiles(
+    group_ids: np.ndarray,
+    values: np.ndarray,
+    num_groups: int,
+    percentiles: Sequence[float],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Number of values and linearly interpolated percentiles of the values for each group. Empty groups get NaN."""
+    order = np.lexsort((values, group_ids))
+    sorted_values = values[order]
+
+    counts = np.bincount(group_ids, minlength=num_groups)
+    starts = np.cumsum(counts) - counts
+    last = np.maximum(counts - 1, 0)
+
+    results = np.full((len(percentiles), num_groups), np.nan)
+    has_values = counts > 0
+    for i, q in enumerate(percentiles):
+        position = last * (q / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, last)
+        fraction = position - lower
+        lower_values = sorted_values[(starts + lower)[has_values]]
+        upper_values = sorted_values[(starts + upper)[has_values]]
+        results[i, has_values] = lower_values + (upper_values - lower_values) * fraction[has_values]
+
+    return counts, results
+
+
+def statistics_from_groups(
+    keys: List[str],
+    group_ids: np.ndarray,
+    delays: np.ndarray,
+    baseline: float,
+    percentile: float,
+) -> LatencyStatistics:
+    counts, (median, upper_percentile) = grouped_percentiles(group_ids, delays, len(keys), (50.0, percentile))
+    return LatencyStatistics(
+        keys=keys,
+        counts=counts,
+        median=median / baseline,
+        percentile=upper_percentile / baseline,
+        baseline=baseline,
+    )
+
+
+def word_latency_statistics(
+    database: Union[SessionDatabase, ColumnarSessionDatabase],
+    percentile: float = 90.0,
+    max_delay: float = 2.0,
+) -> LatencyStatistics:
+    """Median and percentile of the inter-key delays within every word of the session."""
+    database = as_columnar(database)
+    delays, is_valid = inter_key_delays(database, max_delay=max_delay)
+    baseline = float(np.median(delays[is_valid])) if np.any(is_valid) else 1.0
+
+    keys = [str(word) for word in database.word_values]
+    return statistics_from_groups(keys, database.word_codes[is_valid], delays[is_valid], baseline, percentile)
+
+
+def ngram_latency_statistics(
+    database: Union[SessionDatabase, ColumnarSessionDatabase],
+    n: Union[int, Tuple[int, ...]] = NGRAM_SIZES,
+    percentile: float = 90.0,
+    max_delay: float = 2.0,
+    ngram_ids: Optional[SessionNgramIds] = None,
+) -> LatencyStatistics:
+    """Median and percentile of the inter-key delays of every ngram in the session.
+
+       The delay of a character counts for all ngrams that create_ngrams creates around it.
+       The ngram ids of the entries are computed with session_ngram_ids, unless they are passed, e.g. because they were used for counting already.
+    """
+    database = as_columnar(database)
+    if ngram_ids is None:
+        ngram_ids = session_ngram_ids(database, n=n)
+    delays, is_valid = inter_key_delays(database, max_delay=max_delay)
+    baseline = float(np.median(delays[is_valid])) if np.any(is_valid) else 1.0
+
+    # one row per ngram of an entry and one column per valid entry, -1 where the entry has fewer ngrams
+    entry_ngram_ids = ngram_ids.ngram_ids[:, ngram_ids.entry_combinations[is_valid]]
+    has_ngram = entry_ngram_ids >= 0
+    group_delays = np.broadcast_to(delays[is_valid], entry_ngram_ids.shape)[has_ngram]
+
+    return statistics_from_groups(ngram_ids.ngrams, entry_ngram_ids[has_ngram], group_delays, baseline, percentile)
+
+
+def ngram_counts_from_session_with_latency(
+    database_path: Union[Path, ArchivedSession],
+    n: Union[int, Tuple[int, ...]] = NGRAM_SIZES,
+    slow_threshold: float = 1.5,
+    min_count: int = 3,
+) -> Tuple[Counter, Counter]:
+    """Like ngram_counts_from_session, but the correct occurrences of slow ngrams are counted as typos.
+
+       An ngram is slow, if it was typed correctly at least min_count times with a median delay of at least slow_threshold times the session's baseline.
+       The ngrams of the session are extracted once, for the counts and the delays.
+    """
+    database = as_columnar(read_session(database_path))
+    ngram_ids = session_ngram_ids(database, n=n)
+    counts = ngram_ids.counts()
+
+    is_slow = ngram_latency_statistics(database, n=n, ngram_ids=ngram_ids).is_slow(slow_threshold, min_count)
+    typo_counts = counts.typo_counts + np.where(is_slow, counts.correct_counts, 0)
+    correct_counts = np.where(is_slow, 0, counts.correct_counts)
+
+    return NgramCounts(ngrams=counts.ngrams, correct_counts=correct_counts, typo_counts=typo_counts).to_counters()
@@ -1,9 +1,18 @@
 import random
+import numpy as np
 
+from collections import Counter
+from collections.abc import Sequence
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
-from utils.data import read_database
+from utils.archive import ArchivedSession, read_session
+from utils.cache import cache_key, file_key, load_arrays, save_arrays
+from utils.data import ColumnarSessionDatabase
+
+# Sizes of the ngrams that are extracted from sessions and tracked in the SRS database.
+NGRAM_SIZES = (2, 3)
 
 
 def create_ngrams(
@@ -33,21 +42,166 @@ def create_ngrams(
     return ngrams
 
 
+class WordList(Sequence):
+    """Read-only list of words, stored as one utf-8 encoded byte array and the offsets of the words in it.
+
+       Both arrays can be memory-mapped from the cache, so words are only decoded when they are accessed.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray) -> None:
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_words(cls, words: List[str]) -> "WordList":
+        encoded_words = [word.encode("utf-8") for word in words]
+        offsets = np.zeros(len(encoded_words) + 1, dtype=np.int64)
+        np.cumsum([len(encoded_word) for encoded_word in encoded_words], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded_words), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, word_id: int) -> str:
+        return self.data[self.offsets[word_id]:self.offsets[word_id + 1]].tobytes().decode("utf-8")
+
+
+@dataclass
+class NgramWordIndex:
+    """Inverted index from ngrams to the ids of the words in a word list that contain them.
+
+       The ids of the words that contain ngrams[i] are word_ids[offsets[i]:offsets[i + 1]], and ngrams is sorted for lookups with a binary search.
+    """
+    words: Sequence[str]
+    ngrams: np.ndarray
+    offsets: np.ndarray
+    word_ids: np.ndarray
+    n: Tuple[int, ...] = NGRAM_SIZES
+    # Identifies the word file the index was built from (path, size, mtime).
+    source_key: Tuple = ()
+
+    @classmethod
+    def build(cls, words: List[str], n: Tuple[int, ...] = NGRAM_SIZES, source_key: Tuple = ()) -> "NgramWordIndex":
+        """Build the index by collecting the ngrams of every word once."""
+        ngram_word_ids = {}
+        for word_id, word in enumerate(words):
+            word_ngrams = set()
+            for current_n in n:
+                for i in range(len(word) - current_n + 1):
+                    word_ngrams.add(word[i:i + current_n])
+            for ngram in word_ngrams:
+                ngram_word_ids.setdefault(ngram, []).append(word_id)
+
+        ngrams = sorted(ngram_word_ids.keys())
+        offsets = np.zeros(len(ngrams) + 1, dtype=np.int64)
+        np.cumsum([len(ngram_word_ids[ngram]) for ngram in ngrams], out=offsets[1:])
+        word_ids = np.fromiter(
+            (word_id for ngram in ngrams for word_id in ngram_word_ids[ngram]),
+            dtype=np.int32,
+            count=int(offsets[-1]),
+        )
+
+        return cls(
+            words=WordList.from_words(words),
+            ngrams=np.array(ngrams, dtype=str),
+            offsets=offsets,
+            word_ids=word_ids,
+            n=n,
+            source_key=source_key,
+        )
+
+    def word_ids_with_ngram(self, ngram: str) -> np.ndarray:
+        """Ids of all words that contain the ngram."""
+        if len(ngram) in self.n:
+            position = int(np.searchsorted(self.ngrams, ngram))
+            if position < len(self.ngrams) and self.ngrams[position] == ngram:
+                return self.word_ids[self.offsets[position]:self.offsets[position + 1]]
+            return np.empty(0, dtype=np.int32)
+
+        # ngrams of a size that is not indexed fall back to a scan of the word list
+        return np.array([word_id for word_id, word in enumerate(self.words) if ngram in word], dtype=np.int32)
+
+    def words_with_ngram(self, ngram: str) -> List[str]:
+        """All words that contain the ngram."""
+        return [self.words[word_id] for word_id in self.word_ids_with_ngram(ngram)]
+
+    def save(self, cache_dir: Path) -> None:
+        """Write all arrays as .npy files into cache_dir, see save_arrays."""
+        assert isinstance(self.words, WordList), "Only indices built by NgramWordIndex.build can be saved."
+        save_arrays(
+            cache_dir,
+            {
+                "words": self.words.data,
+                "word_offsets": self.words.offsets,
+                "ngrams": self.ngrams,
+                "ngram_offsets": self.offsets,
+                "word_ids": self.word_ids,
+            },
+            key=cache_key(self.source_key, self.n),
+        )
+
+    @classmethod
+    def load(cls, cache_dir: Path, source_key: Tuple, n: Tuple[int, ...] = NGRAM_SIZES) -> Optional["NgramWordIndex"]:
+        """Memory-map the index from cache_dir. Returns None if the cache is missing or was built from another word file."""
+        arrays = load_arrays(cache_dir, ("words", "word_offsets", "ngrams", "ngram_offsets", "word_ids"), key=cache_key(source_key, n))
+        if arrays is None:
+            return None
+
+        return cls(
+            words=WordList(arrays["words"], arrays["word_offsets"]),
+            ngrams=arrays["ngrams"],
+            offsets=arrays["ngram_offsets"],
+            word_ids=arrays["word_ids"],
+            n=tuple(n),
+            source_key=tuple(source_key),
+        )
+
+
+def load_word_index(
+    word_file_path: Path,
+    cache_dir: Path,
+    n: Tuple[int, ...] = NGRAM_SIZES,
+) -> NgramWordIndex:
+    """Load the NgramWordIndex of a word file from the cache, or build and cache it if the word file changed."""
+    assert word_file_path.is_file(), f"Cannot find {word_file_path.absolute()}."
+    source_key = file_key(word_file_path)
+
+    word_index = NgramWordIndex.load(cache_dir, source_key=source_key, n=n)
+    if word_index is not None:
+        return word_index
+
+    with open(str(word_file_path.absolute()), "r") as word_file:
+        words = word_file.read().splitlines()
+
+    word_index = NgramWordIndex.build(words, n=n, source_key=source_key)
+    word_index.save(cache_dir)
+
+    return word_index
+
+
 def get_words_with_ngrams(
     ngrams: List[str],
     word_list: List[str],
     shuffle_words: bool = True,
+    word_index: Optional[NgramWordIndex] = None,
 ) -> List[str]:
-    """Filters a list of words based on whether any ngram is contained in the word."""
+    """Filters a list of words based on whether any ngram is contained in the word.
+
+       If a word_index of the word_list is passed, the words are looked up in the index instead of scanning the word_list.
+    """
     relevant_words = []
 
     # remove duplicate ngrams
     ngrams = list(set(ngrams))
 
-    for word in word_list:
+    if word_index is not None:
         for ngram in ngrams:
-            if ngram in word:
-                relevant_words.append(word)
+            relevant_words.extend(word_index.words_with_ngram(ngram))
+    else:
+        for word in word_list:
+            for ngram in ngrams:
+                if ngram in word:
+                    relevant_words.append(word)
 
     # remove duplicate words
     relevant_words = list(set(relevant_words))
@@ -58,11 +212,12 @@ def get_words_with_ngrams(
     return relevant_words
 
 
-def ngrams_from_session(database_path: Path, n: Union[int, Tuple[int, ...]] = (2, 3)) -> Tuple[List[str], List[str]]:
-    """Read a SessionDatabase from a Path and return all ngrams, correct and with typo."""
-    assert database_path.is_file(), f"Cannot find {database_path.absolute()}."
+def ngrams_from_session(database_path: Union[Path, ArchivedSession], n: Union[int, Tuple[int, ...]] = NGRAM_SIZES) -> Tuple[List[str], List[str]]:
+    """Read a SessionDatabase from a Path or an archive and return all ngrams, correct and with typo."""
+    database = read_session(database_path)
 
-    database = read_database(database_path)
+    if isinstance(database, ColumnarSessionDatabase):
+        return ngrams_from_columnar_session(database, n=n)
 
     database_entries_with_typo = [
         database_entry for database_entry in database.entries
@@ -91,3 +246,164 @@ def ngrams_from_session(database_path: Path, n: Union[int, Tuple[int, ...]] = (2
             correct_ngrams.extend(ngrams)
 
     return correct_ngrams, typo_ngrams
+
+
+def ngrams_from_columnar_session(
+    database: ColumnarSessionDatabase,
+    n: Union[int, Tuple[int, ...]] = NGRAM_SIZES,
+) -> Tuple[List[str], List[str]]:
+    """Return all ngrams of a ColumnarSessionDatabase, correct and with typo."""
+    correct_counts, typo_counts = count_session_ngrams(database, n=n).to_counters()
+    return list(correct_counts.elements()), list(typo_counts.elements())
+
+
+@dataclass
+class NgramCounts:
+    """Number of correct and typo occurrences of ngrams. The id of an ngram is its index in ngrams."""
+    ngrams: List[str]
+    correct_counts: np.ndarray
+    typo_counts: np.ndarray
+
+    def to_counters(self) -> Tuple[Counter, Counter]:
+        """Decode the counts into Counters of correct and typo ngrams."""
+        correct_counts = Counter({self.ngrams[ngram_id]: int(self.correct_counts[ngram_id]) for ngram_id in np.flatnonzero(self.correct_counts)})
+        typo_counts = Counter({self.ngrams[ngram_id]: int(self.typo_counts[ngram_id]) for ngram_id in np.flatnonzero(self.typo_counts)})
+        return correct_counts, typo_counts
+
+
+@dataclass
+class SessionNgramIds:
+    """Ids of the ngrams that create_ngrams creates for every entry of a session, in the ngrams of NgramCounts.
+
+       Entries are grouped into the unique combinations of word, location in the word and correctness.
+       entry_combinations holds the combination of every entry, occurrences and is_correct the number of entries and the correctness
+       of every combination, and ngram_ids[k, c] the id of the k-th ngram of combination c, or -1 if it has fewer ngrams.
+    """
+    ngrams: List[str]
+    entry_combinations: np.ndarray
+    occurrences: np.ndarray
+    is_correct: np.ndarray
+    ngram_ids: np.ndarray
+
+    def counts(self) -> NgramCounts:
+        """Number of correct and typo occurrences of every ngram."""
+        has_ngram = self.ngram_ids >= 0
+        occurrences = np.broadcast_to(self.occurrences, self.ngram_ids.shape)
+        is_correct = np.broadcast_to(self.is_correct, self.ngram_ids.shape)
+        counts = [
+            np.bincount(self.ngram_ids[has_ngram & mask], weights=occurrences[has_ngram & mask], minlength=len(self.ngrams)).astype(np.int64)
+            for mask in (is_correct, ~is_correct)
+        ]
+        return NgramCounts(ngrams=self.ngrams, correct_counts=counts[0], typo_counts=counts[1])
+
+
+def session_ngram_ids(
+    database: ColumnarSessionDatabase,
+    n: Union[int, Tuple[int, ...]] = NGRAM_SIZES,
+) -> SessionNgramIds:
+    """Ngrams of every entry of a session as integer ids, without creating any strings per entry.
+
+       Words are turned into rows of character ids, and every ngram into the integer with its character ids as digits.
+       For every n and every position of the entry's character in the ngram, the codes of all combinations are computed in one vectorized step.
+       Only the unique ngrams are decoded into strings.
+    """
+    if isinstance(n, int):
+        n = (n, )
+
+    if len(database) == 0:
+        return SessionNgramIds(
+            ngrams=[],
+            entry_combinations=np.zeros(0, dtype=np.int64),
+            occurrences=np.zeros(0, dtype=np.int64),
+            is_correct=np.zeros(0, dtype=bool),
+            ngram_ids=np.zeros((sum(n), 0), dtype=np.int64),
+        )
+
+    # unique combinations of word, location in the word and correctness, with their number of occurrences
+    locations_in_words = database.location_in_word.astype(np.int64)
+    num_locations = int(locations_in_words.max()) + 1
+    keys = (database.word_codes.astype(np.int64) * num_locations + locations_in_words) * 2 + database.correct
+    unique_keys, entry_combinations, occurrences = np.unique(keys, return_inverse=True, return_counts=True)
+    is_correct = (unique_keys % 2).astype(bool)
+    word_codes, locations_in_words = np.divmod(unique_keys // 2, num_locations)
+
+    # the code points of a fixed width unicode array are its characters, padded with zeros
+    word_values = np.asarray(database.word_values, dtype=str)
+    code_points = word_values.view(np.uint32).reshape(len(word_values), -1)
+    word_lengths = np.char.str_len(word_values)
+
+    # ids from 1 to the size of the alphabet, so that leading characters are never zero and ngrams of different sizes get different codes
+    alphabet = np.unique(code_points[code_points > 0])
+    base = len(alphabet) + 1
+    assert float(base)**max(n) < 2**63, f"Cannot encode {max(n)}-grams over an alphabet of {len(alphabet)} characters in 64 bit."
+    character_ids = np.where(code_points > 0, np.searchsorted(alphabet, code_points) + 1, 0).astype(np.int64)
+
+    # one row per n and position of the entry's character in the ngram, with the code 0 where the ngram is not complete
+    ngram_codes = np.zeros((sum(n), len(unique_keys)), dtype=np.int64)
+    row = 0
+    for current_n in n:
+        powers = base**np.arange(current_n - 1, -1, -1, dtype=np.int64)
+        for i in range(current_n):
+            # same slices as in create_ngrams, only complete ngrams are used
+            starts = locations_in_words + i - current_n + 1
+            is_complete = (starts >= 0) & (starts + current_n <= word_lengths[word_codes])
+            characters = character_ids[word_codes[is_complete][:, None], starts[is_complete][:, None] + np.arange(current_n)]
+            ngram_codes[row, is_complete] = characters @ powers
+            row += 1
+
+    unique_codes, ngram_ids = np.unique(ngram_codes, return_inverse=True)
+    ngram_ids = ngram_ids.reshape(ngram_codes.shape)
+    # the code 0 of incomplete ngrams is the smallest, so it gets the id 0 if there is any
+    if unique_codes[0] == 0:
+        unique_codes = unique_codes[1:]
+        ngram_ids -= 1
+
+    return SessionNgramIds(
+        ngrams=decode_ngram_codes(unique_codes, alphabet, base),
+        entry_combinations=entry_combinations.reshape(-1),
+        occurrences=occurrences,
+        is_correct=is_correct,
+        ngram_ids=ngram_ids,
+    )
+
+
+def count_session_ngrams(
+    database: ColumnarSessionDatabase,
+    n: Union[int, Tuple[int, ...]] = NGRAM_SIZES,
+) -> NgramCounts:
+    """Count the ngrams that create_ngrams creates for every entry of a session, see session_ngram_ids."""
+    return session_ngram_ids(database, n=n).counts()
+
+
+def decode_ngram_codes(codes: np.ndarray, alphabet: np.ndarray, base: int) -> List[str]:
+    """Turn the integer codes created by session_ngram_ids back into strings."""
+    # character ids, least significant first, until all codes are used up
+    character_ids = []
+    remaining = np.asarray(codes, dtype=np.int64)
+    while np.any(remaining > 0):
+        remaining, character_id = np.divmod(remaining, base)
+        character_ids.append(character_id)
+    if len(character_ids) == 0:
+        return [""] * len(codes)
+    character_ids = np.stack(character_ids, axis=1)
+
+    # reverse the characters of every code, which are all nonzero, and pad them with zeros at the end
+    lengths = np.count_nonzero(character_ids, axis=1)
+    positions = lengths[:, None] - 1 - np.arange(character_ids.shape[1])
+    character_ids = np.where(positions >= 0, np.take_along_axis(character_ids, np.maximum(positions, 0), axis=1), 0)
+
+    # code points, padded with zeros, are the characters of a fixed width unicode array
+    code_points = np.concatenate([[0], alphabet]).astype(np.uint32)[character_ids]
+    return np.ascontiguousarray(code_points).view(f"<U{code_points.shape[1]}").reshape(-1).tolist()
+
+
+def ngram_counts_from_session(
+    database_path: Union[Path, ArchivedSession],
+    n: Union[int, Tuple[int, ...]] = NGRAM_SIZES,
+) -> Tuple[Counter, Counter]:
+    """Read a session from a Path or an archive and return the number of occurrences of all correct and typo ngrams."""
+    database = read_session(database_path)
+    if not isinstance(database, ColumnarSessionDatabase):
+        database = ColumnarSessionDatabase.from_session_database(database)
+
+    return count_session_ngrams(database, n=n).to_counters()
@@ -0,0 +1,96 @@
+import math
+import cProfile
+
+from time import perf_counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class LatencyHistogram:
+    """Fixed-size histogram of durations with logarithmic buckets, each bucket 5% wider than the one before.
+
+       Durations from 1 microsecond to about 100 seconds are resolved, so percentiles are accurate to 5%.
+    """
+
+    min_duration = 1e-6
+    growth = 1.05
+    num_buckets = 380
+
+    def __init__(self) -> None:
+        self.counts = [0] * self.num_buckets
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, duration: float) -> None:
+        if duration <= self.min_duration:
+            bucket = 0
+        else:
+            bucket = min(int(math.log(duration / self.min_duration, self.growth)) + 1, self.num_buckets - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += duration
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket that contains the q-th percentile."""
+        if self.count == 0:
+            return math.nan
+
+        rank = q / 100 * self.count
+        cumulative_count = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank and bucket_count > 0:
+                return self.min_duration * self.growth**bucket
+        return self.min_duration * self.growth**(self.num_buckets - 1)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else math.nan
+
+
+class KeystrokeInstrumentation:
+    """Opt-in timers for the stages of handling a keystroke, with optional cProfile capture of the whole session.
+
+       If disabled, start returns 0.0 and record does nothing, so the timers can stay in the code.
+    """
+
+    def __init__(self, enabled: bool = False, profile: bool = False) -> None:
+        self.enabled = enabled
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.profiler = cProfile.Profile() if profile else None
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def start(self) -> float:
+        return perf_counter() if self.enabled else 0.0
+
+    def record(self, stage: str, start: float, end: Optional[float] = None) -> None:
+        """Add the time from start until end (or now) to the histogram of the stage."""
+        if not self.enabled:
+            return
+        if end is None:
+            end = perf_counter()
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = LatencyHistogram()
+        histogram.add(end - start)
+
+    def report(self) -> List[str]:
+        """Lines with count, mean, p50, p95 and p99 in milliseconds for every stage."""
+        lines = [f"{'stage':<20} {'count':>8} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}"]
+        for stage, histogram in self.histograms.items():
+            lines.append(
+                f"{stage:<20} {histogram.count:>8} {histogram.mean() * 1000:>9.3f}"
+                + "".join(f" {histogram.percentile(q) * 1000:>9.3f}" for q in (50, 95, 99))
+            )
+        return lines
+
+    def dump(self, report_path: Path, profile_path: Optional[Path] = None) -> None:
+        """Write the report of the stages, and the cProfile statistics if profiling is enabled."""
+        if self.enabled:
+            with open(str(report_path), "w") as report_file:
+                report_file.write("Keystroke latency in milliseconds\n")
+                report_file.write("\n".join(self.report()) + "\n")
+
+        if self.profiler is not None and profile_path is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(str(profile_path))
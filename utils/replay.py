@@ -0,0 +1,41 @@
+import json
+
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from utils.data import SessionDatabase
+from utils.engine import TypingEngine
+
+KEY_LOG_SUFFIX = "_key_log.jsonl"
+
+
+def write_key_log(key_log_path: Path, full_text: str, keys: List[Tuple[str, float]], date: str) -> None:
+    """Write a file of json lines: a header with the text and the date of the session, and one line per key with its time stamp."""
+    with open(str(key_log_path), "w", encoding="utf-8") as key_log_file:
+        key_log_file.write(json.dumps({"text": full_text, "date": date}) + "\n")
+        key_log_file.write("".join(json.dumps({"key": key, "time": timestamp}) + "\n" for key, timestamp in keys))
+
+
+def read_key_log(key_log_path: Path) -> Tuple[str, str, List[Tuple[str, float]]]:
+    """Text, date and keys of a key log."""
+    with open(str(key_log_path), "r", encoding="utf-8") as key_log_file:
+        header = json.loads(key_log_file.readline())
+        keys = [(record["key"], record["time"]) for record in map(json.loads, key_log_file)]
+    return header["text"], header["date"], keys
+
+
+def replay_keys(full_text: str, keys: Iterable[Tuple[str, float]], date: Optional[str] = None) -> TypingEngine:
+    """Feed the keys through a TypingEngine as fast as possible. Keys after the end of the text are ignored."""
+    session_database = SessionDatabase(date=date) if date is not None else SessionDatabase()
+    engine = TypingEngine(full_text, session_database=session_database)
+    for key, timestamp in keys:
+        if engine.finished:
+            break
+        engine.press(key, timestamp)
+    return engine
+
+
+def replay_key_log(key_log_path: Path) -> SessionDatabase:
+    """Regenerate the session database of a key log."""
+    full_text, date, keys = read_key_log(key_log_path)
+    return replay_keys(full_text, keys, date=date).session_database
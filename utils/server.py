@@ -0,0 +1,206 @@
+import re
+import json
+import asyncio
+
+from datetime import datetime
+from functools import partial
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional
+
+from utils.data import SessionDatabase
+from utils.engine import TypingEngine
+from utils.journal import SessionJournal, JOURNAL_SUFFIX
+from utils.ngram import NgramWordIndex
+from utils.text import prepare_practice_text
+
+PROFILE_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def is_valid_key(key) -> bool:
+    """Whether a key of a keys request is a string, or a list of a string and a numeric time stamp."""
+    if isinstance(key, list):
+        return len(key) == 2 and isinstance(key[0], str) and isinstance(key[1], (int, float)) and not isinstance(key[1], bool)
+    return isinstance(key, str)
+
+
+@dataclass
+class Profile:
+    """Data directory of a user, with the lock that serializes all updates of its SRS database and session history."""
+    name: str
+    data_dir: Path
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # whether a session of the profile is running, only one session per profile can run at a time
+    active: bool = False
+
+
+class ProfilePool:
+    """Profiles below root_dir, one data directory each, that share one word index and one pool of storage threads.
+
+       All reads and writes of the SRS databases, session histories and session journals run in the thread pool, so they never block the event loop.
+       Different profiles are processed in parallel, while the lock of a profile makes its updates sequential.
+    """
+
+    def __init__(
+        self,
+        root_dir: Path,
+        word_index: NgramWordIndex,
+        num_storage_threads: int = 8,
+        num_words_in_text: int = 20,
+    ) -> None:
+        self.root_dir = root_dir
+        if not self.root_dir.is_dir():
+            self.root_dir.mkdir(parents=True)
+        self.word_index = word_index
+        self.num_words_in_text = num_words_in_text
+        self.executor = ThreadPoolExecutor(max_workers=num_storage_threads)
+        self.profiles: Dict[str, Profile] = {}
+
+    def get(self, name: str) -> Profile:
+        # names become directories under root_dir, so they must not contain separators or dots, e.g. ../x, and checks must survive python -O
+        if PROFILE_NAME_PATTERN.fullmatch(name) is None:
+            raise ValueError(f"Invalid profile name {name!r}.")
+        profile = self.profiles.get(name)
+        if profile is None:
+            data_dir = self.root_dir / name
+            if not data_dir.is_dir():
+                data_dir.mkdir()
+            profile = self.profiles[name] = Profile(name=name, data_dir=data_dir)
+        return profile
+
+    async def run(self, function, *args, **kwargs):
+        """Run a blocking storage function in the thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(function, *args, **kwargs))
+
+    async def prepare_text(self, profile: Profile) -> str:
+        """Fold the finished sessions of the profile into its SRS database and assemble its next practice text."""
+        async with profile.lock:
+            return await self.run(
+                prepare_practice_text,
+                data_dir=profile.data_dir,
+                num_words_in_text=self.num_words_in_text,
+                word_index=self.word_index,
+                num_workers=1,
+            )
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+
+class PracticeSession:
+    """A running session of a profile: the typing engine and the journal of its entries, which is written by the storage threads."""
+
+    def __init__(self, profile: Profile, full_text: str, executor: Executor) -> None:
+        self.profile = profile
+        # microseconds keep the names of quickly repeated sessions of a profile apart
+        session_database = SessionDatabase(date=datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f"))
+        self.journal = SessionJournal(
+            profile.data_dir / f"{session_database.date}{JOURNAL_SUFFIX}",
+            date=session_database.date,
+            executor=executor,
+        )
+        self.engine = TypingEngine(full_text, session_database=session_database, on_entry=self.journal.append)
+
+    def status(self) -> dict:
+        return {
+            "ok": True,
+            "location": self.engine.current_location,
+            "finished": self.engine.finished,
+            "accuracy": self.engine.get_accuracy(),
+            "progress": self.engine.get_progress(),
+        }
+
+
+class PracticeServer:
+    """Local service for many profiles, speaking json lines over TCP.
+
+       Requests and their responses:
+         {"op": "start", "profile": name}       -> {"ok": true, "text": text}
+         {"op": "keys", "keys": [key, ...]}     -> {"ok": true, "location": ..., "finished": ..., "accuracy": ..., "progress": ...}
+           keys are characters or "ctrl+h", optionally with a time stamp as [key, time]
+         {"op": "finish"}                       -> {"ok": true, "entries": number of recorded entries}
+       Every connection runs at most one session at a time. Errors are answered with {"ok": false, "error": message}.
+    """
+
+    def __init__(self, profile_pool: ProfilePool) -> None:
+        self.profile_pool = profile_pool
+        self.num_keys = 0
+        self.num_sessions = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle_connection, host=host, port=port)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session: Optional[PracticeSession] = None
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                try:
+                    session, response = await self.handle_request(json.loads(line), session)
+                except (AssertionError, KeyError, ValueError) as error:
+                    response = {"ok": False, "error": str(error)}
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if session is not None:
+                # the journal of an unfinished session is recovered with the next update of the profile
+                await self.finish_session(session)
+            writer.close()
+
+    async def handle_request(self, request: dict, session: Optional[PracticeSession]):
+        # requests come from the network, so they are checked with exceptions, which python -O keeps, unlike asserts
+        if not isinstance(request, dict):
+            raise ValueError("A request has to be a json object.")
+        op = request["op"]
+
+        if op == "start":
+            if session is not None:
+                raise ValueError("A session is already running on this connection.")
+            profile = self.profile_pool.get(str(request["profile"]))
+            if profile.active:
+                raise ValueError(f"Profile {profile.name} is already in a session.")
+            profile.active = True
+            try:
+                full_text = await self.profile_pool.prepare_text(profile)
+                session = PracticeSession(profile, full_text, self.profile_pool.executor)
+            except Exception:
+                profile.active = False
+                raise
+            self.num_sessions += 1
+            return session, {"ok": True, "text": full_text}
+
+        if session is None:
+            raise ValueError("No session is running on this connection.")
+
+        if op == "keys":
+            keys = request["keys"]
+            if not isinstance(keys, list):
+                raise ValueError("keys has to be a list.")
+            if not all(is_valid_key(key) for key in keys):
+                raise ValueError("Every key has to be a string, or a list of a string and a time stamp.")
+            for key in keys:
+                if session.engine.finished:
+                    break
+                if isinstance(key, list):
+                    session.engine.press(key[0], float(key[1]))
+                else:
+                    session.engine.press(key)
+                self.num_keys += 1
+            return session, session.status()
+
+        if op == "finish":
+            num_entries = len(session.engine.session_database.entries)
+            await self.finish_session(session)
+            return None, {"ok": True, "entries": num_entries}
+
+        raise ValueError(f"Unknown op {op!r}.")
+
+    async def finish_session(self, session: PracticeSession) -> None:
+        """Close the journal of the session, so it is folded into the SRS database before the next text of the profile."""
+        await asyncio.wrap_future(session.journal.finish())
+        session.profile.active = False
@@ -1,25 +1,70 @@
-import random
 import pickle
 import numpy as np
 
-from typing import List, Tuple, Dict
+from functools import partial
+
+from typing import Callable, List, Optional, Tuple, Dict, Set, Mapping, Union
 from dataclasses import dataclass, field
 from collections import Counter
 from pathlib import Path
 
 from utils.data import read_database
-from utils.ngram import ngrams_from_session
+from utils.ngram import ngram_counts_from_session, ngrams_from_session
+from utils.journal import unprocessed_session_paths
+from utils.latency import ngram_counts_from_session_with_latency
 
 
 @dataclass
 class SRSBin:
-    ngrams: List[str] = field(default_factory=list)
+    ngrams: Set[str] = field(default_factory=set)
+
+    def __setstate__(self, state: dict) -> None:
+        """Databases pickled before the indexed representation store the ngrams of a bin as a list."""
+        state["ngrams"] = set(state.get("ngrams", ()))
+        self.__dict__.update(state)
 
 
 @dataclass
 class SRSDataBase:
     bins: Dict[int, SRSBin] = field(default_factory=dict)
     sessions: List[str] = field(default_factory=list)
+    # Index from ngram to its bin number and the set of processed sessions.
+    # Both are derived from bins and sessions, so they are not pickled but rebuilt on load.
+    ngram_bins: Dict[str, int] = field(default_factory=dict, init=False, repr=False, compare=False)
+    session_names: Set[str] = field(default_factory=set, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        for srs_bin in self.bins.values():
+            if not isinstance(srs_bin.ngrams, set):
+                srs_bin.ngrams = set(srs_bin.ngrams)
+        self.rebuild_index()
+
+    def __getstate__(self) -> dict:
+        return {"bins": self.bins, "sessions": self.sessions}
+
+    def __setstate__(self, state: dict) -> None:
+        """Restore a pickled database. Databases written by older versions are migrated by rebuilding the index."""
+        self.bins = state.get("bins", {})
+        self.sessions = state.get("sessions", [])
+        self.rebuild_index()
+
+    def rebuild_index(self) -> None:
+        """Recreate the ngram to bin mapping and the session set from the bins and the session list."""
+        self.ngram_bins = {}
+        for bin_num in sorted(self.bins.keys()):
+            for ngram in self.bins[bin_num].ngrams:
+                # on duplicates, the first bin wins, check_integrity will report the database as broken
+                self.ngram_bins.setdefault(ngram, bin_num)
+        self.session_names = set(self.sessions)
+
+    def has_session(self, session_name: str) -> bool:
+        """Check if a session was already used to update the database."""
+        return session_name in self.session_names
+
+    def add_session(self, session_name: str) -> None:
+        """Register a session as processed."""
+        self.sessions.append(session_name)
+        self.session_names.add(session_name)
 
     def move_ngram_down(self, ngram: str, current_bin_num: int) -> None:
         """Move the ngram to the next lower bin. If it is already in the lowest bin, it stays there."""
@@ -33,7 +78,8 @@ class SRSDataBase:
         # add the ngram to the bin below
         assert current_bin_num - 1 >= 0, f"Database was asked to move ngram into bin {current_bin_num - 1}. Only positive bins including 0 are valid."
         assert current_bin_num - 1 in self.bins, f"Did not find bin number {current_bin_num - 1}. That should not happen, because ngrams always have to go through bins in ascending order."
-        self.bins[current_bin_num - 1].ngrams.append(ngram)
+        self.bins[current_bin_num - 1].ngrams.add(ngram)
+        self.ngram_bins[ngram] = current_bin_num - 1
 
     def move_ngram_up(self, ngram: str, current_bin_num: int) -> None:
         """Move the ngram to the next higher bin. If the bin does not exist yet, it will be created."""
@@ -45,7 +91,8 @@ class SRSDataBase:
             self.bins[current_bin_num + 1] = SRSBin()
 
         # add the ngram to the bin above
-        self.bins[current_bin_num + 1].ngrams.append(ngram)
+        self.bins[current_bin_num + 1].ngrams.add(ngram)
+        self.ngram_bins[ngram] = current_bin_num + 1
 
     def add_new_ngram(self, ngram: str) -> None:
         """Add a new ngram to the first bin."""
@@ -54,41 +101,31 @@ class SRSDataBase:
             self.bins[0] = SRSBin()
 
         # add the ngram to the first bin
-        self.bins[0].ngrams.append(ngram)
+        self.bins[0].ngrams.add(ngram)
+        self.ngram_bins[ngram] = 0
 
     def find_ngram(self, ngram: str) -> Tuple[bool, int]:
         """Check if and where an ngram is in the database."""
-        ngram_is_in_database = False
-        ngram_bin_num = -1
-
-        for srs_bin_num, srs_bin in self.bins.items():
-            if ngram in srs_bin.ngrams:
-                ngram_is_in_database = True
-                ngram_bin_num = srs_bin_num
-                break
-
-        return ngram_is_in_database, ngram_bin_num
+        ngram_bin_num = self.ngram_bins.get(ngram, -1)
+        return ngram_bin_num >= 0, ngram_bin_num
 
     def check_integrity(self) -> bool:
         """Ngrams should only occur once in the complete database."""
-        ngrams = []
-        for _, srs_bin in self.bins.items():
-            ngrams.extend(srs_bin.ngrams)
-        ngram_counter = Counter(ngrams)
-
-        return sum(ngram_counter.values()) == len(ngram_counter.values())
+        # the index holds every ngram exactly once, so any duplicate across bins makes the bins larger than the index
+        return sum(len(srs_bin.ngrams) for srs_bin in self.bins.values()) == len(self.ngram_bins)
 
     def get_max_bin_num(self) -> int:
         return max(self.bins.keys())
 
 
-def update_srs_database_with_ngrams(
+def update_srs_database_with_ngram_counts(
     srs_database: SRSDataBase,
-    correct_ngrams: List[str],
-    typo_ngrams: List[str],
+    correct_counts: Mapping[str, int],
+    typo_counts: Mapping[str, int],
     session_name: str,
+    seed: Union[None, int, np.random.Generator] = None,
 ) -> None:
-    """Updates the SRSDataBase with the information on passed correct and typo ngrams.
+    """Updates the SRSDataBase with the number of occurrences of correct and typo ngrams in a session.
 
         three possible cases for ngram -> only typo, only correct, both
 
@@ -98,57 +135,114 @@ def update_srs_database_with_ngrams(
         typo and in database -> move down one bin
         both and not in database -> add
         both and in database -> random decision based on occurences
-    """
 
-    all_ngrams = list(set(typo_ngrams + correct_ngrams))
+        All ngrams are classified in one pass in sorted order, before the database is changed.
+        The random decisions for all ngrams of the last case are drawn at once from a numpy Generator created from seed.
+    """
 
-    if session_name in srs_database.sessions:
-        print(f"[WARING] update_srs_database_with_ngrams: Session {session_name} is already in the database.")
+    if srs_database.has_session(session_name):
+        print(f"[WARING] update_srs_database_with_ngram_counts: Session {session_name} is already in the database.")
         return
 
-    srs_database.sessions.append(session_name)
+    srs_database.add_session(session_name)
+
+    rng = np.random.default_rng(seed)
+
+    ngrams_to_move_up = []
+    ngrams_to_move_down = []
+    ngrams_to_add = []
+    # ngrams in the database that were typed both correctly and with typos, with their number of occurrences
+    uncertain_ngrams = []
+    uncertain_occurrences = []
 
-    # go through all ngrams
-    for ngram in all_ngrams:
+    for ngram in sorted(set(correct_counts) | set(typo_counts)):
         # check if the ngram is already in the database
         ngram_is_in_database, ngram_bin_num = srs_database.find_ngram(ngram)
-        if ngram_is_in_database:
-            assert ngram_bin_num >= 0, f"Bin number {ngram_bin_num} is invalid. Only bin numbers >=0 make sense."
+        typo_occurrences = typo_counts.get(ngram, 0)
+        correct_occurrences = correct_counts.get(ngram, 0)
 
         # correct
-        if ngram not in typo_ngrams:
+        if typo_occurrences == 0:
             if ngram_is_in_database:
-                srs_database.move_ngram_up(ngram, current_bin_num=ngram_bin_num)
-            else:
-                pass
+                ngrams_to_move_up.append((ngram, ngram_bin_num))
 
         # typo
-        elif ngram not in correct_ngrams:
+        elif correct_occurrences == 0:
             if ngram_is_in_database:
-                srs_database.move_ngram_down(ngram, current_bin_num=ngram_bin_num)
+                ngrams_to_move_down.append((ngram, ngram_bin_num))
             else:
-                srs_database.add_new_ngram(ngram)
+                ngrams_to_add.append(ngram)
 
         # both
         else:
             if ngram_is_in_database:
-                # move the ngram down with a probability of typos/(typos + correct)
-                correct_occurrences = correct_ngrams.count(ngram)
-                typo_occurences = typo_ngrams.count(ngram)
-                if random.random() < typo_occurences / (typo_occurences +
-                                                        correct_occurrences):
-                    srs_database.move_ngram_down(ngram, current_bin_num=ngram_bin_num)
-                else:
-                    pass
+                uncertain_ngrams.append((ngram, ngram_bin_num))
+                uncertain_occurrences.append((typo_occurrences, correct_occurrences))
             else:
-                srs_database.add_new_ngram(ngram)
+                ngrams_to_add.append(ngram)
+
+    if len(uncertain_ngrams) > 0:
+        # move the ngrams down with a probability of typos/(typos + correct)
+        occurrences = np.array(uncertain_occurrences, dtype=np.float64)
+        typo_probabilities = occurrences[:, 0] / occurrences.sum(axis=1)
+        move_down = rng.random(size=len(uncertain_ngrams)) < typo_probabilities
+        ngrams_to_move_down.extend(
+            uncertain_ngram for uncertain_ngram, down in zip(uncertain_ngrams, move_down) if down
+        )
+
+    for ngram, ngram_bin_num in ngrams_to_move_up:
+        srs_database.move_ngram_up(ngram, current_bin_num=ngram_bin_num)
+
+    for ngram, ngram_bin_num in ngrams_to_move_down:
+        srs_database.move_ngram_down(ngram, current_bin_num=ngram_bin_num)
+
+    for ngram in ngrams_to_add:
+        srs_database.add_new_ngram(ngram)
+
+
+def update_srs_database_with_ngrams(
+    srs_database: SRSDataBase,
+    correct_ngrams: List[str],
+    typo_ngrams: List[str],
+    session_name: str,
+    seed: Union[None, int, np.random.Generator] = None,
+) -> None:
+    """Updates the SRSDataBase with the information on passed correct and typo ngrams.
+
+        The occurrences of every ngram are counted once and passed to update_srs_database_with_ngram_counts.
+    """
+    update_srs_database_with_ngram_counts(
+        srs_database,
+        correct_counts=Counter(correct_ngrams),
+        typo_counts=Counter(typo_ngrams),
+        session_name=session_name,
+        seed=seed,
+    )
 
 
 def geometric_pmf(k: np.ndarray, p: float):
     return np.multiply(np.power(1 - p, k - 1), p)
 
 
-def sample_ngrams_from_srs_database(srs_database: SRSDataBase, num_ngrams: int, p: float = 0.5) -> List[str]:
+def sample_bin_sizes(max_bin_num: int, num_ngrams: int, p: float, rng: np.random.Generator) -> Counter:
+    """Number of ngrams to sample from each bin. Bins are sampled from a geometric distribution, clipped to max_bin_num, and every bin gets at least one ngram."""
+    selected_bins = np.clip(rng.geometric(p=p, size=num_ngrams) - 1, 0, max_bin_num)
+
+    bin_counter = Counter(selected_bins)
+
+    for bin_num in range(max_bin_num + 1):
+        if not bin_num in bin_counter.keys():
+            bin_counter[bin_num] = 1
+
+    return bin_counter
+
+
+def sample_ngrams_from_srs_database(
+    srs_database: SRSDataBase,
+    num_ngrams: int,
+    p: float = 0.5,
+    seed: Union[None, int, np.random.Generator] = None,
+) -> List[str]:
     """Select num_ngrams from the SRSDataBase. Distribution of ngrams over bins is sampled from a geometric disribution with success probability of p.
 
        At least one ngram per bin will be sampled into a list, that is shuffled and reduced to num_ngrams items, before being returned.
@@ -160,21 +254,14 @@ def sample_ngrams_from_srs_database(srs_database: SRSDataBase, num_ngrams: int,
 
     """
 
-    rng = np.random.default_rng()
+    rng = np.random.default_rng(seed)
 
-    max_bin_num = srs_database.get_max_bin_num()
-    selected_bins = np.clip(rng.geometric(p=p, size=num_ngrams) - 1, 0, max_bin_num)
-
-
-    bin_counter = Counter(selected_bins)
-
-    for bin_num in range(max_bin_num + 1):
-        if not bin_num in bin_counter.keys():
-            bin_counter[bin_num] = 1
+    bin_counter = sample_bin_sizes(srs_database.get_max_bin_num(), num_ngrams, p, rng)
 
     selected_ngrams = []
     for bin_num, ngram_num in bin_counter.items():
-        bin_ngrams = srs_database.bins[bin_num].ngrams
+        # sort the set of ngrams, so that sampling only depends on the state of the rng
+        bin_ngrams = sorted(srs_database.bins[bin_num].ngrams)
         selected_ngrams.extend(
                 rng.choice(
                     bin_ngrams,
@@ -183,26 +270,134 @@ def sample_ngrams_from_srs_database(srs_database: SRSDataBase, num_ngrams: int,
                     ),
                 )
 
-    np.random.shuffle(selected_ngrams)
+    rng.shuffle(selected_ngrams)
 
     return selected_ngrams[:num_ngrams]
 
 
+class SRSSampler:
+    """Samples the ngrams of many practice texts at once, with the same distribution as sample_ngrams_from_srs_database.
+
+       The ngrams of all bins are kept in one sorted array, ordered by bin, so samples are drawn as integer ids
+       for all texts together and only decoded into strings at the end.
+    """
+
+    def __init__(self, srs_database: SRSDataBase) -> None:
+        self.max_bin_num = srs_database.get_max_bin_num()
+        bin_ngrams = [sorted(srs_database.bins[bin_num].ngrams) if bin_num in srs_database.bins else [] for bin_num in range(self.max_bin_num + 1)]
+        self.bin_sizes = np.array([len(ngrams) for ngrams in bin_ngrams], dtype=np.int64)
+        self.bin_offsets = np.cumsum(self.bin_sizes) - self.bin_sizes
+        self.ngrams = np.array([ngram for ngrams in bin_ngrams for ngram in ngrams], dtype=str)
+
+    def sample_ngram_ids(
+        self,
+        num_ngrams: int,
+        num_texts: int = 1,
+        p: float = 0.5,
+        seed: Union[None, int, np.random.Generator] = None,
+    ) -> np.ndarray:
+        """Ids into self.ngrams of num_ngrams ngrams for each of num_texts texts. Texts with fewer ngrams are padded with -1."""
+        rng = np.random.default_rng(seed)
+        num_bins = self.max_bin_num + 1
+
+        # number of ngrams per text and bin, with at least one ngram per bin, limited by the size of the bin
+        selected_bins = np.clip(rng.geometric(p=p, size=(num_texts, num_ngrams)) - 1, 0, self.max_bin_num)
+        bin_counts = np.zeros((num_texts, num_bins), dtype=np.int64)
+        np.add.at(bin_counts, (np.arange(num_texts)[:, None], selected_bins), 1)
+        bin_counts = np.minimum(np.maximum(bin_counts, 1), self.bin_sizes)
+
+        # draw without replacement within every bin for all texts at once:
+        # the j-th draw is uniform over the positions that were not drawn before, and is shifted past all earlier draws below it
+        max_total = int(bin_counts.sum(axis=1).max()) if num_texts > 0 else 0
+        selected_ids = np.full((num_texts, max_total), -1, dtype=np.int64)
+        num_selected = np.zeros(num_texts, dtype=np.int64)
+        for bin_num in range(num_bins):
+            previous_positions = []
+            for j in range(int(bin_counts[:, bin_num].max(initial=0))):
+                is_drawing = bin_counts[:, bin_num] > j
+                positions = rng.integers(0, np.maximum(self.bin_sizes[bin_num] - j, 1), size=num_texts)
+                if len(previous_positions) > 0:
+                    for previous in np.sort(np.stack(previous_positions, axis=1), axis=1).T:
+                        positions += previous <= positions
+                previous_positions.append(positions)
+
+                rows = np.flatnonzero(is_drawing)
+                selected_ids[rows, num_selected[rows]] = self.bin_offsets[bin_num] + positions[rows]
+                num_selected[rows] += 1
+
+        # shuffle every text by sorting random keys, with the padding at the end, and keep num_ngrams ngrams
+        keys = rng.random(size=selected_ids.shape)
+        keys[selected_ids < 0] = np.inf
+        order = np.argsort(keys, axis=1)
+        return np.take_along_axis(selected_ids, order, axis=1)[:, :num_ngrams]
+
+    def sample(
+        self,
+        num_ngrams: int,
+        num_texts: int = 1,
+        p: float = 0.5,
+        seed: Union[None, int, np.random.Generator] = None,
+    ) -> List[List[str]]:
+        """Ngrams for each of num_texts texts, see sample_ngrams_from_srs_database."""
+        return [
+            [str(self.ngrams[ngram_id]) for ngram_id in text_ngram_ids if ngram_id >= 0]
+            for text_ngram_ids in self.sample_ngram_ids(num_ngrams, num_texts=num_texts, p=p, seed=seed)
+        ]
+
+
 def write_srs_database(srs_database: SRSDataBase, database_save_path: Path = Path("data") / "srs_database.pkl") -> None:
     """Save the database to disk."""
     with open(str(database_save_path), "wb") as output_file:
         pickle.dump(srs_database, output_file)
 
 
-def update_srs_database_from_latest_session(data_dir: Path = Path("data"), srs_database_name: str = "srs_database.pkl") -> None:
-    """Look for the latest session database and update the SRSDataBase with the data from that session."""
+def open_srs_database(srs_database_path: Path):
+    """SQLiteSRSStore for .sqlite, CompactSRSDataBase for .npz and a pickled SRSDataBase for all other suffixes.
+
+       A database that does not exist yet starts empty.
+    """
+    if srs_database_path.suffix == ".sqlite":
+        # imported here, because the store itself depends on this module
+        from utils.srs_sqlite import SQLiteSRSStore
+        return SQLiteSRSStore(srs_database_path)
+
+    if srs_database_path.suffix == ".npz":
+        # imported here, because the compact database itself depends on this module
+        from utils.srs_compact import CompactSRSDataBase
+        return CompactSRSDataBase.load(srs_database_path) if srs_database_path.is_file() else CompactSRSDataBase()
+
+    return read_database(srs_database_path) if srs_database_path.is_file() else SRSDataBase()
+
+
+def srs_database_has_ngrams(srs_database) -> bool:
+    """Whether an SRS database opened with open_srs_database holds any ngrams to sample, e.g. not after a first session without typos."""
+    if isinstance(srs_database, SRSDataBase):
+        return len(srs_database.ngram_bins) > 0
+    return len(srs_database) > 0
+
 
-    assert data_dir.is_dir()
+def close_srs_database(srs_database, srs_database_path: Path, write: bool = True) -> None:
+    """Write an SRS database opened with open_srs_database, unless write is False. SQLite stores are only closed, they write every update."""
+    if hasattr(srs_database, "close"):
+        srs_database.close()
+    elif not write:
+        return
+    elif isinstance(srs_database, SRSDataBase):
+        write_srs_database(srs_database, srs_database_path)
+    else:
+        srs_database.save(srs_database_path)
+
+
+def update_srs_database_from_latest_session(
+    data_dir: Path = Path("data"),
+    srs_database_name: str = "srs_database.pkl",
+    seed: Union[None, int, np.random.Generator] = None,
+) -> None:
+    """Look for the latest session database, in data_dir or its archive, and update the SRSDataBase with the data from that session."""
 
     # get data from latest session
-    session_database_paths = [database_path for database_path in data_dir.iterdir() if "session" in database_path.name]
-    assert len(session_database_paths) > 0
-    session_database_paths.sort()
+    session_database_paths = unprocessed_session_paths(data_dir)
+    assert len(session_database_paths) > 0, f"Cannot find any session in {data_dir.absolute()}."
     correct_ngrams, typo_ngrams = ngrams_from_session(session_database_paths[-1])
 
     # get srs data
@@ -213,5 +408,84 @@ def update_srs_database_from_latest_session(data_dir: Path = Path("data"), srs_d
         srs_database= read_database(srs_database_path)
 
     # update the srs database
-    update_srs_database_with_ngrams(srs_database, correct_ngrams, typo_ngrams, session_name=session_database_paths[-1].name)
-    write_srs_database(srs_database)
+    update_srs_database_with_ngrams(srs_database, correct_ngrams, typo_ngrams, session_name=session_database_paths[-1].name, seed=seed)
+    write_srs_database(srs_database, srs_database_path)
+
+
+def print_progress(num_processed: int, num_sessions: int, session_name: str) -> None:
+    print(f"[{num_processed}/{num_sessions}] Updated SRS database with {session_name}")
+
+
+def backfill_srs_database(
+    data_dir: Path = Path("data"),
+    srs_database_name: str = "srs_database.pkl",
+    seed: Union[None, int, np.random.Generator] = None,
+    num_workers: Optional[int] = None,
+    progress: Optional[Callable[[int, int, str], None]] = print_progress,
+    slow_ngram_threshold: Optional[float] = 1.5,
+    exclude: Optional[List[Path]] = None,
+    max_sessions: Optional[int] = None,
+) -> Optional[List[str]]:
+    """Update the SRSDataBase with every session in data_dir that it does not contain yet.
+
+       Sessions in exclude, e.g. the journal of a running session, are skipped.
+       Ngrams that are typed slower than slow_ngram_threshold times the median inter-key delay of a session are handled like typos.
+       Pass None to only use typos.
+       The ngrams of the sessions are extracted in a pool of num_workers processes, but the database is updated in chronological order
+       with a single random generator created from seed, so the result does not depend on the number of workers.
+       The format of the SRS database depends on the suffix of srs_database_name, see open_srs_database.
+       Returns the names of the processed sessions. If there are more than max_sessions new sessions, none of them is processed
+       and None is returned, e.g. to leave a long backfill to a background process.
+    """
+
+    session_database_paths = unprocessed_session_paths(data_dir, exclude=exclude)
+    if len(session_database_paths) == 0:
+        # opening an SQLite store would create an empty database file
+        return []
+
+    # get srs data
+    srs_database_path = data_dir / srs_database_name
+    srs_database = open_srs_database(srs_database_path)
+
+    session_database_paths = [database_path for database_path in session_database_paths if not srs_database.has_session(database_path.name)]
+
+    if len(session_database_paths) == 0:
+        close_srs_database(srs_database, srs_database_path, write=False)
+        return []
+    if max_sessions is not None and len(session_database_paths) > max_sessions:
+        close_srs_database(srs_database, srs_database_path, write=False)
+        return None
+
+    rng = np.random.default_rng(seed)
+
+    if slow_ngram_threshold is None:
+        count_ngrams = ngram_counts_from_session
+    else:
+        count_ngrams = partial(ngram_counts_from_session_with_latency, slow_threshold=slow_ngram_threshold)
+
+    if len(session_database_paths) == 1 or num_workers == 1:
+        session_ngram_counts = map(count_ngrams, session_database_paths)
+        executor = None
+    else:
+        # imported here, because starting the process machinery is only worth it for several sessions
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=num_workers)
+        # map returns the results in the order of the sessions, even if they finish out of order
+        session_ngram_counts = executor.map(count_ngrams, session_database_paths)
+
+    try:
+        for num_processed, (session_database_path, (correct_counts, typo_counts)) in enumerate(zip(session_database_paths, session_ngram_counts), start=1):
+            if isinstance(srs_database, SRSDataBase):
+                update_srs_database_with_ngram_counts(srs_database, correct_counts, typo_counts, session_name=session_database_path.name, seed=rng)
+            else:
+                # SQLite stores commit every session in its own transaction
+                srs_database.update_with_ngram_counts(correct_counts, typo_counts, session_name=session_database_path.name, seed=rng)
+            if progress is not None:
+                progress(num_processed, len(session_database_paths), session_database_path.name)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    close_srs_database(srs_database, srs_database_path)
+
+    return [session_database_path.name for session_database_path in session_database_paths]
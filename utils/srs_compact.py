@@ -0,0 +1,180 @@
+import numpy as np
+
+from pathlib import Path
+from typing import Iterable, List, Mapping, Optional, Union
+
+from utils.srs import SRSBin, SRSDataBase, sample_bin_sizes
+
+
+def encode_ngrams(ngrams: Iterable[str]) -> np.ndarray:
+    """Fixed-width byte array of the utf-8 encoded ngrams."""
+    encoded_ngrams = [ngram.encode("utf-8") for ngram in ngrams]
+    return np.array(encoded_ngrams, dtype=bytes) if len(encoded_ngrams) > 0 else np.empty(0, dtype="S1")
+
+
+class CompactSRSDataBase:
+    """SRS database with integer ngram ids instead of sets of strings.
+
+       ngrams is the vocabulary, a fixed-width array of utf-8 encoded ngrams in which the position of an ngram is its id,
+       and bin_nums holds the bin of every id. utf-8 bytes sort like the code points of the strings, so the order of strings is kept.
+       Ids never change, new ngrams are appended. order holds the ids sorted by ngram, so ngrams are found with a binary search
+       and the members of a bin come out of bin_nums in sorted order, without a second copy of any string.
+       Updates and samples are the same as for an SRSDataBase with the same content and seed.
+    """
+
+    def __init__(
+        self,
+        ngrams: Optional[np.ndarray] = None,
+        bin_nums: Optional[np.ndarray] = None,
+        sessions: Optional[List[str]] = None,
+        num_bins: Optional[int] = None,
+    ) -> None:
+        self.ngrams = ngrams if ngrams is not None else np.empty(0, dtype="S1")
+        self.bin_nums = bin_nums.astype(np.int16) if bin_nums is not None else np.empty(0, dtype=np.int16)
+        assert len(self.ngrams) == len(self.bin_nums)
+        self.sessions = list(sessions) if sessions is not None else []
+        self.session_names = set(self.sessions)
+        # bins can be empty, e.g. when their last ngram moved up, but they still count for sampling like the bins of an SRSDataBase
+        self.num_bins = num_bins if num_bins is not None else (int(self.bin_nums.max()) + 1 if len(self.bin_nums) > 0 else 0)
+        self.order = np.argsort(self.ngrams, kind="stable").astype(np.int32)
+
+    def __len__(self) -> int:
+        return len(self.ngrams)
+
+    @classmethod
+    def from_srs_database(cls, srs_database: SRSDataBase) -> "CompactSRSDataBase":
+        ngram_bins = srs_database.ngram_bins
+        return cls(
+            ngrams=encode_ngrams(ngram_bins.keys()),
+            bin_nums=np.fromiter(ngram_bins.values(), dtype=np.int16, count=len(ngram_bins)),
+            sessions=srs_database.sessions,
+            num_bins=srs_database.get_max_bin_num() + 1 if len(srs_database.bins) > 0 else 0,
+        )
+
+    def to_srs_database(self) -> SRSDataBase:
+        bins = {bin_num: SRSBin() for bin_num in range(self.num_bins)}
+        for ngram, bin_num in zip(self.ngrams.tolist(), self.bin_nums.tolist()):
+            bins[bin_num].ngrams.add(ngram.decode("utf-8"))
+        return SRSDataBase(bins=bins, sessions=list(self.sessions))
+
+    def save(self, database_path: Path) -> None:
+        """Write the vocabulary, the bins and the sessions into an .npz file that can be loaded without pickle."""
+        with open(str(database_path), "wb") as output_file:
+            np.savez(
+                output_file,
+                ngrams=self.ngrams,
+                bin_nums=self.bin_nums,
+                sessions=np.array(self.sessions, dtype=str),
+                num_bins=np.array(self.num_bins),
+            )
+
+    @classmethod
+    def load(cls, database_path: Path) -> "CompactSRSDataBase":
+        with np.load(str(database_path.absolute()), allow_pickle=False) as arrays:
+            return cls(
+                ngrams=arrays["ngrams"],
+                bin_nums=arrays["bin_nums"],
+                sessions=arrays["sessions"].tolist(),
+                num_bins=int(arrays["num_bins"]),
+            )
+
+    def nbytes(self) -> int:
+        """Bytes of the arrays, without the session names."""
+        return self.ngrams.nbytes + self.bin_nums.nbytes + self.order.nbytes
+
+    def has_session(self, session_name: str) -> bool:
+        return session_name in self.session_names
+
+    def get_max_bin_num(self) -> int:
+        assert self.num_bins > 0, "The SRS database does not contain any ngrams."
+        return self.num_bins - 1
+
+    def find_ngram_ids(self, ngrams: np.ndarray) -> np.ndarray:
+        """Ids of the encoded ngrams, -1 for ngrams that are not in the database."""
+        if len(self.ngrams) == 0:
+            return np.full(len(ngrams), -1, dtype=np.int64)
+        positions = np.searchsorted(self.ngrams, ngrams, sorter=self.order)
+        ids = self.order[np.minimum(positions, len(self.order) - 1)]
+        return np.where(self.ngrams[ids] == ngrams, ids, -1)
+
+    def bin_ids(self) -> List[np.ndarray]:
+        """Ids of the ngrams in every bin, sorted by ngram."""
+        ids_by_bin = self.order[np.argsort(self.bin_nums[self.order], kind="stable")]
+        bin_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.bin_nums, minlength=self.num_bins))])
+        return [ids_by_bin[bin_offsets[bin_num]:bin_offsets[bin_num + 1]] for bin_num in range(self.num_bins)]
+
+    def update_with_ngram_counts(
+        self,
+        correct_counts: Mapping[str, int],
+        typo_counts: Mapping[str, int],
+        session_name: str,
+        seed: Union[None, int, np.random.Generator] = None,
+    ) -> None:
+        """Same as update_srs_database_with_ngram_counts, but all ngrams of the session are classified and moved with array operations."""
+        if self.has_session(session_name):
+            print(f"[WARING] CompactSRSDataBase.update_with_ngram_counts: Session {session_name} is already in the database.")
+            return
+
+        self.sessions.append(session_name)
+        self.session_names.add(session_name)
+
+        rng = np.random.default_rng(seed)
+
+        session_ngrams = sorted(set(correct_counts) | set(typo_counts))
+        if len(session_ngrams) == 0:
+            return
+        correct_occurrences = np.array([correct_counts.get(ngram, 0) for ngram in session_ngrams], dtype=np.int64)
+        typo_occurrences = np.array([typo_counts.get(ngram, 0) for ngram in session_ngrams], dtype=np.int64)
+        session_ngrams = encode_ngrams(session_ngrams)
+
+        ids = self.find_ngram_ids(session_ngrams)
+        is_in_database = ids >= 0
+        move_up = is_in_database & (typo_occurrences == 0)
+        move_down = is_in_database & (typo_occurrences > 0) & (correct_occurrences == 0)
+        is_uncertain = is_in_database & (typo_occurrences > 0) & (correct_occurrences > 0)
+        add = ~is_in_database & (typo_occurrences > 0)
+
+        num_uncertain = int(is_uncertain.sum())
+        if num_uncertain > 0:
+            # move the ngrams down with a probability of typos/(typos + correct), drawn in sorted order like the reference
+            typo_probabilities = typo_occurrences[is_uncertain] / (typo_occurrences[is_uncertain] + correct_occurrences[is_uncertain])
+            move_down[is_uncertain] = rng.random(size=num_uncertain) < typo_probabilities
+
+        self.bin_nums[ids[move_up]] += 1
+        if np.any(move_up):
+            self.num_bins = max(self.num_bins, int(self.bin_nums[ids[move_up]].max()) + 1)
+        # ngrams in the first bin stay there
+        self.bin_nums[ids[move_down]] = np.maximum(self.bin_nums[ids[move_down]] - 1, 0)
+
+        new_ngrams = session_ngrams[add]
+        if len(new_ngrams) > 0:
+            # the new ngrams are sorted and not in the vocabulary, so they can be merged into the sorted order
+            positions = np.searchsorted(self.ngrams, new_ngrams, sorter=self.order) if len(self.ngrams) > 0 else np.zeros(len(new_ngrams), dtype=np.int64)
+            new_ids = np.arange(len(self.ngrams), len(self.ngrams) + len(new_ngrams), dtype=np.int32)
+            self.ngrams = np.concatenate([self.ngrams, new_ngrams])
+            self.bin_nums = np.concatenate([self.bin_nums, np.zeros(len(new_ngrams), dtype=np.int16)])
+            self.order = np.insert(self.order, positions, new_ids)
+            self.num_bins = max(self.num_bins, 1)
+
+    def sample_ngrams(
+        self,
+        num_ngrams: int,
+        p: float = 0.5,
+        seed: Union[None, int, np.random.Generator] = None,
+    ) -> List[str]:
+        """Same as sample_ngrams_from_srs_database."""
+        rng = np.random.default_rng(seed)
+
+        bin_counter = sample_bin_sizes(self.get_max_bin_num(), num_ngrams, p, rng)
+        bin_ids = self.bin_ids()
+
+        selected_ngrams = []
+        for bin_num, ngram_num in bin_counter.items():
+            bin_ngrams = self.ngrams[bin_ids[bin_num]]
+            selected_ngrams.extend(
+                ngram.decode("utf-8") for ngram in rng.choice(bin_ngrams, size=min(ngram_num, len(bin_ngrams)), replace=False).tolist()
+            )
+
+        rng.shuffle(selected_ngrams)
+
+        return selected_ngrams[:num_ngrams]
@@ -0,0 +1,178 @@
+import sqlite3
+import numpy as np
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Union
+
+from utils.data import read_database
+from utils.srs import SRSBin, SRSDataBase, sample_bin_sizes, update_srs_database_with_ngram_counts
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ngrams (
+    ngram TEXT PRIMARY KEY,
+    bin INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ngrams_bin ON ngrams (bin, ngram);
+CREATE TABLE IF NOT EXISTS sessions (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SQLiteSRSStore:
+    """SRS database stored in SQLite, with one row per ngram and its bin, and one row per processed session.
+
+       Updates only write the changed ngrams in a single transaction, so a failure never leaves a partially written database behind.
+       The number of bins is stored as well, because bins can be empty, e.g. when their last ngram moved up,
+       but they still count for sampling like the bins of an SRSDataBase.
+    """
+
+    def __init__(self, database_path: Path) -> None:
+        self.database_path = database_path
+        self.connection = sqlite3.connect(str(database_path))
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM ngrams").fetchone()[0]
+
+    def has_session(self, session_name: str) -> bool:
+        return self.connection.execute("SELECT 1 FROM sessions WHERE name = ?", (session_name,)).fetchone() is not None
+
+    @property
+    def num_bins(self) -> int:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'num_bins'").fetchone()
+        if row is not None:
+            return row[0]
+        # stores written before the number of bins was stored, empty bins at the top are lost in them
+        max_bin_num = self.connection.execute("SELECT MAX(bin) FROM ngrams").fetchone()[0]
+        return max_bin_num + 1 if max_bin_num is not None else 0
+
+    def set_num_bins(self, num_bins: int) -> None:
+        """Store the number of bins, inside the transaction of the caller."""
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('num_bins', ?)", (num_bins,))
+
+    def get_max_bin_num(self) -> int:
+        assert self.num_bins > 0, "The SRS database does not contain any ngrams."
+        return self.num_bins - 1
+
+    def find_ngrams(self, ngrams: Iterable[str]) -> Dict[str, int]:
+        """Bin numbers of all passed ngrams that are in the database."""
+        ngram_bins = {}
+        ngrams = list(ngrams)
+        # stay below the limit of variables in a statement of older SQLite versions
+        chunk_size = 900
+        for start in range(0, len(ngrams), chunk_size):
+            chunk = ngrams[start:start + chunk_size]
+            rows = self.connection.execute(
+                f"SELECT ngram, bin FROM ngrams WHERE ngram IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            ngram_bins.update(rows)
+        return ngram_bins
+
+    def update_with_ngram_counts(
+        self,
+        correct_counts: Mapping[str, int],
+        typo_counts: Mapping[str, int],
+        session_name: str,
+        seed: Union[None, int, np.random.Generator] = None,
+    ) -> None:
+        """Same as update_srs_database_with_ngram_counts, but only the ngrams of the session are loaded and only the changed ones are written."""
+        if self.has_session(session_name):
+            print(f"[WARING] SQLiteSRSStore.update_with_ngram_counts: Session {session_name} is already in the database.")
+            return
+
+        session_ngram_bins = self.find_ngrams(set(correct_counts) | set(typo_counts))
+
+        # database that holds only the ngrams of the session, with all bins of the store,
+        # so the ngrams can be moved exactly as in the full database
+        partial_database = SRSDataBase(bins={bin_num: SRSBin() for bin_num in range(self.num_bins)})
+        for ngram, bin_num in session_ngram_bins.items():
+            partial_database.bins[bin_num].ngrams.add(ngram)
+        partial_database.rebuild_index()
+
+        update_srs_database_with_ngram_counts(partial_database, correct_counts, typo_counts, session_name, seed=seed)
+
+        changed_rows = [
+            (ngram, bin_num) for ngram, bin_num in partial_database.ngram_bins.items()
+            if session_ngram_bins.get(ngram) != bin_num
+        ]
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO ngrams (ngram, bin) VALUES (?, ?)", changed_rows)
+            self.connection.execute("INSERT INTO sessions (name) VALUES (?)", (session_name,))
+            self.set_num_bins(len(partial_database.bins))
+
+    def sample_ngrams(
+        self,
+        num_ngrams: int,
+        p: float = 0.5,
+        seed: Union[None, int, np.random.Generator] = None,
+    ) -> List[str]:
+        """Same as sample_ngrams_from_srs_database, but only the sampled ngrams are read from the database."""
+        rng = np.random.default_rng(seed)
+
+        bin_counter = sample_bin_sizes(self.get_max_bin_num(), num_ngrams, p, rng)
+
+        bin_sizes = dict(self.connection.execute("SELECT bin, COUNT(*) FROM ngrams GROUP BY bin").fetchall())
+        # positions in the sorted bins, exactly as they are drawn from the sorted ngrams of an SRSBin
+        bin_positions = []
+        for bin_num, ngram_num in bin_counter.items():
+            bin_size = bin_sizes.get(int(bin_num), 0)
+            bin_positions.extend((int(bin_num), int(position)) for position in rng.choice(bin_size, size=min(ngram_num, bin_size), replace=False))
+
+        # all sampled rows are read in one query, that numbers the ngrams of every bin along the (bin, ngram) index
+        sampled_rows = {}
+        if len(bin_positions) > 0:
+            rows = self.connection.execute(
+                f"""WITH sampled (bin, position) AS (VALUES {', '.join(['(?, ?)'] * len(bin_positions))}),
+                    numbered AS (
+                        SELECT bin, ngram, ROW_NUMBER() OVER (PARTITION BY bin ORDER BY ngram) - 1 AS position
+                        FROM ngrams WHERE bin IN (SELECT bin FROM sampled)
+                    )
+                    SELECT numbered.bin, numbered.position, numbered.ngram FROM numbered JOIN sampled USING (bin, position)""",
+                [value for bin_position in bin_positions for value in bin_position],
+            )
+            sampled_rows = {(bin_num, position): ngram for bin_num, position, ngram in rows}
+        selected_ngrams = [sampled_rows[bin_position] for bin_position in bin_positions]
+
+        rng.shuffle(selected_ngrams)
+
+        return selected_ngrams[:num_ngrams]
+
+    def read_ngram_bins(self) -> Dict[str, int]:
+        """Bin numbers of all ngrams, read with a single query."""
+        return dict(self.connection.execute("SELECT ngram, bin FROM ngrams"))
+
+    def to_srs_database(self) -> SRSDataBase:
+        """Load the complete store into an SRSDataBase."""
+        srs_database = SRSDataBase(bins={bin_num: SRSBin() for bin_num in range(self.num_bins)})
+        for ngram, bin_num in self.read_ngram_bins().items():
+            srs_database.bins[bin_num].ngrams.add(ngram)
+        srs_database.sessions = [name for name, in self.connection.execute("SELECT name FROM sessions ORDER BY position")]
+        srs_database.rebuild_index()
+        return srs_database
+
+    def import_srs_database(self, srs_database: SRSDataBase) -> None:
+        """Replace the content of the store with an SRSDataBase."""
+        with self.connection:
+            self.connection.execute("DELETE FROM ngrams")
+            self.connection.execute("DELETE FROM sessions")
+            self.connection.executemany("INSERT INTO ngrams (ngram, bin) VALUES (?, ?)", srs_database.ngram_bins.items())
+            self.connection.executemany("INSERT INTO sessions (name) VALUES (?)", ((name,) for name in srs_database.sessions))
+            self.set_num_bins(srs_database.get_max_bin_num() + 1 if len(srs_database.bins) > 0 else 0)
+
+
+def import_srs_database_pickle(pickle_path: Path, sqlite_path: Path) -> SQLiteSRSStore:
+    """Create an SQLite store from a pickled SRSDataBase, e.g. data/srs_database.pkl."""
+    store = SQLiteSRSStore(sqlite_path)
+    store.import_srs_database(read_database(pickle_path))
+    return store
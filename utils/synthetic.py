@@ -0,0 +1,134 @@
+import string
+import numpy as np
+
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from utils.data import SessionDatabase, SessionDatabaseEntry
+from utils.engine import BACKSPACE_KEY
+from utils.srs import SRSBin, SRSDataBase
+
+
+def synthetic_words(
+    num_words: int,
+    seed: Union[None, int, np.random.Generator] = None,
+    min_length: int = 2,
+    max_length: int = 12,
+) -> List[str]:
+    """Random lowercase words, with letters drawn roughly by their frequency in english text."""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_lowercase))
+    frequencies = np.array([
+        8.2, 1.5, 2.8, 4.3, 12.7, 2.2, 2.0, 6.1, 7.0, 0.2, 0.8, 4.0, 2.4,
+        6.7, 7.5, 1.9, 0.1, 6.0, 6.3, 9.1, 2.8, 1.0, 2.4, 0.2, 2.0, 0.1,
+    ])
+    lengths = rng.integers(min_length, max_length + 1, size=num_words)
+    characters = rng.choice(letters, size=int(lengths.sum()), p=frequencies / frequencies.sum())
+    ends = np.cumsum(lengths)
+    return ["".join(characters[end - length:end]) for end, length in zip(ends, lengths)]
+
+
+def write_word_file(word_file_path: Path, words: List[str]) -> None:
+    """Write words in the format of /usr/share/dict/words."""
+    with open(str(word_file_path), "w") as word_file:
+        word_file.write("\n".join(words) + "\n")
+
+
+def synthetic_text(words: List[str], num_words: int, seed: Union[None, int, np.random.Generator] = None) -> str:
+    rng = np.random.default_rng(seed)
+    return " ".join(words[word_id] for word_id in rng.integers(len(words), size=num_words))
+
+
+def synthetic_session(
+    num_entries: int,
+    words: List[str],
+    typo_rate: float = 0.05,
+    mean_delay: float = 0.2,
+    seed: Union[None, int, np.random.Generator] = None,
+    date: str = "2000-01-01_00-00",
+) -> SessionDatabase:
+    """A session of num_entries keystrokes typing a random text of words, with typos at typo_rate and exponentially distributed inter-key delays."""
+    rng = np.random.default_rng(seed)
+    text = synthetic_text(words, num_words=num_entries // 4 + 1, seed=rng)[:num_entries]
+
+    is_typo = rng.random(size=len(text)) < typo_rate
+    times = np.cumsum(rng.exponential(mean_delay, size=len(text)))
+    typo_characters = rng.choice(list(string.ascii_lowercase), size=len(text))
+
+    entries = []
+    word_index = 0
+    location_in_word = 0
+    text_words = text.split(" ")
+    for location, char in enumerate(text):
+        current_input = str(typo_characters[location]) if is_typo[location] else char
+        entries.append(SessionDatabaseEntry(
+            input=current_input,
+            text=char,
+            correct=current_input == char,
+            word=text_words[word_index],
+            location_in_word=location_in_word,
+            time=float(times[location]),
+        ))
+        location_in_word += 1
+        if char == " ":
+            word_index += 1
+            location_in_word = 0
+
+    return SessionDatabase(entries=entries, date=date)
+
+
+def synthetic_srs_database(
+    num_ngrams: int,
+    num_bins: int = 8,
+    p: float = 0.5,
+    words: Optional[List[str]] = None,
+    seed: Union[None, int, np.random.Generator] = None,
+    n: Tuple[int, ...] = (2, 3),
+) -> SRSDataBase:
+    """An SRSDataBase with up to num_ngrams ngrams of the sizes in n, spread geometrically over num_bins bins."""
+    rng = np.random.default_rng(seed)
+    if words is None:
+        words = synthetic_words(max(num_ngrams // 2, 1), seed=rng)
+
+    ngrams = set()
+    for word in words:
+        for current_n in n:
+            for i in range(len(word) - current_n + 1):
+                ngrams.add(word[i:i + current_n])
+        if len(ngrams) >= num_ngrams:
+            break
+    ngrams = sorted(ngrams)[:num_ngrams]
+
+    bin_nums = np.clip(rng.geometric(p=p, size=len(ngrams)) - 1, 0, num_bins - 1)
+    bins = {bin_num: SRSBin() for bin_num in range(num_bins)}
+    for ngram, bin_num in zip(ngrams, bin_nums):
+        bins[int(bin_num)].ngrams.add(ngram)
+
+    return SRSDataBase(bins=bins)
+
+
+def synthetic_keystrokes(
+    text: str,
+    typo_rate: float = 0.05,
+    correction_rate: float = 0.5,
+    mean_delay: float = 0.2,
+    seed: Union[None, int, np.random.Generator] = None,
+) -> List[Tuple[str, float]]:
+    """Keys with time stamps that type text completely, with typos at typo_rate, of which correction_rate are corrected with a backspace."""
+    rng = np.random.default_rng(seed)
+    is_typo = rng.random(size=len(text)) < typo_rate
+    is_corrected = rng.random(size=len(text)) < correction_rate
+    typo_characters = rng.choice(list(string.ascii_lowercase), size=len(text))
+
+    keys = []
+    for location, char in enumerate(text):
+        if is_typo[location]:
+            keys.append(str(typo_characters[location]))
+            if is_corrected[location]:
+                keys.append(BACKSPACE_KEY)
+                keys.append(char)
+        else:
+            keys.append(char)
+
+    times = np.cumsum(rng.exponential(mean_delay, size=len(keys)))
+    return list(zip(keys, times.tolist()))
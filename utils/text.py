@@ -0,0 +1,169 @@
+import numpy as np
+
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+from utils.data import read_database
+from utils.ngram import NgramWordIndex, load_word_index
+from utils.srs import SRSDataBase, backfill_srs_database, close_srs_database, open_srs_database, sample_ngrams_from_srs_database, srs_database_has_ngrams
+
+
+def assemble_text(
+    sampled_ngrams: List[str],
+    word_index: NgramWordIndex,
+    num_words_in_text: int,
+    seed: Union[None, int, np.random.Generator] = None,
+    word_pairs: Sequence[Tuple[str, str]] = (),
+    selected_words: Sequence[str] = (),
+) -> str:
+    """Create a practice text with the selected words and one random word per sampled ngram, filled up with random words to num_words_in_text words.
+
+       Every word pair is inserted as two consecutive words at a random position.
+    """
+    rng = np.random.default_rng(seed)
+    sampled_ngrams = list(sampled_ngrams)
+    words = word_index.words
+
+    text_words = list(selected_words)
+
+    while len(sampled_ngrams) > 0:
+        ngram = sampled_ngrams.pop()
+        ngram_word_ids = word_index.word_ids_with_ngram(ngram)
+        # if there is no word matching the ngram, add the ngram itself
+        if len(ngram_word_ids) == 0:
+            if len(ngram) > 0:
+                text_words.append(str(ngram))
+        else:
+            text_words.append(words[rng.choice(ngram_word_ids)])
+
+    num_missing_words = num_words_in_text - len(text_words)
+    if num_missing_words > 0:
+        text_words.extend(words[word_id] for word_id in rng.integers(len(words), size=num_missing_words))
+    if len(selected_words) > 0:
+        # the selected words are sorted by how much they cover, which should not show in the text
+        rng.shuffle(text_words)
+
+    for first_word, second_word in word_pairs:
+        position = int(rng.integers(len(text_words) + 1))
+        text_words[position:position] = [first_word, second_word]
+
+    return " ".join(text_words)
+
+
+def update_practice_history(
+    data_dir: Path = Path("data"),
+    srs_database_name: str = "srs_database.pkl",
+    word_pair_tracker_name: str = "word_pair_tracker.pkl",
+    exclude: Optional[List[Path]] = None,
+    num_workers: Optional[int] = None,
+    max_sessions: Optional[int] = None,
+):
+    """Fold all finished sessions into the SRS database and the word pair tracker, and return the WordPairTracker.
+
+       Sessions in exclude, e.g. the journal of the running round, are skipped.
+       If more than max_sessions sessions are new, e.g. after a crash or an import, nothing is folded in and None is returned,
+       so the caller can leave the backfill to a background process.
+    """
+    # imported here, because importing this module is on the startup path of the app
+    from utils.word_pairs import backfill_word_pair_tracker
+
+    # process all sessions that are not in the srs database yet, not only the latest one
+    processed_sessions = backfill_srs_database(
+        data_dir=data_dir,
+        srs_database_name=srs_database_name,
+        num_workers=num_workers,
+        progress=None,
+        exclude=exclude,
+        max_sessions=max_sessions,
+    )
+    if processed_sessions is None:
+        return None
+
+    return backfill_word_pair_tracker(data_dir=data_dir, tracker_name=word_pair_tracker_name, exclude=exclude, max_sessions=max_sessions)
+
+
+def update_practice_history_in_background(**kwargs) -> None:
+    """update_practice_history for a worker process. The WordPairTracker is not returned, since it would be pickled and sent to the app, which does not need it."""
+    update_practice_history(**kwargs)
+
+
+def prepare_practice_text(
+    data_dir: Path = Path("data"),
+    srs_database_name: str = "srs_database.pkl",
+    word_file_path: Path = Path("/usr/share/dict/words"),
+    word_index_name: str = "word_index",
+    num_words_in_text: int = 20,
+    exploration_percentage: float = 0.2,
+    num_word_pairs: int = 2,
+    word_pair_tracker_name: str = "word_pair_tracker.pkl",
+    exclude: Optional[List[Path]] = None,
+    word_index: Optional[NgramWordIndex] = None,
+    num_workers: Optional[int] = None,
+    corpus_path: Optional[Path] = None,
+    corpus_index_name: str = "corpus_index",
+    word_selection: str = "random",
+    update_history: bool = True,
+) -> str:
+    """Fold all finished sessions into the SRS database and the word pair tracker, sample ngrams and word pairs from them and assemble the next practice text.
+
+       The word pairs are drawn from the pairs with the most typos and take the place of sampled ngrams.
+       Sessions in exclude, e.g. the journal of the running round, are not folded into the SRS database.
+       A word_index that is already loaded can be passed to share it, e.g. between many profiles.
+       If corpus_path is passed, the text is a passage of sentences from the corpus that contain the sampled ngrams, without word pairs.
+       With word_selection="coverage", the words are not drawn per sampled ngram, but picked to cover as many weak ngrams as possible.
+       Without update_history, the text is sampled from the SRS database and the word pair tracker as they are, e.g. for a quick first text,
+       while update_practice_history runs later.
+    """
+    assert word_selection in ("random", "coverage"), f"Unknown word selection {word_selection}."
+    # imported here, because importing this module is on the startup path of the app
+    from utils.word_pairs import WordPairTracker
+
+    if update_history:
+        word_pair_tracker = update_practice_history(
+            data_dir=data_dir,
+            srs_database_name=srs_database_name,
+            word_pair_tracker_name=word_pair_tracker_name,
+            exclude=exclude,
+            num_workers=num_workers,
+        )
+    elif (data_dir / word_pair_tracker_name).is_file():
+        word_pair_tracker = read_database(data_dir / word_pair_tracker_name)
+    else:
+        word_pair_tracker = WordPairTracker()
+    top_pairs = [pair for pair, _ in word_pair_tracker.top_pairs(5 * num_word_pairs)] if corpus_path is None else []
+    word_pairs = [top_pairs[i] for i in np.random.default_rng().permutation(len(top_pairs))[:num_word_pairs]]
+
+    num_sampled_ngrams = max(int(num_words_in_text*(1-exploration_percentage)) - 2*len(word_pairs), 0)
+
+    if word_index is None and corpus_path is None:
+        assert word_file_path.is_file(), f"Cannot find {word_file_path.absolute()}."
+
+        # word list and inverted index from ngrams to words, memory-mapped from a cache that is only rebuilt when the word file changes
+        word_index = load_word_index(word_file_path, data_dir / word_index_name)
+
+    sampled_ngrams = []
+    selected_words = []
+    # without ngrams in the SRS database, e.g. before the first session or after sessions without typos, the text only consists of random words
+    if (data_dir / srs_database_name).is_file():
+        srs_database = open_srs_database(data_dir / srs_database_name)
+        if srs_database_has_ngrams(srs_database):
+            if word_selection == "coverage" and corpus_path is None:
+                # imported here, because only --coverage needs the selector
+                from utils.coverage import select_coverage_words
+                selected_words = select_coverage_words(srs_database, word_index, num_sampled_ngrams)
+            elif isinstance(srs_database, SRSDataBase):
+                sampled_ngrams = sample_ngrams_from_srs_database(srs_database, num_sampled_ngrams)
+            else:
+                sampled_ngrams = srs_database.sample_ngrams(num_sampled_ngrams)
+        close_srs_database(srs_database, data_dir / srs_database_name, write=False)
+
+    if corpus_path is not None:
+        # imported here, because only --corpus needs the corpus index
+        from utils.corpus import load_corpus_source
+        # sentences and the inverted index from ngrams to sentences are memory-mapped, the index is only rebuilt when the corpus changes
+        corpus_source = load_corpus_source(corpus_path, data_dir / corpus_index_name)
+        full_text = corpus_source.assemble_text(sampled_ngrams, num_words_in_text)
+        corpus_source.close()
+        return full_text
+
+    return assemble_text(sampled_ngrams, word_index, num_words_in_text - 2*len(word_pairs), word_pairs=word_pairs, selected_words=selected_words)
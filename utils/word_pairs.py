@@ -0,0 +1,174 @@
+import pickle
+import hashlib
+import numpy as np
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from utils.data import ColumnarSessionDatabase, SessionDatabase, read_database
+from utils.archive import read_session
+from utils.journal import unprocessed_session_paths
+
+# separates the two words of a pair, words never contain spaces
+PAIR_SEPARATOR = " "
+
+
+def pair_hashes(pairs: List[str]) -> np.ndarray:
+    """64 bit hashes of the pairs that are stable across processes, unlike hash()."""
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(pair.encode("utf-8"), digest_size=8).digest(), "little") for pair in pairs],
+        dtype=np.uint64,
+    )
+
+
+@dataclass
+class CountMinSketch:
+    """Approximate counts of arbitrarily many keys in depth rows of width counters.
+
+       Estimates are never too small and are too large by at most e/width times the total count with probability 1 - exp(-depth).
+    """
+    width: int = 2**16
+    depth: int = 4
+    table: np.ndarray = None
+    total: int = 0
+
+    def __post_init__(self) -> None:
+        if self.table is None:
+            self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        assert self.table.shape == (self.depth, self.width)
+
+    def columns(self, hashes: np.ndarray) -> np.ndarray:
+        """Column of every hash in every row, from two independent halves of the hash (double hashing)."""
+        lower = hashes & np.uint64(0xFFFFFFFF)
+        upper = (hashes >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((lower[None, :] + rows * upper[None, :]) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, hashes: np.ndarray, counts: np.ndarray) -> None:
+        columns = self.columns(hashes)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        columns = self.columns(hashes)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+
+@dataclass
+class WordPairTracker:
+    """Approximate number of typos in every pair of consecutive words, in fixed memory.
+
+       All pairs are counted in a CountMinSketch, and the num_heavy_hitters pairs with the highest estimates are kept with their estimate.
+       Only the heavy hitters are stored as strings, and sessions are added in chronological order, so instead of all session names
+       only the name of the latest one is kept. This way, the memory does not grow with the number of sessions.
+    """
+    sketch: CountMinSketch = field(default_factory=CountMinSketch)
+    num_heavy_hitters: int = 100
+    heavy_hitters: Dict[str, int] = field(default_factory=dict)
+    # session names start with their date, so every session up to this name is in the tracker
+    last_session: str = ""
+
+    def __setstate__(self, state: dict) -> None:
+        """Trackers pickled before the high-water mark store the set of all session names."""
+        sessions = state.pop("sessions", None)
+        if sessions is not None:
+            state["last_session"] = max(sessions, default="")
+        self.__dict__.update(state)
+
+    def has_session(self, session_name: str) -> bool:
+        return session_name <= self.last_session
+
+    def add_pair_counts(self, pairs: List[str], counts: np.ndarray) -> None:
+        if len(pairs) == 0:
+            return
+        hashes = pair_hashes(pairs)
+        self.sketch.add(hashes, counts)
+
+        # estimates of heavy hitters that are not in the pairs do not change, so only the pairs have to be estimated again
+        self.heavy_hitters.update(zip(pairs, self.sketch.estimate(hashes).tolist()))
+        if len(self.heavy_hitters) > self.num_heavy_hitters:
+            top_pairs = sorted(self.heavy_hitters.items(), key=lambda item: item[1], reverse=True)[:self.num_heavy_hitters]
+            self.heavy_hitters = dict(top_pairs)
+
+    def top_pairs(self, num_pairs: int) -> List[Tuple[Tuple[str, str], int]]:
+        """The num_pairs pairs with the most typos, with their estimated number of typos."""
+        top_pairs = sorted(self.heavy_hitters.items(), key=lambda item: item[1], reverse=True)[:num_pairs]
+        return [(tuple(pair.split(PAIR_SEPARATOR)), count) for pair, count in top_pairs]
+
+
+def session_word_pair_typos(database: Union[SessionDatabase, ColumnarSessionDatabase]) -> Tuple[List[str], np.ndarray]:
+    """Pairs of consecutive words in the session, where the second word was typed with at least one typo, and how often.
+
+       The space after a word belongs to the word, so a typo between two words counts for the pair ending in the first one.
+       Consecutive entries with the same word belong to the same occurrence of the word.
+    """
+    if isinstance(database, SessionDatabase):
+        database = ColumnarSessionDatabase.from_session_database(database)
+    if len(database) == 0:
+        return [], np.zeros(0, dtype=np.int64)
+
+    word_codes = database.word_codes.astype(np.int64)
+    is_new_word = np.concatenate([[True], word_codes[1:] != word_codes[:-1]])
+    occurrence_ids = np.cumsum(is_new_word) - 1
+    occurrence_words = word_codes[is_new_word]
+    occurrence_typos = np.bincount(occurrence_ids, weights=(~database.correct).astype(np.float64), minlength=len(occurrence_words)) > 0
+
+    # pair of every occurrence with the one in front of it
+    has_typo = occurrence_typos[1:]
+    first_words = occurrence_words[:-1][has_typo]
+    second_words = occurrence_words[1:][has_typo]
+    num_words = len(database.word_values)
+    pair_codes, counts = np.unique(first_words * num_words + second_words, return_counts=True)
+
+    pairs = [
+        f"{database.word_values[first_word]}{PAIR_SEPARATOR}{database.word_values[second_word]}"
+        for first_word, second_word in zip(*np.divmod(pair_codes, num_words))
+    ]
+    return pairs, counts.astype(np.int64)
+
+
+def update_word_pair_tracker(
+    tracker: WordPairTracker,
+    database: Union[SessionDatabase, ColumnarSessionDatabase],
+    session_name: str,
+) -> None:
+    if tracker.has_session(session_name):
+        print(f"[WARING] update_word_pair_tracker: Session {session_name} is not newer than the latest session in the tracker.")
+        return
+    tracker.add_pair_counts(*session_word_pair_typos(database))
+    tracker.last_session = session_name
+
+
+def write_word_pair_tracker(tracker: WordPairTracker, tracker_path: Path) -> None:
+    with open(str(tracker_path), "wb") as tracker_file:
+        pickle.dump(tracker, tracker_file)
+
+
+def backfill_word_pair_tracker(
+    data_dir: Path = Path("data"),
+    tracker_name: str = "word_pair_tracker.pkl",
+    exclude: Optional[List[Path]] = None,
+    max_sessions: Optional[int] = None,
+) -> Optional[WordPairTracker]:
+    """Update the WordPairTracker in data_dir with every session it does not contain yet, and return it.
+
+       Sessions in exclude, e.g. the journal of a running session, are skipped.
+       If there are more than max_sessions new sessions, none of them is processed and None is returned.
+    """
+    tracker_path = data_dir / tracker_name
+    tracker = read_database(tracker_path) if tracker_path.is_file() else WordPairTracker()
+
+    session_database_paths = unprocessed_session_paths(data_dir, is_processed=tracker.has_session, exclude=exclude)
+    if len(session_database_paths) == 0:
+        return tracker
+    if max_sessions is not None and len(session_database_paths) > max_sessions:
+        return None
+
+    for session_database_path in session_database_paths:
+        update_word_pair_tracker(tracker, read_session(session_database_path), session_name=session_database_path.name)
+
+    write_word_pair_tracker(tracker, tracker_path)
+
+    return tracker
@@ -1,22 +1,64 @@
+from time import perf_counter
+from bisect import bisect_right
+from typing import Callable, List, Optional
+
 from rich import box
 from rich.align import Align
 from rich.panel import Panel
 from rich.console import RenderableType
+from rich.text import Text
 
 from textual.widget import Widget
 
+from widgets.scheduler import FrameScheduler
+from widgets.styled_text import StyledText, wrap_text
+
+
+class ScheduledWidget(Widget):
+    """Widget that leaves its refreshes to a FrameScheduler, if it has one, and refreshes immediately otherwise."""
+
+    scheduler: Optional[FrameScheduler] = None
+
+    def request_refresh(self) -> None:
+        if self.scheduler is None:
+            self.refresh()
+        else:
+            self.scheduler.mark_dirty(self)
+
+
+class TextBox(ScheduledWidget):
+    """Panel with the practice text.
+
+       In viewport mode, a StyledText is wrapped into lines once per text and width, and only the lines around the cursor are rendered,
+       so the cost of a refresh does not depend on the length of the text. The cursor stays on the line at a third of the height.
+    """
 
-class TextBox(Widget):
     def __init__(
         self,
         renderable: RenderableType,
         name: str | None = None,
+        viewport: bool = False,
     ) -> None:
         super().__init__(name)
         self.renderable = renderable
+        self.viewport = viewport
+        # Offsets of the starts and ends of the wrapped lines, and the text and the width they were wrapped for
+        self.line_starts: List[int] = []
+        self.line_ends: List[int] = []
+        self.wrapped_text: Optional[str] = None
+        self.wrapped_width = 0
+        # perf_counter() when the text was rendered for the first time, to measure the startup time
+        self.first_render_time: Optional[float] = None
+        # Called with perf_counter() before and after the text is rendered into lines, to measure the rendering time
+        self.render_callback: Optional[Callable[[float, float], None]] = None
 
     def render(self) -> RenderableType:
         renderable = self.renderable
+        if self.viewport and isinstance(renderable, StyledText):
+            renderable = self.render_viewport(renderable)
+
+        if self.first_render_time is None:
+            self.first_render_time = perf_counter()
 
         return Panel(
             Align.center(renderable),
@@ -25,12 +67,46 @@ class TextBox(Widget):
             box=box.ROUNDED,
         )
 
+    def render_viewport(self, styled_text: StyledText) -> RenderableType:
+        """Lines of styled_text that fit into the panel, around the cursor."""
+        # the panel takes two rows for its border, and two columns for its border and two for its padding
+        width = self.size.width - 4
+        height = self.size.height - 2
+        if width <= 0 or height <= 0:
+            # not laid out yet
+            return styled_text
+
+        if styled_text.text is not self.wrapped_text or width != self.wrapped_width:
+            self.line_starts = wrap_text(styled_text.text, width)
+            self.line_ends = self.line_starts[1:] + [len(styled_text.text)]
+            self.wrapped_text = styled_text.text
+            self.wrapped_width = width
+
+        cursor_line = bisect_right(self.line_starts, styled_text.location) - 1
+        first_line = max(min(cursor_line - height // 3, len(self.line_starts) - height), 0)
+        lines = [
+            styled_text.slice(self.line_starts[line], self.line_ends[line])
+            for line in range(first_line, min(first_line + height, len(self.line_starts)))
+        ]
+
+        # the lines are wrapped already, so rich must not wrap them again
+        return Text("\n", no_wrap=True).join(lines)
+
+    def render_lines(self) -> None:
+        if self.render_callback is None:
+            super().render_lines()
+            return
+
+        start = perf_counter()
+        super().render_lines()
+        self.render_callback(start, perf_counter())
+
     async def update(self, renderable: RenderableType) -> None:
         self.renderable = renderable
-        self.refresh()
+        self.request_refresh()
 
 
-class InfoBox(Widget):
+class InfoBox(ScheduledWidget):
     def __init__(
         self,
         name: str | None = None,
@@ -50,13 +126,17 @@ class InfoBox(Widget):
         )
 
     async def update(self, accuracy: RenderableType, speed: RenderableType, progress: RenderableType) -> None:
+        self.set_values(accuracy, speed, progress)
+        self.request_refresh()
+
+    def set_values(self, accuracy: RenderableType, speed: RenderableType, progress: RenderableType) -> None:
+        """Change the values without a refresh, e.g. right before a frame that refreshes the box anyway."""
         self.progress = progress
         self.speed = speed
         self.accuracy = accuracy
-        self.refresh()
 
 
-class GutterBox(Widget):
+class GutterBox(ScheduledWidget):
     def __init__(
         self,
         name: str | None = None,
@@ -75,4 +155,4 @@ class GutterBox(Widget):
 
     async def update(self, renderable: RenderableType) -> None:
         self.renderable = renderable
-        self.refresh()
+        self.request_refresh()
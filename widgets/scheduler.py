@@ -0,0 +1,65 @@
+import asyncio
+
+from time import monotonic, perf_counter
+from typing import Callable, Dict, Optional
+
+from textual.widget import Widget
+
+
+class FrameScheduler:
+    """Coalesces the refreshes of widgets into frames, at most one frame every frame_interval seconds.
+
+       Widgets are only marked dirty when their content changes. The frame is scheduled on the event loop, after the key events
+       that are already queued, so a burst of keys is handled completely before the dirty widgets are refreshed once.
+       before_frame is called at the start of every frame, e.g. to format values that are only shown once per frame.
+    """
+
+    def __init__(
+        self,
+        frame_interval: float = 1 / 60,
+        before_frame: Optional[Callable[[], None]] = None,
+        clock: Callable[[], float] = monotonic,
+    ) -> None:
+        self.frame_interval = frame_interval
+        self.before_frame = before_frame
+        self.clock = clock
+        # dict instead of set, so widgets are refreshed in the order they were marked
+        self.dirty_widgets: Dict[Widget, None] = {}
+        self.frame_handle: Optional[asyncio.TimerHandle] = None
+        self.last_frame_time = -float("inf")
+        self.num_frames = 0
+        # Called with perf_counter() before and after every frame, to measure the frame time
+        self.frame_callback: Optional[Callable[[float, float], None]] = None
+
+    def mark_dirty(self, widget: Widget) -> None:
+        self.dirty_widgets[widget] = None
+        if self.frame_handle is None:
+            delay = max(self.last_frame_time + self.frame_interval - self.clock(), 0.0)
+            self.frame_handle = asyncio.get_running_loop().call_later(delay, self.render_frame)
+
+    def render_frame(self) -> None:
+        """Refresh all dirty widgets now."""
+        start = perf_counter()
+        if self.frame_handle is not None:
+            self.frame_handle.cancel()
+            self.frame_handle = None
+
+        if self.before_frame is not None:
+            self.before_frame()
+
+        dirty_widgets = self.dirty_widgets
+        self.dirty_widgets = {}
+        for widget in dirty_widgets:
+            widget.refresh()
+
+        self.last_frame_time = self.clock()
+        self.num_frames += 1
+        if self.frame_callback is not None:
+            self.frame_callback(start, perf_counter())
+
+    def cancel(self) -> None:
+        """Drop the pending frame, e.g. when the app shuts down."""
+        if self.frame_handle is not None:
+            self.frame_handle.cancel()
+            self.frame_handle = None
+        self.dirty_widgets = {}
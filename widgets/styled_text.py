@@ -0,0 +1,92 @@
+import re
+
+from bisect import bisect_right
+from operator import attrgetter
+from typing import List, Optional
+
+from rich.text import Span, Text
+
+
+def wrap_text(text: str, width: int) -> List[int]:
+    """Offsets at which the lines start, when text is wrapped at whitespace into lines of at most width characters.
+
+       The whitespace after a word stays on its line and counts towards the width, so a cursor on it is never cropped.
+       Words that are longer than width are split.
+    """
+    assert width > 0, "The width has to be positive."
+    line_starts = [0]
+    line_length = 0
+    for match in re.finditer(r"\S*\s*", text):
+        word_length = match.end() - match.start()
+        if line_length > 0 and line_length + word_length > width:
+            line_starts.append(match.start())
+            line_length = 0
+        line_length += word_length
+        while line_length > width:
+            line_starts.append(line_starts[-1] + width)
+            line_length -= width
+    return line_starts
+
+
+class StyledText:
+    """Text with a styled prefix of already typed characters and a cursor on the next character.
+
+       The styles of the prefix are kept as runs of equally styled characters.
+       Typing and deleting only change the last run, so their cost does not depend on the length of the text,
+       and rendering creates a rich Text from the spans without parsing any markup.
+    """
+
+    def __init__(self, text: str, cursor_style: str = "black on white") -> None:
+        self.text = text
+        self.characters = list(text)
+        self.cursor_style = cursor_style
+        # Location of the cursor, equal to the length of the styled prefix
+        self.location = 0
+        self.spans: List[Span] = []
+
+    def push(self, style: str, character: Optional[str] = None) -> None:
+        """Style the character under the cursor, optionally display it as another character, and advance the cursor."""
+        if character is not None:
+            self.characters[self.location] = character
+
+        if len(self.spans) > 0 and self.spans[-1].style == style:
+            self.spans[-1] = Span(self.spans[-1].start, self.location + 1, style)
+        else:
+            self.spans.append(Span(self.location, self.location + 1, style))
+
+        self.location += 1
+
+    def pop(self) -> None:
+        """Move the cursor back by one character and remove its style."""
+        if self.location == 0:
+            return
+
+        self.location -= 1
+        self.characters[self.location] = self.text[self.location]
+
+        last_span = self.spans.pop()
+        if last_span.end - last_span.start > 1:
+            self.spans.append(Span(last_span.start, last_span.end - 1, last_span.style))
+
+    def slice(self, start: int, end: int) -> Text:
+        """Text of the characters from start to end, with their styles and the cursor, if it is in the slice.
+
+           The spans are found with a binary search, so the cost depends on the length of the slice, not of the text.
+        """
+        first_span = bisect_right(self.spans, start, key=attrgetter("end"))
+        spans = []
+        for span in self.spans[first_span:]:
+            if span.start >= end:
+                break
+            spans.append(Span(max(span.start, start) - start, min(span.end, end) - start, span.style))
+        if start <= self.location < min(end, len(self.text)):
+            spans.append(Span(self.location - start, self.location - start + 1, self.cursor_style))
+
+        return Text("".join(self.characters[start:end]), spans=spans)
+
+    def __rich__(self) -> Text:
+        spans = list(self.spans)
+        if self.location < len(self.text):
+            spans.append(Span(self.location, self.location + 1, self.cursor_style))
+
+        return Text("".join(self.characters), spans=spans)